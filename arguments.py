@@ -4,6 +4,12 @@ _parser = argparse.ArgumentParser()
 _parser.add_argument("-v", "--ydl-verbose", action="store_true", help="enables verbose yt-dlp logs")
 _parser.add_argument("-l", "--logfile", default="/tmp/meu-chapeu/meu-chapeu.log", help="specify log file path")
 _parser.add_argument("--env", default=".env", help="use specified env file")
+_parser.add_argument("--log-max-size", type=int, default=50, help="rotate the log file after it reaches this many MiB")
+_parser.add_argument("--log-max-age", type=float, default=24, help="rotate the log file after this many hours")
+_parser.add_argument("--log-backups", type=int, default=5, help="number of rotated log files to keep")
+_parser.add_argument("--log-rate-limit", type=float, default=10, help="maximum lines per second for each category of high-volume log lines")
 _parser.add_argument("--log-heartbeats", action="store_true", help="enables logging of outgoing heartbeats and incoming heartbeat acks")
 
+_parser.add_argument("--record-gateway", metavar="DIR", help="record frames received from the gateway to a capture file in DIR, for replay benchmarks (captures contain interaction tokens)")
+
 args = _parser.parse_args()
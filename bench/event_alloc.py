@@ -0,0 +1,211 @@
+# Measures what the receive paths of Client and VoiceClient allocate and cost per event, for the mix a bot in large
+# guilds gets: voice state updates that are nearly all about other users, and speaking and client notices on the voice
+# connection. Run from the repository root:
+#   python -m bench.event_alloc --events 20000
+import argparse
+import sys
+
+_parser = argparse.ArgumentParser()
+_parser.add_argument("--events", type=int, default=20000, help="events fed to each receive path")
+_parser.add_argument("--own-share", type=float, default=0.01, help="share of the voice state updates that are about the bot itself")
+_parser.add_argument("--no-logs", action="store_true", help="disable logging, to tell its share of the cost")
+_parser.add_argument("--output", help="write the results to this JSON file")
+_parser.add_argument("--baseline", help="JSON results of an earlier run, exits with status 1 if this run is worse by more than --tolerance")
+_parser.add_argument("--tolerance", type=float, default=0.1)
+_parser.add_argument("--logfile", default="/tmp/meu-chapeu/event-alloc.log")
+_bench_args = _parser.parse_args()
+
+# The bot's modules parse the command line when imported
+sys.argv = [sys.argv[0], "--logfile", _bench_args.logfile]
+
+import array
+import asyncio
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Dict, List
+
+os.environ.setdefault("APPLICATION_ID", "0")
+
+from client import Client
+from config import Config
+from event import Event
+from guild_resources import GuildRegistry
+from http_client import HttpClient
+from intents import Intent
+from logs import logger as base_logger
+from sharding import IdentifyLimiter
+from timing import PhaseTimer
+from title_index import TitleIndex
+from track_index import TrackIndex
+from voice_client import VoiceClient
+from voice_event import VoiceEvent
+
+_DISPATCH = 0
+_SPEAKING = 5
+_CLIENTS_CONNECT = 11
+_CLIENTS_DISCONNECT = 13
+
+
+def _gateway_frames(events: int, own_share: float) -> List[str]:
+    own_every = max(1, round(1 / own_share)) if own_share > 0 else 0
+    frames = []
+    for i in range(events):
+        guild_id = str((i % 500) << 22)
+        data: Dict[str, Any] | None
+        if own_every and i % own_every == 0:
+            user_id, name, data = os.environ["APPLICATION_ID"], "VOICE_SERVER_UPDATE", None
+            if i % (2 * own_every) == 0:
+                data = {"guild_id": guild_id, "endpoint": "example.discord.media:443", "token": "secret"}
+            else:
+                name = "VOICE_STATE_UPDATE"
+        else:
+            user_id, name, data = str(10**17 + i), "VOICE_STATE_UPDATE", None
+        if data is None:
+            data = {"guild_id": guild_id, "channel_id": str(i % 7), "user_id": user_id, "session_id": f"{i:032x}",
+                    "deaf": False, "mute": False, "self_deaf": False, "self_mute": i % 2 == 0, "self_video": False,
+                    "self_stream": False, "suppress": False, "request_to_speak_timestamp": None,
+                    "member": {"user": {"id": user_id, "username": f"user{i}", "global_name": f"User {i}", "avatar": "a" * 32,
+                                        "discriminator": "0", "public_flags": 0},
+                               "roles": [str(10**17 + r) for r in range(i % 6)], "nick": None, "avatar": None,
+                               "joined_at": "2024-01-01T00:00:00.000000+00:00", "premium_since": None,
+                               "pending": False, "deaf": False, "mute": False, "flags": 0}}
+        frames.append(json.dumps({"op": _DISPATCH, "s": i + 1, "t": name, "d": data}))
+    return frames
+
+
+def _voice_frames(events: int) -> List[str]:
+    frames = []
+    for i in range(events):
+        user_id = str(10**17 + i % 50)
+        match i % 4:
+            case 0 | 1:
+                op, data = _SPEAKING, {"user_id": user_id, "ssrc": 100 + i % 50, "speaking": i % 2}
+            case 2:
+                op, data = _CLIENTS_CONNECT, {"user_ids": [user_id]}
+            case _:
+                op, data = _CLIENTS_DISCONNECT, {"user_id": user_id}
+        frames.append(json.dumps({"op": op, "seq": i + 1, "d": data}))
+    return frames
+
+
+# Stands in for the websocket of the client under test. Every recv first lets the tasks of the previous event run,
+# then, while tracing, records how far traced memory rose above where it was before that event
+class _Frames:
+    _frames: List[str]
+    _next: int
+    _traced_since: int
+    peaks: array.array  # allocated up front, so recording doesn't show up as retained memory
+    done: asyncio.Event
+
+    def __init__(self, frames: List[str]) -> None:
+        self._frames = frames
+        self._next = 0
+        self._traced_since = 0
+        self.peaks = array.array("q", bytes(8 * len(frames)))
+        self.done = asyncio.Event()
+
+    async def recv(self) -> str:
+        await asyncio.sleep(0)
+        if tracemalloc.is_tracing():
+            if self._next > 0:
+                self.peaks[self._next - 1] = tracemalloc.get_traced_memory()[1] - self._traced_since
+            tracemalloc.reset_peak()
+            self._traced_since = tracemalloc.get_traced_memory()[0]
+        if self._next == len(self._frames):
+            self.done.set()
+            await asyncio.Future()  # until the receive loop is cancelled
+        self._next += 1
+        return self._frames[self._next - 1]
+
+
+async def _feed(receive_loop: Callable[[], Coroutine[Any, Any, None]], frames: _Frames) -> None:
+    running = asyncio.create_task(receive_loop())
+    await frames.done.wait()
+    await asyncio.sleep(0)
+    running.cancel()
+    await asyncio.gather(running, return_exceptions=True)
+
+
+async def _no_op() -> None:
+    pass
+
+
+def _client(config: Config) -> Client:
+    return Client(HttpClient(config), Intent.GUILD_VOICE_STATES, config, "ws://127.0.0.1", (0, 1), IdentifyLimiter(1),
+                  lambda guild_id: None, GuildRegistry(config.voice_join_phase_timeout), TitleIndex(),
+                  TrackIndex(Path(":memory:"), config.local_search_min_coverage))
+
+
+def _voice_client(config: Config) -> VoiceClient:
+    return VoiceClient("0", "0", "ws://127.0.0.1", "session", "token", _no_op, config, PhaseTimer())
+
+
+# Runs the frames through a fresh client twice: timed, then traced. Retained is what is still allocated after the
+# traced run and a collection, which grows if anything keeps events or parts of them alive.
+async def _measure(make_client: Callable[[Config], Any], frames: List[str], parse: Callable[[str], Any]) -> Dict[str, float]:
+    config = Config()
+    timed, traced = _Frames(frames), _Frames(frames)
+
+    client = make_client(config)
+    client._ws = timed
+    started = time.perf_counter()
+    await _feed(client._receive_loop, timed)
+    elapsed = time.perf_counter() - started
+
+    client = make_client(config)
+    client._ws = traced
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await _feed(client._receive_loop, traced)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    peaks = sorted(traced.peaks)
+    return {"us_per_event": elapsed / len(frames) * 1e6,
+            "transient_bytes_mean": sum(peaks) / len(peaks),
+            "transient_bytes_p99": peaks[min(len(peaks) - 1, int(len(peaks) * 0.99))],
+            "retained_bytes_per_event": retained / len(frames),
+            "event_object_bytes": _object_bytes(parse(frames[-1]))}
+
+
+# Without __slots__, an object's attributes live in a dictionary of their own
+def _object_bytes(obj: Any) -> int:
+    return sys.getsizeof(obj) + (sys.getsizeof(obj.__dict__) if hasattr(obj, "__dict__") else 0)
+
+
+def _regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str]:
+    regressions = []
+    for path, measurements in results.items():
+        for key, value in measurements.items():
+            reference = baseline.get(path, {}).get(key)
+            if reference is not None and value > reference * (1 + _bench_args.tolerance) + 1:
+                regressions.append(f"{path} {key} {value:.1f}, baseline {reference:.1f}")
+    return regressions
+
+
+async def main() -> int:
+    if _bench_args.no_logs:
+        base_logger.remove()
+    results = {"gateway": await _measure(_client, _gateway_frames(_bench_args.events, _bench_args.own_share), Event),
+               "voice": await _measure(_voice_client, _voice_frames(_bench_args.events), VoiceEvent)}
+    print(json.dumps(results, indent=2))
+    if _bench_args.output:
+        Path(_bench_args.output).write_text(json.dumps(results, indent=2))
+
+    if _bench_args.baseline:
+        regressions = _regressions(results, json.loads(Path(_bench_args.baseline).read_text()))
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import statistics
+import struct
+import time
+import websockets
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from dataclasses import dataclass, field
+from nacl.bindings import crypto_aead_xchacha20poly1305_ietf_decrypt
+from nacl.exceptions import CryptoError
+from typing import Any, Dict, List, Tuple
+
+_HEARTBEAT_INTERVAL = 13750  # ms
+_IP_DISCOVERY_PACKET_FORMAT = "!HHI64sH"
+_IP_DISCOVERY_PACKET_SIZE = struct.calcsize(_IP_DISCOVERY_PACKET_FORMAT)
+_RTP_HEADER_FORMAT = "!BBHII"
+_RTP_HEADER_SIZE = struct.calcsize(_RTP_HEADER_FORMAT)
+_NONCE_SIZE = 4
+_SAMPLING_RATE = 48000
+_FRAME_SAMPLES = 960
+
+# Voice gateway opcodes sent by the server
+_READY = 2
+_SESSION_DESCRIPTION = 4
+_HEARTBEAT_ACK = 6
+_HELLO = 8
+_RESUMED = 9
+
+
+# What one SSRC sent, checked the way a receiver's jitter buffer would see it
+@dataclass
+class StreamStats:
+    packets: int = 0
+    decrypt_failures: int = 0
+    lost: int = 0
+    out_of_order: int = 0
+    bad_timestamps: int = 0
+    jitter: float = 0.0  # RFC 3550 interarrival jitter, in seconds
+    max_transit_deviation: float = 0.0
+    last_seq: int | None = None
+    last_ts: int | None = None
+    last_arrival: float | None = None
+
+    def receive(self, seq: int, ts: int, arrival: float) -> None:
+        self.packets += 1
+        if self.last_seq is not None and self.last_ts is not None and self.last_arrival is not None:
+            seq_delta = (seq - self.last_seq) & 0xFFFF
+            if seq_delta == 0 or seq_delta >= 0x8000:
+                self.out_of_order += 1
+                return
+            self.lost += seq_delta - 1
+
+            ts_delta = (ts - self.last_ts) & 0xFFFFFFFF
+            if ts_delta == 0 or ts_delta % _FRAME_SAMPLES != 0:
+                self.bad_timestamps += 1
+            deviation = abs((arrival - self.last_arrival) - ts_delta / _SAMPLING_RATE)
+            self.jitter += (deviation - self.jitter) / 16
+            self.max_transit_deviation = max(self.max_transit_deviation, deviation)
+        self.last_seq, self.last_ts, self.last_arrival = seq, ts, arrival
+
+
+@dataclass
+class _Session:
+    ssrc: int
+    mode: str | None = None
+    key: bytes | None = None
+    stats: StreamStats = field(default_factory=StreamStats)
+
+
+class _UDPEndpoint(asyncio.DatagramProtocol):
+    _server: "FakeVoiceServer"
+    _transport: asyncio.DatagramTransport
+
+    def __init__(self, server: "FakeVoiceServer") -> None:
+        self._server = server
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:  # type: ignore[override]
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        arrival = time.perf_counter()
+        if len(data) == _IP_DISCOVERY_PACKET_SIZE and data[1] == 0x1:
+            (_, _, ssrc, _, _) = struct.unpack(_IP_DISCOVERY_PACKET_FORMAT, data)
+            self._transport.sendto(struct.pack(_IP_DISCOVERY_PACKET_FORMAT, 0x2, 70, ssrc, addr[0].encode(), addr[1]), addr)
+            return
+        if len(data) > _RTP_HEADER_SIZE + _NONCE_SIZE:
+            self._server.receive_rtp(data, arrival)
+
+
+# Plays Discord's part of the voice connection: gateway handshake, IP discovery, transport encryption and heartbeats.
+# DAVE is not offered, so sessions use transport encryption only.
+class FakeVoiceServer:
+    _host: str
+    _mode: str
+    _sessions: Dict[int, _Session]
+    _next_ssrc: int
+    _udp_port: int
+
+    def __init__(self, host: str, mode: str) -> None:
+        self._host = host
+        self._mode = mode
+        self._sessions = {}
+        self._next_ssrc = 1
+
+    async def start(self, ws_port: int = 0) -> Tuple[int, int]:
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _UDPEndpoint(self), local_addr=(self._host, 0))
+        self._udp_port = transport.get_extra_info("sockname")[1]
+        ws_server = await websockets.serve(self._handle_connection, self._host, ws_port)
+        ws_port = ws_server.sockets[0].getsockname()[1]
+        return ws_port, self._udp_port
+
+    def reset_stats(self) -> None:
+        for session in self._sessions.values():
+            session.stats = StreamStats()
+
+    def stats(self) -> List[StreamStats]:
+        return [session.stats for session in self._sessions.values() if session.stats.packets > 0]
+
+    def receive_rtp(self, data: bytes, arrival: float) -> None:
+        (_, _, seq, ts, ssrc) = struct.unpack_from(_RTP_HEADER_FORMAT, data)
+        session = self._sessions.get(ssrc)
+        if session is None or session.key is None:
+            return
+        if not _decrypts(session.mode, session.key, data):
+            session.stats.decrypt_failures += 1
+            return
+        session.stats.receive(seq, ts, arrival)
+
+    async def _handle_connection(self, ws: websockets.ServerConnection) -> None:
+        seq = 0
+
+        async def send(op: int, data: Any) -> None:
+            nonlocal seq
+            seq += 1
+            await ws.send(json.dumps({"op": op, "seq": seq, "d": data}))
+
+        await send(_HELLO, {"heartbeat_interval": _HEARTBEAT_INTERVAL})
+        session = None
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                op, data = message["op"], message.get("d")
+                match op:
+                    case 0:  # IDENTIFY
+                        session = _Session(self._next_ssrc)
+                        self._next_ssrc += 1
+                        self._sessions[session.ssrc] = session
+                        await send(_READY, {"ssrc": session.ssrc, "ip": self._host, "port": self._udp_port,
+                                            "modes": [self._mode], "heartbeat_interval": _HEARTBEAT_INTERVAL})
+                    case 1 if session is not None:  # SELECT_PROTOCOL
+                        session.mode = data["data"]["mode"]
+                        session.key = os.urandom(32)
+                        await send(_SESSION_DESCRIPTION, {"mode": session.mode, "secret_key": list(session.key),
+                                                          "dave_protocol_version": 0})
+                    case 3:  # HEARTBEAT
+                        await send(_HEARTBEAT_ACK, {"t": data["t"]})
+                    case 7:  # RESUME
+                        await send(_RESUMED, None)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+def _decrypts(mode: str | None, key: bytes, data: bytes) -> bool:
+    header = data[:_RTP_HEADER_SIZE]
+    ciphertext = data[_RTP_HEADER_SIZE:-_NONCE_SIZE]
+    nonce = data[-_NONCE_SIZE:]
+    try:
+        if mode == "aead_aes256_gcm_rtpsize":
+            AESGCM(key).decrypt(nonce + bytes(8), ciphertext, header)
+        else:
+            crypto_aead_xchacha20poly1305_ietf_decrypt(ciphertext, header, nonce + bytes(20), key)
+    except (InvalidTag, CryptoError):
+        return False
+    return True
+
+
+def summarize(stats: List[StreamStats]) -> Dict[str, Any]:
+    if not stats:
+        return {"streams": 0}
+    jitters = sorted(s.jitter * 1000 for s in stats)
+    received = sum(s.packets for s in stats)
+    lost = sum(s.lost for s in stats)
+    return {"streams": len(stats),
+            "packets": received,
+            "loss_percent": 100 * lost / max(1, received + lost),
+            "decrypt_failures": sum(s.decrypt_failures for s in stats),
+            "out_of_order": sum(s.out_of_order for s in stats),
+            "bad_timestamps": sum(s.bad_timestamps for s in stats),
+            "jitter_mean_ms": statistics.fmean(jitters),
+            "jitter_p99_ms": jitters[min(len(jitters) - 1, int(len(jitters) * 0.99))],
+            "max_deviation_ms": max(s.max_transit_deviation for s in stats) * 1000}
+
+
+# Entry point of the server process: reports its websocket port, then answers "reset", "stats" and "stop" commands
+def serve(conn: Any, host: str, mode: str) -> None:
+    async def main() -> None:
+        server = FakeVoiceServer(host, mode)
+        ws_port, _ = await server.start()
+        conn.send(ws_port)
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            match command:
+                case "reset":
+                    server.reset_stats()
+                    conn.send(None)
+                case "stats":
+                    conn.send(server.stats())
+                case "stop":
+                    return
+
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+# Feeds a gateway capture (see --record-gateway) back into a Client through a local websocket server, to measure what
+# bursts of gateway traffic cost. Run from the repository root:
+#   python -m bench.gateway_replay /tmp/captures/gateway-shard0-20240101-120000.rec.gz --repeat 10
+# Without a capture, a synthetic burst like the one a bot in many large guilds gets after identifying is replayed.
+import argparse
+import sys
+
+_parser = argparse.ArgumentParser()
+_parser.add_argument("capture", nargs="?", help="capture file recorded with --record-gateway")
+_parser.add_argument("--realtime", action="store_true", help="replay with the recorded timing instead of as fast as possible")
+_parser.add_argument("--repeat", type=int, default=1, help="replay the dispatches of the capture this many times in one session")
+_parser.add_argument("--synthetic-guilds", type=int, default=2000, help="guilds in the synthetic burst used without a capture")
+_parser.add_argument("--no-logs", action="store_true", help="disable logging, to tell its share of the cost")
+_parser.add_argument("--tracemalloc", action="store_true", help="report the allocation sites that grew the most (slows the replay down)")
+_parser.add_argument("--output", help="write the results to this JSON file")
+_parser.add_argument("--baseline", help="JSON results of an earlier run, exits with status 1 if this run is worse by more than --tolerance")
+_parser.add_argument("--tolerance", type=float, default=0.1)
+_parser.add_argument("--logfile", default="/tmp/meu-chapeu/gateway-replay.log")
+_bench_args = _parser.parse_args()
+
+# The bot's modules parse the command line when imported
+sys.argv = [sys.argv[0], "--logfile", _bench_args.logfile]
+
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+import tracemalloc
+import websockets
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+os.environ.setdefault("APPLICATION_ID", "0")
+
+from client import Client
+from config import Config
+from event import Event
+from gateway_recorder import read_recording
+from guild_resources import GuildRegistry
+from http_client import HttpClient
+from intents import Intent
+from logs import logger as base_logger
+from sharding import IdentifyLimiter
+from title_index import TitleIndex
+from track_index import TrackIndex
+
+logger = base_logger.bind(context="GatewayReplay")
+
+_HOST = "127.0.0.1"
+_LAG_INTERVAL = 0.005
+_DISPATCH = 0
+_HELLO = 10
+_SESSION_OPCODES = {_DISPATCH, _HELLO}  # heartbeat ACKs are answered live, reconnects and invalid sessions are left out
+
+
+# Answers REST calls locally: nobody is ever in a voice channel and every interaction response succeeds
+class _StubHttpClient(HttpClient):
+    async def get_user_voice_channel(self, guild_id: str, user_id: str) -> str | None:
+        return None
+
+    async def respond_interaction(self, interaction_event: Event, message: str, ephemeral=False, deferred=False) -> bool:
+        return True
+
+
+def _synthetic_frames(guilds: int) -> List[Tuple[float, str]]:
+    frames = [{"op": _HELLO, "d": {"heartbeat_interval": 41250}},
+              {"op": _DISPATCH, "t": "READY", "d": {"v": 10, "session_id": "replay", "resume_gateway_url": f"ws://{_HOST}",
+                                                    "user": {"id": os.environ["APPLICATION_ID"], "username": "bot"},
+                                                    "guilds": [{"id": str(guild_id << 22), "unavailable": True} for guild_id in range(guilds)]}}]
+    for guild_id in range(guilds):
+        voice_states = [{"user_id": str(user_id), "channel_id": str(guild_id * 10 + user_id % 3), "session_id": "s",
+                         "self_mute": False, "self_deaf": False, "self_video": False, "mute": False, "deaf": False}
+                        for user_id in range(guild_id % 25)]
+        frames.append({"op": _DISPATCH, "t": "GUILD_CREATE",
+                       "d": {"id": str(guild_id << 22), "name": f"Guild {guild_id}", "member_count": 1000 + guild_id,
+                             "channels": [{"id": str(guild_id * 10 + c), "type": 2, "name": f"Voice {c}"} for c in range(8)],
+                             "voice_states": voice_states}})
+    for i in range(guilds * 5):
+        guild_id = i % guilds
+        frames.append({"op": _DISPATCH, "t": "VOICE_STATE_UPDATE",
+                       "d": {"guild_id": str(guild_id << 22), "channel_id": str(guild_id * 10), "user_id": str(i),
+                             "session_id": "s", "self_mute": i % 2 == 0, "self_deaf": False, "self_stream": False,
+                             "member": {"user": {"id": str(i), "username": f"user{i}"}, "roles": [], "nick": None}}})
+    return [(i * 0.0005, json.dumps(frame)) for i, frame in enumerate(frames)]
+
+
+# Keeps the session opening once and renumbers the dispatches of every repetition, so the client sees one session
+def _session_frames(frames: List[Tuple[float, str]], repeat: int) -> List[Tuple[float, str]]:
+    parsed = [(elapsed, json.loads(frame)) for elapsed, frame in frames]
+    parsed = [(elapsed, frame) for elapsed, frame in parsed if frame["op"] in _SESSION_OPCODES]
+    duration = parsed[-1][0] if parsed else 0.0
+    session: List[Tuple[float, str]] = []
+    seq = 0
+    for repetition in range(repeat):
+        for elapsed, frame in parsed:
+            if repetition > 0 and (frame["op"] == _HELLO or frame.get("t") == "READY"):
+                continue
+            if frame["op"] == _DISPATCH:
+                seq += 1
+                frame = dict(frame, s=seq)
+            session.append((repetition * duration + elapsed, json.dumps(frame)))
+    return session
+
+
+# Runs in its own process, so sending doesn't take CPU time from the client being measured
+def _serve(conn: Any, frames: List[Tuple[float, str]], realtime: bool) -> None:
+    async def handle(ws: websockets.ServerConnection) -> None:
+        async def answer_heartbeats() -> None:
+            async for message in ws:
+                if json.loads(message)["op"] == 1:
+                    await ws.send(json.dumps({"op": 11, "d": None}))
+
+        answering = asyncio.create_task(answer_heartbeats())
+        started = time.perf_counter()
+        try:
+            for elapsed, frame in frames:
+                if realtime and (delay := started + elapsed - time.perf_counter()) > 0:
+                    await asyncio.sleep(delay)
+                await ws.send(frame)
+            await answering
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def main() -> None:
+        async with websockets.serve(handle, _HOST, 0, max_size=None) as server:
+            conn.send(server.sockets[0].getsockname()[1])
+            await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+
+    asyncio.run(main())
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def _monitor_lag(samples: List[float]) -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(_LAG_INTERVAL)
+        samples.append(time.perf_counter() - started - _LAG_INTERVAL)
+
+
+def _pending_dispatches() -> int:
+    return sum(1 for task in asyncio.all_tasks() if getattr(task.get_coro(), "__qualname__", None) == "Client._handle_dispatch")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def _replay(config: Config, ws_port: int, last_seq: int) -> Dict[str, Any]:
+    client = Client(_StubHttpClient(config), Intent.GUILD_VOICE_STATES, config, f"ws://{_HOST}:{ws_port}", (0, 1),
+                    IdentifyLimiter(1), lambda guild_id: None, GuildRegistry(config.voice_join_phase_timeout), TitleIndex(),
+                    TrackIndex(Path(":memory:"), config.local_search_min_coverage))
+    lag: List[float] = []
+    monitor = asyncio.create_task(_monitor_lag(lag))
+    rss_started = _rss()
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    running = asyncio.create_task(client.start())
+    while client._last_seq != last_seq or _pending_dispatches():
+        if running.done():
+            raise RuntimeError("Client stopped before the replay finished")
+        await asyncio.sleep(0.001)
+    wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+    rss_finished = _rss()
+
+    running.cancel()
+    monitor.cancel()
+    await asyncio.gather(running, monitor, return_exceptions=True)
+    return {"wall_s": wall,
+            "cpu_s": cpu,
+            "dispatches_per_s": last_seq / wall,
+            "cpu_us_per_dispatch": cpu / last_seq * 1e6,
+            "loop_lag_mean_ms": statistics.fmean(lag) * 1000 if lag else 0.0,
+            "loop_lag_p99_ms": _percentile(lag, 0.99) * 1000,
+            "loop_lag_max_ms": max(lag, default=0.0) * 1000,
+            "rss_growth_mib": (rss_finished - rss_started) / 2**20,
+            "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def _parse_cost(frames: List[Tuple[float, str]]) -> float:
+    started = time.perf_counter()
+    for _, frame in frames:
+        Event(frame)
+    return (time.perf_counter() - started) / len(frames) * 1e6
+
+
+def _regressions(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    tolerance = _bench_args.tolerance
+    regressions = []
+    if results["dispatches_per_s"] < baseline["dispatches_per_s"] * (1 - tolerance):
+        regressions.append(f"throughput {results['dispatches_per_s']:.0f}/s, baseline {baseline['dispatches_per_s']:.0f}/s")
+    for key in ("cpu_us_per_dispatch", "event_parse_us", "loop_lag_p99_ms", "rss_growth_mib"):
+        if results[key] > baseline[key] * (1 + tolerance) + (0.5 if key == "rss_growth_mib" else 0):
+            regressions.append(f"{key} {results[key]:.2f}, baseline {baseline[key]:.2f}")
+    return regressions
+
+
+async def main() -> int:
+    if _bench_args.no_logs:
+        base_logger.remove()
+    frames = list(read_recording(Path(_bench_args.capture))) if _bench_args.capture else _synthetic_frames(_bench_args.synthetic_guilds)
+    frames = _session_frames(frames, _bench_args.repeat)
+    last_seq = sum(1 for _, frame in frames if json.loads(frame)["op"] == _DISPATCH)
+    if last_seq == 0:
+        print("The capture has no dispatches to replay")
+        return 1
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.get_context("fork").Process(target=_serve, args=(child_conn, frames, _bench_args.realtime), daemon=True)
+    server.start()
+    ws_port = conn.recv()
+
+    if _bench_args.tracemalloc:
+        tracemalloc.start(10)
+        snapshot = tracemalloc.take_snapshot()
+    results = await _replay(Config(), ws_port, last_seq)
+    if _bench_args.tracemalloc:
+        growth = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        tracemalloc.stop()
+        print("Top allocation growth:")
+        for stat in growth[:10]:
+            print(f"  {stat}")
+    conn.send("stop")
+    server.join()
+
+    results["dispatches"] = last_seq
+    results["bytes"] = sum(len(frame) for _, frame in frames)
+    results["event_parse_us"] = _parse_cost(frames)
+    print(json.dumps(results, indent=2))
+    if _bench_args.output:
+        Path(_bench_args.output).write_text(json.dumps(results, indent=2))
+
+    if _bench_args.baseline:
+        regressions = _regressions(results, json.loads(Path(_bench_args.baseline).read_text()))
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
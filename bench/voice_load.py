@@ -0,0 +1,131 @@
+# Drives concurrent voice streams against a local stand-in for Discord's voice servers, to measure how many guilds
+# one process can serve. Run from the repository root:
+#   python -m bench.voice_load --streams 10 25 50 100 --duration 30
+import argparse
+import sys
+
+_parser = argparse.ArgumentParser()
+_parser.add_argument("--streams", type=int, nargs="+", default=[1, 10, 25, 50], help="concurrent stream counts to try, in order")
+_parser.add_argument("--duration", type=float, default=20, help="seconds measured at each stream count")
+_parser.add_argument("--warmup", type=float, default=5, help="seconds streams run before measuring starts")
+_parser.add_argument("--media", help="media file to stream, a synthetic tone is generated if omitted")
+_parser.add_argument("--mode", default="aead_aes256_gcm_rtpsize", choices=["aead_aes256_gcm_rtpsize", "aead_xchacha20_poly1305_rtpsize"])
+_parser.add_argument("--reencode", action="store_true", help="decode and encode with libopus instead of passing Opus packets through")
+_parser.add_argument("--max-jitter", type=float, default=5, help="highest acceptable p99 of per-stream jitter, in ms")
+_parser.add_argument("--max-loss", type=float, default=0.1, help="highest acceptable packet loss, in percent")
+_parser.add_argument("--logfile", default="/tmp/meu-chapeu/voice-load.log")
+_bench_args = _parser.parse_args()
+
+# The bot's modules parse the command line when imported
+sys.argv = [sys.argv[0], "--logfile", _bench_args.logfile]
+
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import time
+
+from bench.fake_voice_server import serve, summarize
+from pathlib import Path
+from typing import Any, Dict, List
+
+os.environ.setdefault("APPLICATION_ID", "0")
+os.environ["OPUS_PASSTHROUGH"] = "false" if _bench_args.reencode else "true"
+os.environ["IDLE_TIMEOUT"] = "3600"
+
+from config import Config
+from logs import logger as base_logger
+from media_file import MediaFile
+from timing import PhaseTimer
+from voice_client import VoiceClient
+
+logger = base_logger.bind(context="VoiceLoad")
+
+_HOST = "127.0.0.1"
+
+
+def _synthetic_media(directory: Path, duration: float) -> Path:
+    path = directory / "tone.webm"
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                    "-ac", "2", "-ar", "48000", "-c:a", "libopus", "-b:a", "128k", str(path)], check=True)
+    return path
+
+
+async def _no_op() -> None:
+    pass
+
+
+async def _run_stage(config: Config, conn: Any, ws_port: int, media_path: Path, streams: int, stage: int) -> Dict[str, Any]:
+    clients = [VoiceClient(f"{stage}-{i}", "0", f"ws://{_HOST}:{ws_port}", "session", "token", _no_op, config, PhaseTimer())
+               for i in range(streams)]
+    tasks = [asyncio.create_task(client.start()) for client in clients]
+    media_duration = int(_bench_args.warmup + _bench_args.duration) + 60
+    for i, client in enumerate(clients):
+        await client.enqueue_media(MediaFile(id=str(i), file_path=media_path, title="load test", thumbnail="",
+                                             duration=media_duration, link="", download_fn=lambda: True))
+
+    await asyncio.sleep(_bench_args.warmup)
+    conn.send("reset")
+    conn.recv()
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    await asyncio.sleep(_bench_args.duration)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    conn.send("stats")
+    stats = conn.recv()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    result = summarize(stats)
+    result["cpu_percent"] = 100 * cpu / wall
+    result["cpu_percent_per_stream"] = result["cpu_percent"] / streams
+    result["jitter_ms"] = sorted(round(s.jitter * 1000, 2) for s in stats)
+    return result
+
+
+def _sustainable(result: Dict[str, Any], streams: int) -> bool:
+    return (result["streams"] == streams
+            and result["decrypt_failures"] == 0
+            and result["loss_percent"] <= _bench_args.max_loss
+            and result["jitter_p99_ms"] <= _bench_args.max_jitter)
+
+
+async def main() -> None:
+    config = Config()
+    conn, child_conn = multiprocessing.Pipe()
+    # A separate process, so receiving and decrypting doesn't count against the CPU time of the streams
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(child_conn, _HOST, _bench_args.mode), daemon=True)
+    server.start()
+    ws_port = conn.recv()
+
+    with tempfile.TemporaryDirectory() as directory:
+        media_path = Path(_bench_args.media) if _bench_args.media else _synthetic_media(Path(directory), _bench_args.warmup + _bench_args.duration + 60)
+        sustainable = 0
+        results: List[str] = []
+        for stage, streams in enumerate(_bench_args.streams):
+            result = await _run_stage(config, conn, ws_port, media_path, streams, stage)
+            ok = _sustainable(result, streams)
+            line = (f"{streams} streams: {'ok' if ok else 'FAILED'}, received from {result['streams']}, "
+                    f"loss {result.get('loss_percent', 100):.3f} %, decrypt failures {result.get('decrypt_failures', 0)}, "
+                    f"bad timestamps {result.get('bad_timestamps', 0)}, out of order {result.get('out_of_order', 0)}, "
+                    f"jitter mean {result.get('jitter_mean_ms', 0):.2f} ms, p99 {result.get('jitter_p99_ms', 0):.2f} ms, "
+                    f"max deviation {result.get('max_deviation_ms', 0):.2f} ms, "
+                    f"CPU {result['cpu_percent']:.1f} % ({result['cpu_percent_per_stream']:.2f} % per stream)")
+            logger.info(line)
+            logger.info(f"{streams} streams, per-stream jitter (ms): {result['jitter_ms']}")
+            results.append(line)
+            if not ok:
+                break
+            sustainable = streams
+
+    conn.send("stop")
+    server.join()
+    print("\n".join(results))
+    print(f"Sustainable stream count: {sustainable} (p99 jitter <= {_bench_args.max_jitter} ms, loss <= {_bench_args.max_loss} %)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -35,6 +35,7 @@ docker run -d \
     --env-file $ENV_PATH \
     --restart unless-stopped \
     -v $LOGS_PATH:/bot/logs \
+    -v $STATE_PATH:/bot/state \
     -v /etc/localtime:/etc/localtime:ro \
     -v /etc/timezone:/etc/timezone:ro \
     --network=host \
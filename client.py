@@ -1,20 +1,38 @@
 from arguments import args
 import asyncio
+import gateway_recorder
+import guild_resources
+import heartbeat
 import json
+import logs
 import random
+import reconnect
+import session_state
+import sharding
+import time
+import title_index
+import track_index
 import websockets
-import youtube
 
 from event import Event, OpCode
-from typing import Dict, Any
+from pathlib import Path
+from typing import Dict, Any, Callable, List, Tuple, TYPE_CHECKING
 from config import Config
-from voice_client import VoiceClient
+from timing import PhaseTimer
 from http_client import HttpClient
+from interactions import InteractionRequestType
 from logs import logger as base_logger
 from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
 
+# Voice and YouTube modules are imported on first use (and preloaded by ShardManager), they dominate startup time
+if TYPE_CHECKING:
+    from voice_client import VoiceClient
+
 logger = base_logger.bind(context="GatewayClient")
 
+_AUTOCOMPLETE_CHOICES = 10
+_CHOICE_MAX_LENGTH = 100
+
 
 class Client:
     _http_client: HttpClient
@@ -22,68 +40,134 @@ class Client:
     _intents: int
     _config: Config
     _last_seq: int | None
-    _voice_clients: Dict[str, VoiceClient]
-    _voice_state_updates: Dict[str, asyncio.Future[Event]]
-    _voice_server_updates: Dict[str, asyncio.Future[Event]]
+    _guilds: guild_resources.GuildRegistry
+    _titles: title_index.TitleIndex
+    _tracks: track_index.TrackIndex
     _identified: bool
     _closed: bool
-    _waiting_heartbeat_ack: bool
+    _heartbeat_monitor: heartbeat.HeartbeatMonitor
     _ws: websockets.ClientConnection
     _session_id: str
     _resume_url: str
     _heartbeat_task: asyncio.Task | None
-
-    def __init__(self, http_client: HttpClient, intents: int, config: Config) -> None:
+    _backoff: reconnect.Backoff
+    _shard: Tuple[int, int]
+    _identify_limiter: sharding.IdentifyLimiter
+    _shard_router: Callable[[str], "Client | None"]
+    _recorder: gateway_recorder.GatewayRecorder | None
+    _restored_playback: Dict[str, session_state.GuildPlayback]
+    _playback_restore_started: bool
+
+    def __init__(self, http_client: HttpClient, intents: int, config: Config, url: str, shard: Tuple[int, int],
+                 identify_limiter: sharding.IdentifyLimiter, shard_router: Callable[[str], "Client | None"],
+                 guilds: guild_resources.GuildRegistry, titles: title_index.TitleIndex, tracks: track_index.TrackIndex) -> None:
         self._http_client = http_client
-        self._url = http_client.get_gateway_url()
+        self._url = url
         self._intents = intents
         self._config = config
+        self._shard = shard
+        self._identify_limiter = identify_limiter
+        self._shard_router = shard_router
+        self._guilds = guilds
+        self._titles = titles
+        self._tracks = tracks
 
         self._last_seq = None
-        self._voice_clients = {}
-        self._voice_state_updates = {}
-        self._voice_server_updates = {}
         self._identified = False
         self._closed = False
-        self._waiting_heartbeat_ack = False
+        self._heartbeat_monitor = heartbeat.HeartbeatMonitor(config.heartbeat_max_missed)
+        self._heartbeat_task = None
+        self._backoff = reconnect.Backoff(config.reconnect_max_delay)
+        self._restored_playback = {}
+        self._playback_restore_started = False
+        self._recorder = None
+        if args.record_gateway:
+            path = Path(args.record_gateway) / f"gateway-shard{shard[0]}-{time.strftime('%Y%m%d-%H%M%S')}.rec.gz"
+            self._recorder = gateway_recorder.GatewayRecorder(path)
+            logger.info(f"Recording gateway frames to {path}")
+
+    # Picks up the gateway session and voice playback of a previous process, before start is called
+    def restore(self, session: session_state.GatewaySession | None, playback: List[session_state.GuildPlayback]) -> None:
+        if session is not None:
+            self._session_id = session.session_id
+            self._resume_url = session.resume_url
+            self._last_seq = session.last_seq
+            self._identified = True
+        self._restored_playback = {guild.guild_id: guild for guild in playback}
+
+    def session_snapshot(self) -> session_state.GatewaySession | None:
+        if not self._identified:
+            return None
+        return session_state.GatewaySession(session_id=self._session_id, resume_url=self._resume_url, last_seq=self._last_seq)
+
+    def playback_snapshots(self) -> List[session_state.GuildPlayback]:
+        snapshots = {guild_id: playback for guild_id, voice_client in self._guilds.voice_clients().items()
+                     if sharding.shard_id(guild_id, self._shard[1]) == self._shard[0] and (playback := voice_client.playback_state()) is not None}
+        for guild_id, playback in self._restored_playback.items():  # not rejoined yet
+            snapshots.setdefault(guild_id, playback)
+        return list(snapshots.values())
 
     async def start(self) -> None:
-        logger.info("Bot starting")
-        self._ws = await websockets.connect(self._url)
+        logger.info(f"Shard {self._shard[0]}/{self._shard[1]} starting")
+        self._ws = await self._connect()
+        close_code = 1000
         try:
             await self._receive_loop()
         except asyncio.exceptions.CancelledError:
             logger.info("Receive loop task cancelled")
+            close_code = 4000  # anything but 1000 and 1001 keeps the session resumable for the next process
         finally:
             self._closed = True
-            await self._ws.close()
+            await self._ws.close(code=close_code)
+            if self._recorder is not None:
+                self._recorder.close()
+
+    async def _connect(self) -> websockets.ClientConnection:
+        if self._identified:
+            logger.info(f"Resuming session {self._session_id} of a previous process")
+            try:
+                self._ws = await websockets.connect(self._resume_url)
+                await self._send_resume()
+                return self._ws
+            except (OSError, websockets.exceptions.InvalidHandshake, ConnectionClosed) as e:
+                logger.warning(f"Could not resume the previous session, starting a new one: {e!r}")
+                self._identified = False
+        return await websockets.connect(self._url)
 
     async def send(self, op: OpCode, data: Any) -> None:
         payload = {"op": op.value, "d": data}
         await self._ws.send(json.dumps(payload))
 
+    @property
+    def latency(self) -> float | None:
+        return self._heartbeat_monitor.latency
+
     async def _send_heartbeat(self) -> None:
-        if self._waiting_heartbeat_ack:
-            logger.warning("Last heartbeat was not acknowledged")
         try:
-            self._waiting_heartbeat_ack = True
             await self.send(OpCode.HEARTBEAT, self._last_seq)
         except websockets.exceptions.ConnectionClosed:
             logger.warning("Could not send heartbeat: connection is closed (reconnecting?)")
-            self._waiting_heartbeat_ack = False
             return
+        self._heartbeat_monitor.sent()
         if args.log_heartbeats:
             logger.log("OUT", f"HEARTBEAT last_seq = {self._last_seq}")
 
     def _handle_heartbeat_ack(self):
-        self._waiting_heartbeat_ack = False
-        if args.log_heartbeats:
-            logger.log("IN", "HEARTBEAT ACK")
+        rtt = self._heartbeat_monitor.acked()
+        if rtt is None:
+            logger.warning("Received unexpected heartbeat ACK")
+        elif args.log_heartbeats:
+            logger.log("IN", f"HEARTBEAT ACK rtt = {rtt * 1000:.1f} ms, average = {self._heartbeat_monitor.average_latency * 1000:.1f} ms")
 
     async def _regular_heartbeats(self, heartbeat_interval) -> None:
         try:
             while not self._closed:
-                await self._send_heartbeat()
+                if self._heartbeat_monitor.expired():
+                    logger.warning(f"{self._heartbeat_monitor.missed} heartbeats were not acknowledged, dropping zombie connection")
+                    self._heartbeat_monitor.reset()
+                    self._ws.transport.abort()  # the receive loop sees an abnormal closure and resumes
+                else:
+                    await self._send_heartbeat()
                 await asyncio.sleep(heartbeat_interval)
         except asyncio.exceptions.CancelledError:
             logger.info("Heartbeat task cancelled")
@@ -91,59 +175,56 @@ class Client:
     async def _identify(self) -> None:
         data = {"token": self._config.api_token,
                 "intents": self._intents,
+                "shard": list(self._shard),
                 "properties": {"os": "linux",
                                "browser": "meu_chapeu",
                                "device": "meu_chapeu"}}
+        await self._identify_limiter.acquire(self._shard[0])
         await self.send(OpCode.IDENTIFY, data)
-        logger.log("OUT", "IDENTIFY")
+        logger.log("OUT", f"IDENTIFY shard = {self._shard}")
 
     async def _handle_hello(self, event: Event) -> None:
         logger.log("IN", "HELLO")
+        self._heartbeat_monitor.reset()
 
-        if self._identified:
+        if not self._identified:
+            await self._identify()
+        if self._heartbeat_task is not None:
             return
 
         heartbeat_interval = event["heartbeat_interval"] / 1000
         initial_wait = heartbeat_interval * random.random()
         logger.info(f"Heartbeat interval: {heartbeat_interval:.3f} s")
         logger.info(f"Will start regular heartbeats in {initial_wait:.3f} s")
-        await self._identify()
         await asyncio.sleep(initial_wait)
         self._heartbeat_task = asyncio.create_task(self._regular_heartbeats(heartbeat_interval))
 
-    def _handle_user_voice_state_update(self, event: Event) -> None:
-        username = event["member"]["user"]["username"]
-        relevant_fields = {field: event[field] for field in ["self_mute", "self_deaf", "self_stream", "guild_id", "channel_id", "user_id"] if field in event}
-
-        logger.log("IN", f"DISPATCH - USER VOICE STATE UPDATE ({username}): {relevant_fields}")
-
     def _handle_voice_state_update(self, event: Event) -> None:
-        if event["member"]["user"]["id"] != self._config.application_id:
-            self._handle_user_voice_state_update(event)
+        if event["user_id"] != self._config.application_id:
+            if logs.sample("user voice state update"):
+                logger.log("IN", "DISPATCH - USER VOICE STATE UPDATE: {}", event.voice_state())
             return
 
-        logger.log("IN", f"DISPATCH - BOT VOICE STATE UPDATE: {event}")
+        state = event.voice_state()
+        logger.log("IN", "DISPATCH - BOT VOICE STATE UPDATE: {}", state)
 
-        guild_id = event["guild_id"]
-        fut = self._voice_state_updates.pop(guild_id, None)
-        if fut:
-            fut.set_result(event)
+        self._guilds.resolve_voice_state_update(state.guild_id, state)
 
     def _handle_voice_server_update(self, event: Event) -> None:
-        logger.log("IN", f"DISPATCH - VOICE SERVER UPDATE: {event}")
+        server = event.voice_server()
+        logger.log("IN", "DISPATCH - VOICE SERVER UPDATE: {}", server)
 
-        guild_id = event["guild_id"]
-        fut = self._voice_server_updates.pop(guild_id, None)
-        if fut:
-            fut.set_result(event)
+        self._guilds.resolve_voice_server_update(server.guild_id, server)
 
     # TODO: receive only what's actually required instead of entire event
     async def _handle_play(self, event: Event) -> None:
+        import youtube
+
         guild_id = event["guild_id"]
         user_id = event["member"]["user"]["id"]
         search_query = event["data"]["options"][0]["value"]
 
-        media_task = asyncio.create_task(youtube.get_video_from_user_query(search_query, self._config))
+        media_task = asyncio.create_task(youtube.get_video_from_user_query(search_query, self._config, self._tracks))
 
         channel_id = await self._http_client.get_user_voice_channel(guild_id, user_id)
 
@@ -152,11 +233,14 @@ class Client:
             await self._http_client.respond_interaction(event, "You need to be in a channel I can join or have already joined, in the same server you called me.", ephemeral=True)
             return
 
-        voice_client = self._voice_clients.get(guild_id)
+        voice_client = self._guilds.voice_client(guild_id)
 
-        if voice_client is None or voice_client.closed:
-            voice_client = await self._join_voice_channel(guild_id, channel_id)
-            self._voice_clients[guild_id] = voice_client
+        if voice_client is None:
+            voice_client = await self._owning_shard(guild_id)._join_voice_channel(guild_id, channel_id)
+            if voice_client is None:
+                media_task.cancel()
+                await self._http_client.respond_interaction(event, "Failed to join your voice channel, please try again.", ephemeral=True)
+                return
         elif voice_client.channel_id != channel_id:
             media_task.cancel()
             await self._http_client.respond_interaction(event, "You need to be in the same channel and server I'm currently connected to", ephemeral=True)
@@ -167,6 +251,9 @@ class Client:
             await self._http_client.respond_interaction(event, "Failed to find video. If you provided a link, it may be incorrect. If you used a search query, it may have returned no results.", ephemeral=True)
             return
 
+        typed_query = None if youtube.video_id_from_url(search_query) else search_query
+        self._titles.add(media.id, media.title, typed_query)
+        self._tracks.record(media.id, media.title, typed_query)
         asyncio.create_task(self._http_client.respond_interaction(event, f"Adding [{media.title}]({media.link}) ({media.duration_str()}) to the queue"))
         await voice_client.enqueue_media(media)
 
@@ -174,9 +261,9 @@ class Client:
     async def _handle_skip(self, event: Event) -> None:
         guild_id = event["guild_id"]
         user_id = event["member"]["user"]["id"]
-        voice_client = self._voice_clients.get(guild_id)
+        voice_client = self._guilds.voice_client(guild_id)
 
-        if voice_client is None or voice_client.closed:
+        if voice_client is None:
             await self._http_client.respond_interaction(event, "I'm not connected in this server", ephemeral=True)
             return
         elif voice_client.channel_id != await self._http_client.get_user_voice_channel(guild_id, user_id):
@@ -188,27 +275,74 @@ class Client:
         else:
             await self._http_client.respond_interaction(event, "Nothing to skip", ephemeral=True)
 
+    # TODO: receive only what's actually required instead of entire event
+    async def _handle_seek(self, event: Event) -> None:
+        guild_id = event["guild_id"]
+        user_id = event["member"]["user"]["id"]
+        position = _parse_position(event["data"]["options"][0]["value"])
+        voice_client = self._guilds.voice_client(guild_id)
+
+        if voice_client is None:
+            await self._http_client.respond_interaction(event, "I'm not connected in this server", ephemeral=True)
+            return
+        elif voice_client.channel_id != await self._http_client.get_user_voice_channel(guild_id, user_id):
+            await self._http_client.respond_interaction(event, "You need to be in the same channel I'm currently connected to", ephemeral=True)
+            return
+        elif position is None:
+            await self._http_client.respond_interaction(event, "Invalid position, use seconds or minutes:seconds, e.g. 90 or 1:30", ephemeral=True)
+            return
+
+        if voice_client.seek_current_media(position):
+            await self._http_client.respond_interaction(event, f"Seeking to {int(position) // 60}:{int(position) % 60:02d}")
+        else:
+            await self._http_client.respond_interaction(event, "Nothing playing or position is past the end", ephemeral=True)
+
+    # Answered from the title index only, autocomplete responses are due within 3 seconds of every keystroke
+    async def _handle_play_autocomplete(self, event: Event) -> None:
+        import youtube
+
+        typed = event["data"]["options"][0]["value"]
+        suggestions = self._titles.suggest(typed, _AUTOCOMPLETE_CHOICES)
+        if logs.sample("autocomplete"):
+            logger.log("IN", "AUTOCOMPLETE (/play): guild_id = {}, typed = {}, suggestions = {}", event["guild_id"], typed, len(suggestions))
+        # Links make /play skip the search, and are well within the length limit of choice values
+        choices = [{"name": suggestion.title[:_CHOICE_MAX_LENGTH], "value": youtube.youtube_link(suggestion.video_id)}
+                   for suggestion in suggestions]
+        if typed and suggestions:
+            youtube.prefetch(suggestions[0].video_id, self._config)
+        await self._http_client.respond_autocomplete(event, choices)
+
     async def _handle_interaction(self, event: Event) -> None:
+        if event["type"] == InteractionRequestType.APPLICATION_COMMAND_AUTOCOMPLETE:
+            if event["data"]["name"] == "play":
+                await self._handle_play_autocomplete(event)
+            return
+
         command_name = event["data"]["name"]
         username = event["member"]["user"]["username"]
         guild_id = event["guild_id"]
-        query = event["data"]["options"][0]["value"] if command_name == "play" else None
+        query = event["data"]["options"][0]["value"] if command_name in ("play", "seek") else None
 
         match command_name:
             case "play":
-                logger.log("IN", f"<blue>NEW INTERACTION (/play)</blue>: guild_id = {guild_id}, username = {username}, query = {query}")
+                logger.log("IN", "<blue>NEW INTERACTION (/play)</blue>: guild_id = {}, username = {}, query = {}", guild_id, username, query)
                 await self._handle_play(event)
             case "skip":
-                logger.log("IN", f"<blue>NEW INTERACTION (/skip)</blue>: guild_id = {guild_id}, username = {username}")
+                logger.log("IN", "<blue>NEW INTERACTION (/skip)</blue>: guild_id = {}, username = {}", guild_id, username)
                 await self._handle_skip(event)
+            case "seek":
+                logger.log("IN", "<blue>NEW INTERACTION (/seek)</blue>: guild_id = {}, username = {}, position = {}", guild_id, username, query)
+                await self._handle_seek(event)
 
     async def _handle_dispatch(self, event: Event) -> None:
         match event.name:
             case "READY":
-                logger.log("IN", f"DISPATCH - READY: {event}")
+                logger.log("IN", "DISPATCH - READY: {}", event)
                 self._session_id = event["session_id"]
                 self._resume_url = event["resume_gateway_url"]
                 self._identified = True
+                self._backoff.reset()
+                self._restore_playback()
             case "INTERACTION_CREATE":
                 await self._handle_interaction(event)
             case "VOICE_STATE_UPDATE":
@@ -216,38 +350,90 @@ class Client:
             case "VOICE_SERVER_UPDATE":
                 self._handle_voice_server_update(event)
             case "RESUMED":
-                logger.log("IN", f"DISPATCH - RESUMED: {event}")
+                logger.log("IN", "DISPATCH - RESUMED: {}", event)
+                self._backoff.reset()
+                self._restore_playback()
 
-    async def _join_voice_channel(self, guild_id: str, channel_id: str) -> VoiceClient:
-        state_future = asyncio.get_running_loop().create_future()
-        server_future = asyncio.get_running_loop().create_future()
-        self._voice_state_updates[guild_id] = state_future
-        self._voice_server_updates[guild_id] = server_future
+    # Voice state updates have to be sent, and their dispatches arrive, on the shard the guild belongs to
+    def _owning_shard(self, guild_id: str) -> "Client":
+        owner = self._shard_router(guild_id)
+        if owner is None:
+            logger.warning(f"Guild {guild_id} does not belong to any shard of this process, using shard {self._shard[0]}")
+            return self
+        return owner
+
+    async def _join_voice_channel(self, guild_id: str, channel_id: str) -> "VoiceClient | None":
+        from voice_client import VoiceClient
+
+        join_timer = PhaseTimer()
+        state_future, server_future = self._guilds.expect_voice_updates(guild_id)
 
         vsu_payload = {"guild_id": guild_id,
                        "channel_id": channel_id,
                        "self_mute": False,
                        "self_deaf": True}
-        logger.log("OUT", f"VOICE_STATE_UPDATE: {vsu_payload}")
-        await self.send(OpCode.VOICE_STATE_UPDATE, vsu_payload)
-
-        # TODO handle timeouts
-        state_resp = await state_future
-        server_resp = await server_future
+        try:
+            logger.log("OUT", "VOICE_STATE_UPDATE: {}", vsu_payload)
+            await self.send(OpCode.VOICE_STATE_UPDATE, vsu_payload)
+            state_resp = await asyncio.wait_for(state_future, self._config.voice_join_phase_timeout)
+            join_timer.mark("voice state update")
+            server_resp = await asyncio.wait_for(server_future, self._config.voice_join_phase_timeout)
+            join_timer.mark("voice server update")
+        except TimeoutError:
+            logger.warning(f"Voice join of guild {guild_id} timed out waiting for voice state and server updates, phases so far: {join_timer}")
+            await self._leave_voice_channel(guild_id)
+            return None
+        except ConnectionClosed as e:
+            logger.warning(f"Voice join of guild {guild_id} failed, gateway connection closed: {e}")
+            return None
+        finally:
+            self._guilds.discard_voice_updates(guild_id)
+        if server_resp.endpoint is None:  # Discord has no voice server for the guild right now
+            logger.warning(f"Voice join of guild {guild_id} failed, no voice server is available")
+            await self._leave_voice_channel(guild_id)
+            return None
 
         vc = VoiceClient(guild_id,
                          channel_id,
-                         server_resp["endpoint"],
-                         state_resp["session_id"],
-                         server_resp["token"],
-                         lambda: self._leave_voice_channel(guild_id),
-                         self._config)
+                         server_resp.endpoint,
+                         state_resp.session_id,
+                         server_resp.token,
+                         lambda: self._voice_client_closed(guild_id, vc),
+                         self._config,
+                         join_timer)
+        self._guilds.add_voice_client(guild_id, vc)
 
         logger.info(f"JOINED VOICE guild_id = {guild_id}, channel_id = {channel_id}")
 
         asyncio.create_task(vc.start())
         return vc
 
+    async def _voice_client_closed(self, guild_id: str, voice_client: "VoiceClient") -> None:
+        if self._guilds.release(guild_id, voice_client):
+            await self._leave_voice_channel(guild_id)
+
+    # Rejoins the voice channels of all restored guilds concurrently, each continuing its queue where it stopped
+    def _restore_playback(self) -> None:
+        if self._playback_restore_started:
+            return
+        self._playback_restore_started = True
+        for playback in self._restored_playback.values():
+            asyncio.create_task(self._restore_guild_playback(playback))
+
+    async def _restore_guild_playback(self, playback: session_state.GuildPlayback) -> None:
+        import youtube
+
+        try:
+            voice_client = await self._join_voice_channel(playback.guild_id, playback.channel_id)
+            if voice_client is None:
+                logger.warning(f"Could not rejoin voice in guild {playback.guild_id}, dropping its restored queue")
+                return
+            for media in playback.queue:
+                await voice_client.enqueue_media(youtube.media_file(media.id, media.title, media.thumbnail, media.duration, self._config), media.start)
+            logger.info(f"Restored {len(playback.queue)} queued media in guild {playback.guild_id}")
+        finally:
+            self._restored_playback.pop(playback.guild_id, None)
+
     async def _leave_voice_channel(self, guild_id: str) -> None:
         vsu_payload = {"guild_id": guild_id,
                        "channel_id": None,
@@ -258,44 +444,44 @@ class Client:
         except websockets.exceptions.ConnectionClosed:
             return
 
-        logger.log("OUT", f"VOICE_STATE_UPDATE: {vsu_payload}")
+        logger.log("OUT", "VOICE_STATE_UPDATE: {}", vsu_payload)
 
     async def _reconnect(self) -> None:
-        logger.info("Reconnecting...")
-        connected = False
+        await self._ws.close()
+        if not self._identified:
+            logger.info("Reconnecting before the session was established, starting a new session...")
+            self._ws = await reconnect.connect(self._url, self._backoff)
+            return
 
-        while not connected:
-            try:
-                self._ws = await websockets.connect(self._resume_url, open_timeout=None)
-                connected = True
-            except Exception as e:
-                logger.warning(f"Exception: {e}")
-                logger.warning("Reconnection failed, retrying after 30 seconds...")
-                await asyncio.sleep(30)
+        logger.info("Reconnecting...")
+        self._ws = await reconnect.connect(self._resume_url, self._backoff)
+        try:
+            await self._send_resume()
+        except ConnectionClosed as e:
+            logger.warning(f"Could not send resume: {e}")  # the receive loop sees the closed connection and retries
 
+    async def _send_resume(self) -> None:
         await self.send(OpCode.RESUME, {"token": self._config.api_token,
                                         "session_id": self._session_id,
                                         "seq": self._last_seq})
         logger.log("OUT", f"RESUME session_id = {self._session_id}, seq = {self._last_seq}")
 
-    async def _handle_invalid_session(self) -> None:
-        logger.info("Received invalid session, opening new session in 60 seconds")
+    async def _handle_invalid_session(self, resumable: bool) -> None:
+        if resumable:
+            logger.info("Received invalid session, resuming")
+            await self._reconnect()
+            return
 
         self._identified = False
-
         if self._heartbeat_task is not None:
             self._heartbeat_task.cancel()
+            self._heartbeat_task = None
 
-        connected = False
-        while not connected:
-            await asyncio.sleep(60)
-            logger.info("Attempting to start a new session...")
-            try:
-                self._ws = await websockets.connect(self._url, open_timeout=None)
-                connected = True
-            except Exception as e:
-                logger.warning(f"Attempt to start new session failed. Exception: {e}")
-
+        delay = random.uniform(1, 5)  # Discord asks for a random wait of 1-5 seconds before identifying again
+        logger.info(f"Received invalid session, opening new session in {delay:.2f} seconds")
+        await self._ws.close()
+        await asyncio.sleep(delay)
+        self._ws = await reconnect.connect(self._url, self._backoff)
         logger.info("New session started")
 
     async def _handle_disconnection(self, exception: ConnectionClosed) -> bool:
@@ -313,6 +499,8 @@ class Client:
             try:
                 data = await self._ws.recv()
                 assert isinstance(data, str)
+                if self._recorder is not None:
+                    self._recorder.record(data)
                 event = Event(data)
             except ConnectionClosed as e:
                 if await self._handle_disconnection(e):
@@ -336,8 +524,8 @@ class Client:
                     logger.log("IN", "RECONNECT")
                     await self._reconnect()
                 case OpCode.INVALID_SESSION:
-                    logger.log("IN", f"INVALID SESSION {event}")
-                    await self._handle_invalid_session()
+                    logger.log("IN", "INVALID SESSION {}", event)
+                    await self._handle_invalid_session(event.data is True)
 
 
 _ALLOWED_RECONNECT_CLOSE_CODES = {1001, 1006, 4000, 4001, 4002, 4003, 4005, 4007, 4008, 4009}
@@ -345,3 +533,13 @@ _ALLOWED_RECONNECT_CLOSE_CODES = {1001, 1006, 4000, 4001, 4002, 4003, 4005, 4007
 
 def _should_reconnect(exception: ConnectionClosed) -> bool:
     return exception.rcvd is None or exception.rcvd.code in _ALLOWED_RECONNECT_CLOSE_CODES
+
+
+def _parse_position(value: str) -> float | None:
+    seconds = 0.0
+    try:
+        for part in value.strip().split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return None
+    return seconds if seconds >= 0 else None
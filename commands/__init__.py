@@ -1,4 +1,7 @@
 from .play import Play
+from .seek import Seek
 from .skip import Skip
 
-__all__ = ["Play", "Skip"]
+ALL = [Play, Skip, Seek]
+
+__all__ = ["ALL", "Play", "Seek", "Skip"]
@@ -6,4 +6,4 @@ Play = {"name": "play",
                      "name": "query",
                      "description": "Search query or link",
                      "required": True,
-                     "autocomplete": False}]}
+                     "autocomplete": True}]}  # suggestions of media played before
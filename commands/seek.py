@@ -0,0 +1,8 @@
+Seek = {"name": "seek",
+        "description": "Jump to a position in the audio currently playing",
+        "integration_types": [0],  # GUILD
+        "contexts": [0],           # GUILD
+        "options": [{"type": 3,    # STRING
+                     "name": "position",
+                     "description": "Position as seconds or minutes:seconds, e.g. 90 or 1:30",
+                     "required": True}]}
@@ -1,6 +1,8 @@
 import dotenv
 import os
 
+from pathlib import Path
+
 
 class Config:
     _api_token: str | None
@@ -9,6 +11,43 @@ class Config:
     _api_url: str | None
     _application_id: str | None
     _idle_timeout: int | None
+    _opus_bitrate: int | None
+    _opus_complexity: int
+    _opus_vbr: bool
+    _opus_fec: bool
+    _opus_expected_packet_loss: int
+    _opus_signal: str
+    _opus_min_complexity: int
+    _opus_encode_time_threshold: float
+    _opus_max_full_complexity_streams: int
+    _opus_passthrough: bool
+    _silence_trim: bool
+    _silence_suppression_threshold: float
+    _audio_gain: float
+    _loudness_normalization: bool
+    _loudness_target: float
+    _fade_in: float
+    _fade_out: float
+    _reconnect_max_delay: float
+    _voice_reconnect_attempts: int
+    _heartbeat_max_missed: int
+    _shard_count: int | None
+    _shard_process_index: int
+    _shard_process_count: int
+    _voice_join_phase_timeout: float
+    _ip_discovery_timeout: float
+    _ip_discovery_attempts: int
+    _pacing_spin_time: float
+    _pacing_late_policy: str
+    _pacing_max_catch_up: int
+    _sender_realtime_priority: int | None
+    _sender_cpu_affinity: frozenset[int] | None
+    _state_dir: Path
+    _gateway_fetch_timeout: float
+    _state_snapshot_interval: float
+    _state_restore_max_age: float
+    _local_search_min_coverage: float
+    _youtube_api_timeout: float
 
     def __init__(self, env_file: str = ".env"):
         dotenv.load_dotenv(env_file)
@@ -19,6 +58,43 @@ class Config:
         self._application_id = os.getenv("APPLICATION_ID")
         self._idle_timeout = int(os.getenv("IDLE_TIMEOUT", default=300))
         self._google_api_token = os.getenv("GOOGLE_API_TOKEN")
+        self._opus_bitrate = int(os.environ["OPUS_BITRATE"]) if os.getenv("OPUS_BITRATE") else None
+        self._opus_complexity = int(os.getenv("OPUS_COMPLEXITY", default=10))
+        self._opus_vbr = _getenv_bool("OPUS_VBR", default=True)
+        self._opus_fec = _getenv_bool("OPUS_FEC", default=False)
+        self._opus_expected_packet_loss = int(os.getenv("OPUS_EXPECTED_PACKET_LOSS", default=0))
+        self._opus_signal = os.getenv("OPUS_SIGNAL", default="auto")
+        self._opus_min_complexity = int(os.getenv("OPUS_MIN_COMPLEXITY", default=5))
+        self._opus_encode_time_threshold = float(os.getenv("OPUS_ENCODE_TIME_THRESHOLD_MS", default=2.0)) / 1000
+        self._opus_max_full_complexity_streams = int(os.getenv("OPUS_MAX_FULL_COMPLEXITY_STREAMS", default=32))
+        self._opus_passthrough = _getenv_bool("OPUS_PASSTHROUGH", default=True)
+        self._silence_trim = _getenv_bool("SILENCE_TRIM", default=True)
+        self._silence_suppression_threshold = float(os.getenv("SILENCE_SUPPRESSION_THRESHOLD_MS", default=1000)) / 1000
+        self._audio_gain = float(os.getenv("AUDIO_GAIN_DB", default=0.0))
+        self._loudness_normalization = _getenv_bool("LOUDNESS_NORMALIZATION", default=False)
+        self._loudness_target = float(os.getenv("LOUDNESS_TARGET_LUFS", default=-16.0))
+        self._fade_in = float(os.getenv("FADE_IN_MS", default=0)) / 1000
+        self._fade_out = float(os.getenv("FADE_OUT_MS", default=0)) / 1000
+        self._reconnect_max_delay = float(os.getenv("RECONNECT_MAX_DELAY", default=60))
+        self._voice_reconnect_attempts = int(os.getenv("VOICE_RECONNECT_ATTEMPTS", default=8))
+        self._heartbeat_max_missed = int(os.getenv("HEARTBEAT_MAX_MISSED", default=2))
+        self._shard_count = int(os.environ["SHARD_COUNT"]) if os.getenv("SHARD_COUNT") else None
+        self._shard_process_index = int(os.getenv("SHARD_PROCESS_INDEX", default=0))
+        self._shard_process_count = int(os.getenv("SHARD_PROCESS_COUNT", default=1))
+        self._voice_join_phase_timeout = float(os.getenv("VOICE_JOIN_PHASE_TIMEOUT", default=10))
+        self._ip_discovery_timeout = float(os.getenv("IP_DISCOVERY_TIMEOUT_MS", default=1000)) / 1000
+        self._ip_discovery_attempts = int(os.getenv("IP_DISCOVERY_ATTEMPTS", default=3))
+        self._pacing_spin_time = float(os.getenv("PACING_SPIN_US", default=0)) / 1000000
+        self._pacing_late_policy = os.getenv("PACING_LATE_POLICY", default="catch_up")
+        self._pacing_max_catch_up = int(os.getenv("PACING_MAX_CATCH_UP", default=3))
+        self._sender_realtime_priority = int(os.environ["SENDER_REALTIME_PRIORITY"]) if os.getenv("SENDER_REALTIME_PRIORITY") else None
+        self._sender_cpu_affinity = frozenset(int(cpu) for cpu in os.environ["SENDER_CPU_AFFINITY"].split(",")) if os.getenv("SENDER_CPU_AFFINITY") else None
+        self._state_dir = Path(os.getenv("STATE_DIR", default="state"))
+        self._gateway_fetch_timeout = float(os.getenv("GATEWAY_FETCH_TIMEOUT", default=3))
+        self._state_snapshot_interval = float(os.getenv("STATE_SNAPSHOT_INTERVAL", default=5))
+        self._state_restore_max_age = float(os.getenv("STATE_RESTORE_MAX_AGE", default=300))
+        self._local_search_min_coverage = float(os.getenv("LOCAL_SEARCH_MIN_COVERAGE", default=0.6))
+        self._youtube_api_timeout = float(os.getenv("YOUTUBE_API_TIMEOUT", default=5))
 
     @property
     def api_token(self):
@@ -47,3 +123,158 @@ class Config:
     @property
     def google_api_token(self):
         return self._google_api_token
+
+    @property
+    def opus_bitrate(self):
+        return self._opus_bitrate
+
+    @property
+    def opus_complexity(self):
+        return self._opus_complexity
+
+    @property
+    def opus_vbr(self):
+        return self._opus_vbr
+
+    @property
+    def opus_fec(self):
+        return self._opus_fec
+
+    @property
+    def opus_expected_packet_loss(self):
+        return self._opus_expected_packet_loss
+
+    @property
+    def opus_signal(self):
+        return self._opus_signal
+
+    @property
+    def opus_min_complexity(self):
+        return self._opus_min_complexity
+
+    @property
+    def opus_encode_time_threshold(self):
+        return self._opus_encode_time_threshold
+
+    @property
+    def opus_max_full_complexity_streams(self):
+        return self._opus_max_full_complexity_streams
+
+    @property
+    def opus_passthrough(self):
+        return self._opus_passthrough
+
+    @property
+    def silence_trim(self):
+        return self._silence_trim
+
+    @property
+    def silence_suppression_threshold(self):
+        return self._silence_suppression_threshold
+
+    @property
+    def audio_gain(self):
+        return self._audio_gain
+
+    @property
+    def loudness_normalization(self):
+        return self._loudness_normalization
+
+    @property
+    def loudness_target(self):
+        return self._loudness_target
+
+    @property
+    def fade_in(self):
+        return self._fade_in
+
+    @property
+    def fade_out(self):
+        return self._fade_out
+
+    @property
+    def reconnect_max_delay(self):
+        return self._reconnect_max_delay
+
+    @property
+    def voice_reconnect_attempts(self):
+        return self._voice_reconnect_attempts
+
+    @property
+    def heartbeat_max_missed(self):
+        return self._heartbeat_max_missed
+
+    @property
+    def shard_count(self):
+        return self._shard_count
+
+    @property
+    def shard_process_index(self):
+        return self._shard_process_index
+
+    @property
+    def shard_process_count(self):
+        return self._shard_process_count
+
+    @property
+    def voice_join_phase_timeout(self):
+        return self._voice_join_phase_timeout
+
+    @property
+    def ip_discovery_timeout(self):
+        return self._ip_discovery_timeout
+
+    @property
+    def ip_discovery_attempts(self):
+        return self._ip_discovery_attempts
+
+    @property
+    def pacing_spin_time(self):
+        return self._pacing_spin_time
+
+    @property
+    def pacing_late_policy(self):
+        return self._pacing_late_policy
+
+    @property
+    def pacing_max_catch_up(self):
+        return self._pacing_max_catch_up
+
+    @property
+    def sender_realtime_priority(self):
+        return self._sender_realtime_priority
+
+    @property
+    def sender_cpu_affinity(self):
+        return self._sender_cpu_affinity
+
+    @property
+    def state_dir(self):
+        return self._state_dir
+
+    @property
+    def gateway_fetch_timeout(self):
+        return self._gateway_fetch_timeout
+
+    @property
+    def state_snapshot_interval(self):
+        return self._state_snapshot_interval
+
+    @property
+    def state_restore_max_age(self):
+        return self._state_restore_max_age
+
+    @property
+    def local_search_min_coverage(self):
+        return self._local_search_min_coverage
+
+    @property
+    def youtube_api_timeout(self):
+        return self._youtube_api_timeout
+
+
+def _getenv_bool(key: str, default: bool) -> bool:
+    value = os.getenv(key)
+    if not value:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
@@ -2,59 +2,119 @@ from nacl.bindings import crypto_aead_xchacha20poly1305_ietf_encrypt
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from dave.parser import KDFLabel
 
-from typing import Tuple
+import struct
+from threading import Lock
+from typing import Dict
 
+TRANSPORT_TAG_SIZE = 16
+DAVE_TAG_SIZE = 8
+_GCM_TAG_SIZE = 16
 
-def encrypt_packet(header: bytes, payload: bytes, nonce: int, key: bytes, mode: str) -> bytes:
-    match mode:
-        case "aead_xchacha20_poly1305_rtpsize":
-            return crypto_aead_xchacha20poly1305_ietf_encrypt(payload, header, nonce.to_bytes(24, "little"), key)
+_RATCHET_KEY_LENGTH = 16
+_RATCHET_SECRET_LENGTH = 32
+_RATCHET_CACHED_GENERATIONS = 2
 
-        case "aead_aes256_gcm_rtpsize":
-            return AESGCM(key).encrypt(nonce.to_bytes(12, "little"), payload, header)
 
-        case _:
-            raise NotImplementedError(f"Unimplemented transport encryption mode: {mode}")
+class TransportEncryptor:
+    _key: bytes
+    _aesgcm: AESGCM | None
+    _nonce: bytearray
 
+    def __init__(self, key: bytes, mode: str):
+        self._key = key
+        match mode:
+            case "aead_xchacha20_poly1305_rtpsize":
+                self._aesgcm = None
+                self._nonce = bytearray(24)
 
-# TODO better names
-def encrypt_dave(payload: bytes, nonce: int, key: bytes) -> Tuple[bytes, bytes]:
-    nonce_bytes = b'\x00' * 8 + nonce.to_bytes(4, "little")
+            case "aead_aes256_gcm_rtpsize":
+                self._aesgcm = AESGCM(key)
+                self._nonce = bytearray(12)
 
-    cipher = Cipher(
-        algorithms.AES(key),
-        modes.GCM(nonce_bytes, min_tag_length=8)
-    )
+            case _:
+                raise NotImplementedError(f"Unimplemented transport encryption mode: {mode}")
 
-    encryptor = cipher.encryptor()
+    def encrypt_into(self, header: memoryview, payload: memoryview, nonce: int, out: memoryview) -> int:
+        struct.pack_into("<I", self._nonce, 0, nonce)
+        size = len(payload) + TRANSPORT_TAG_SIZE
 
-    ciphertext = encryptor.update(payload) + encryptor.finalize()
-    tag = encryptor.tag[:8]
+        if self._aesgcm is not None:
+            self._aesgcm.encrypt_into(self._nonce, payload, header, out[:size])
+        else:  # PyNaCl only accepts and returns bytes
+            out[:size] = crypto_aead_xchacha20poly1305_ietf_encrypt(bytes(payload), bytes(header), bytes(self._nonce), self._key)
 
-    return ciphertext, tag
+        return size
+
+
+class DaveEncryptor:
+    _key: bytes | None
+    _aesgcm: AESGCM | None
+    _nonce: bytearray
+
+    def __init__(self):
+        self._key = None
+        self._aesgcm = None
+        self._nonce = bytearray(12)
+
+    # Writes ciphertext followed by the full 16 byte GCM tag, of which DAVE keeps only the first 8 bytes.
+    # Returns the size of ciphertext plus truncated tag, so the caller may overwrite the remaining tag bytes.
+    def encrypt_into(self, payload: bytes, nonce: int, key: bytes, out: memoryview) -> int:
+        if key is not self._key:
+            self._key = key
+            self._aesgcm = AESGCM(key)
+        assert self._aesgcm is not None
+
+        struct.pack_into("<I", self._nonce, 8, nonce)
+        self._aesgcm.encrypt_into(self._nonce, payload, None, out[:len(payload) + _GCM_TAG_SIZE])
+        return len(payload) + DAVE_TAG_SIZE
 
 
 def _derive_tree_secret(secret: bytes, label: str, generation: int, length: int) -> bytes:
     label_bytes = b"MLS 1.0 " + label.encode("ascii")
-    context_bytes = generation.to_bytes(length=4, byteorder="little")
+    context_bytes = generation.to_bytes(length=4, byteorder="big")
     kdf_label = KDFLabel.build({"length": length, "label": label_bytes, "context": context_bytes})
     return HKDFExpand(algorithm=hashes.SHA256(), length=length, info=kdf_label).derive(secret)
 
 
 class KeyRatchet:
-    key: bytes
-    nonce: bytes
-    generation: int
+    _secret: bytes
+    _secret_generation: int
+    _keys: Dict[int, bytes]
+    _lock: Lock
 
     def __init__(self, base_secret: bytes):
-        self.generation = 0
-        self.key = _derive_tree_secret(base_secret, "key", 0, 16)
+        self._secret = base_secret
+        self._secret_generation = 0
+        self._keys = {}
+        self._lock = Lock()
+        self.derive(0)
 
     def get(self, generation: int) -> bytes:
-        if generation > 0:
-            raise NotImplementedError("No support for generations beyond 0")
-        return self.key
+        key = self._keys.get(generation)
+        if key is None:
+            key = self.derive(generation)
+        return key
+
+    def derive(self, generation: int) -> bytes:
+        with self._lock:
+            key = self._keys.get(generation)
+            if key is not None:
+                return key
+
+            if generation < self._secret_generation:
+                raise ValueError(f"Generation {generation} was already discarded (current generation is {self._secret_generation})")
+
+            while self._secret_generation < generation:
+                self._secret = _derive_tree_secret(self._secret, "secret", self._secret_generation, _RATCHET_SECRET_LENGTH)
+                self._secret_generation += 1
+
+            key = _derive_tree_secret(self._secret, "key", generation, _RATCHET_KEY_LENGTH)
+
+            # readers look keys up without the lock, so publish a new dict instead of mutating the current one
+            keys = {gen: k for gen, k in self._keys.items() if gen > generation - _RATCHET_CACHED_GENERATIONS}
+            keys[generation] = key
+            self._keys = keys
+            return key
@@ -141,29 +141,32 @@ impl DaveSession {
 
 #[pymethods]
 impl DaveSession {
+    // The group operations below release the GIL while they compute, so the Python threads calling them don't hold up the others
     #[new]
-    fn new(user_id: &str) -> Self {
-        let provider = OpenMlsRustCrypto::default();
-        let parsed_user_id:u64 = user_id.parse().expect("Failed to parse user id to u64");
-        let signature_keys = SignatureKeyPair::new(CIPHERSUITE.signature_algorithm())
-            .expect("Error generating a signature key pair.");
-        let credential:Credential = BasicCredential::new(parsed_user_id.to_be_bytes().to_vec()).into();
-        let credential_with_key = CredentialWithKey {
-            credential: credential.clone(),
-            signature_key: signature_keys.public().into()
-        };
-        let kpb = build_key_package_bundle(&provider, &signature_keys, credential_with_key);
-
-        signature_keys.store(provider.storage()).expect("Failed to store signature keys");
-
-        Self {
-            user_id: parsed_user_id,
-            provider: provider,
-            signature_keys: signature_keys,
-            credential: credential,
-            key_package_bundle: kpb,
-            mls_group: None
-        }
+    fn new(py: Python<'_>, user_id: &str) -> Self {
+        py.allow_threads(|| {
+            let provider = OpenMlsRustCrypto::default();
+            let parsed_user_id:u64 = user_id.parse().expect("Failed to parse user id to u64");
+            let signature_keys = SignatureKeyPair::new(CIPHERSUITE.signature_algorithm())
+                .expect("Error generating a signature key pair.");
+            let credential:Credential = BasicCredential::new(parsed_user_id.to_be_bytes().to_vec()).into();
+            let credential_with_key = CredentialWithKey {
+                credential: credential.clone(),
+                signature_key: signature_keys.public().into()
+            };
+            let kpb = build_key_package_bundle(&provider, &signature_keys, credential_with_key);
+
+            signature_keys.store(provider.storage()).expect("Failed to store signature keys");
+
+            Self {
+                user_id: parsed_user_id,
+                provider: provider,
+                signature_keys: signature_keys,
+                credential: credential,
+                key_package_bundle: kpb,
+                mls_group: None
+            }
+        })
     }
 
     fn mls_group_exists(&self) -> bool {
@@ -178,36 +181,38 @@ impl DaveSession {
         PyBytes::new(py, &bytes_vec).into()
     }
 
-    fn create_group_from_welcome(&mut self, external_sender_identity: &[u8], external_sender_signature: &[u8], welcome: &[u8]) {
-        //TODO (protocol check): external sender in welcome message must match this one
-        let _external_sender = ExternalSender::new(SignaturePublicKey::from(external_sender_signature), BasicCredential::new(external_sender_identity.to_vec()).into());
-
-        let welcome = Welcome::tls_deserialize_exact(welcome)
-            .expect("Failed to deserialize welcome message");
-        let group_config = MlsGroupJoinConfig::builder()
-            .use_ratchet_tree_extension(true)
-            .wire_format_policy(PURE_PLAINTEXT_WIRE_FORMAT_POLICY)
-            .build();
-        let processed_welcome = ProcessedWelcome::new_from_welcome(
-            &self.provider,
-            &group_config,
-            welcome
-        ).expect("Failed to process welcome message");
-        let group_info = processed_welcome.unverified_group_info();
-        let ratchet_tree = group_info
-            .extensions()
-            .ratchet_tree()
-            .expect("Ratchet tree not found")
-            .ratchet_tree()
-            .clone();
-        let staged_welcome = processed_welcome
-            .into_staged_welcome(&self.provider, Some(ratchet_tree))
-            .expect("Failed to stage welcome message");
-
-        self.mls_group = Some(staged_welcome
-            .into_group(&self.provider)
-            .expect("Failed to create MlsGroup from staged welcome message")
-        );
+    fn create_group_from_welcome(&mut self, py: Python<'_>, external_sender_identity: &[u8], external_sender_signature: &[u8], welcome: &[u8]) {
+        py.allow_threads(|| {
+            //TODO (protocol check): external sender in welcome message must match this one
+            let _external_sender = ExternalSender::new(SignaturePublicKey::from(external_sender_signature), BasicCredential::new(external_sender_identity.to_vec()).into());
+
+            let welcome = Welcome::tls_deserialize_exact(welcome)
+                .expect("Failed to deserialize welcome message");
+            let group_config = MlsGroupJoinConfig::builder()
+                .use_ratchet_tree_extension(true)
+                .wire_format_policy(PURE_PLAINTEXT_WIRE_FORMAT_POLICY)
+                .build();
+            let processed_welcome = ProcessedWelcome::new_from_welcome(
+                &self.provider,
+                &group_config,
+                welcome
+            ).expect("Failed to process welcome message");
+            let group_info = processed_welcome.unverified_group_info();
+            let ratchet_tree = group_info
+                .extensions()
+                .ratchet_tree()
+                .expect("Ratchet tree not found")
+                .ratchet_tree()
+                .clone();
+            let staged_welcome = processed_welcome
+                .into_staged_welcome(&self.provider, Some(ratchet_tree))
+                .expect("Failed to stage welcome message");
+
+            self.mls_group = Some(staged_welcome
+                .into_group(&self.provider)
+                .expect("Failed to create MlsGroup from staged welcome message")
+            );
+        })
     }
 
     fn export_base_sender_key(&self, py: Python<'_>) -> PyObject {
@@ -222,7 +227,7 @@ impl DaveSession {
     // TODO: per the DAVE protocol, need to reject add proposals when user ID being added is not expected to be in the call,
     // according to clients_connect (11) and clients_disconnect (13) events
     fn append_proposals(&mut self, py: Python<'_>, proposal_message: &[u8]) -> Py<ProcessMessageResult> {
-        let (commit_msg, welcome) = self.process_append_proposal_message(deserialize_dave_mls_message(proposal_message));
+        let (commit_msg, welcome) = py.allow_threads(|| self.process_append_proposal_message(deserialize_dave_mls_message(proposal_message)));
         Py::new(py, ProcessMessageResult::new(&py, commit_msg, welcome)).expect("Failed to create Py<ProcessMessageResult>")
     }
 
@@ -230,48 +235,50 @@ impl DaveSession {
         let protocol_message = deserialize_dave_mls_message(proposal_message);
         let external_sender = ExternalSender::new(SignaturePublicKey::from(es_signature), BasicCredential::new(es_identity.to_vec()).into());
 
-        self.create_group(protocol_message.group_id().clone(), external_sender);
+        py.allow_threads(|| self.create_group(protocol_message.group_id().clone(), external_sender));
         self.append_proposals(py, proposal_message)
     }
 
-    fn merge_commit(&mut self, commit_message: &[u8]) -> PyResult<()> {
-        let protocol_message = deserialize_dave_mls_message(commit_message);
-        let process_message_result = self.mls_group
-            .as_mut()
-            .expect("Cannot process commit message: no MLS group")
-            .process_message(&self.provider, protocol_message);
-
-        match process_message_result {
-            Ok(processed_message) => {
-                let ProcessedMessageContent::StagedCommitMessage(staged_commit) = processed_message.into_content() else {
-                        panic!("Message is not a commit");
-                };
-
-                self.mls_group
-                    .as_mut()
-                    .unwrap()
-                    .merge_staged_commit(&self.provider, *staged_commit)
-                    .expect("Failed to merge commit");
-                Ok(())
-            }
-
-            Err(ProcessMessageError::InvalidCommit(StageCommitError::OwnCommit)) => {
-                self.mls_group
-                    .as_mut()
-                    .unwrap()
-                    .merge_pending_commit(&self.provider)
-                    .expect("Failed to merge own commit");
-                Ok(())
-            }
-
-            Err(ProcessMessageError::InvalidCommit(e)) => {
-                Err(DaveInvalidCommit::new_err(e.to_string()))
-            }
-
-            Err(e) => {
-                panic!("Failed to process commit message: {:?}", e)
+    fn merge_commit(&mut self, py: Python<'_>, commit_message: &[u8]) -> PyResult<()> {
+        py.allow_threads(|| {
+            let protocol_message = deserialize_dave_mls_message(commit_message);
+            let process_message_result = self.mls_group
+                .as_mut()
+                .expect("Cannot process commit message: no MLS group")
+                .process_message(&self.provider, protocol_message);
+
+            match process_message_result {
+                Ok(processed_message) => {
+                    let ProcessedMessageContent::StagedCommitMessage(staged_commit) = processed_message.into_content() else {
+                            panic!("Message is not a commit");
+                    };
+
+                    self.mls_group
+                        .as_mut()
+                        .unwrap()
+                        .merge_staged_commit(&self.provider, *staged_commit)
+                        .expect("Failed to merge commit");
+                    Ok(())
+                }
+
+                Err(ProcessMessageError::InvalidCommit(StageCommitError::OwnCommit)) => {
+                    self.mls_group
+                        .as_mut()
+                        .unwrap()
+                        .merge_pending_commit(&self.provider)
+                        .expect("Failed to merge own commit");
+                    Ok(())
+                }
+
+                Err(ProcessMessageError::InvalidCommit(e)) => {
+                    Err(DaveInvalidCommit::new_err(e.to_string()))
+                }
+
+                Err(e) => {
+                    panic!("Failed to process commit message: {:?}", e)
+                }
             }
-        }
+        })
     }
 
     fn remove_proposals(&mut self, proposal_refs: &[u8]) {
@@ -1,9 +1,20 @@
+import concurrent.futures
+import itertools
 import openmls_dave  # type: ignore[import-untyped]
 
 from crypto import KeyRatchet
+from concurrent.futures import ThreadPoolExecutor
+from dave import worker
 from dataclasses import dataclass, field
 from enum import Enum, unique, auto
-from typing import Tuple, Dict
+from typing import Iterator, Tuple, Dict
+
+_GENERATION_SHIFT = 24
+_NONCES_PER_GENERATION = 1 << _GENERATION_SHIFT
+_NEXT_GENERATION_PRECOMPUTE_OFFSET = _NONCES_PER_GENERATION // 2
+_NONCE_BATCH = 256  # nonces a stream reserves at a time, about 5 s of audio
+
+_ratchet_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dave-ratchet")
 
 
 @dataclass(frozen=True)
@@ -12,12 +23,6 @@ class ExternalSender:
     signature: bytes
 
 
-@dataclass(frozen=True)
-class MediaKey:
-    key: bytes
-    nonce: int
-
-
 class DaveException(Exception):
     pass
 
@@ -40,38 +45,133 @@ class Transition:
     key_ratchet: KeyRatchet | None = field(repr=False)
 
 
+# What media is encrypted with, published as a whole when a transition executes and never changed afterwards, so the
+# sender reads it without locking. Nonces are handed out in batches from the snapshot's own counter (next() on an
+# itertools.count is atomic), so none repeats under a key, whatever resets happen while it is in use.
+@dataclass(frozen=True)
+class MediaKeys:
+    epoch: int
+    key_ratchet: KeyRatchet | None = field(repr=False)  # None while media is sent unencrypted
+    nonce_batches: Iterator[int] = field(repr=False)
+
+
+# One stream's view of the media keys, used from its sender thread only
+class MediaKeyStream:
+    __slots__ = ("_dave", "_epoch", "_key_ratchet", "_nonce", "_batch_end")
+
+    _dave: "DaveSessionManager"
+    _epoch: int
+    _key_ratchet: KeyRatchet | None
+    _nonce: int
+    _batch_end: int
+
+    def __init__(self, dave: "DaveSessionManager") -> None:
+        self._dave = dave
+        self._epoch = -1
+        self._key_ratchet = None
+        self._nonce = self._batch_end = 0
+
+    def next_key(self) -> Tuple[bytes, int] | None:
+        keys = self._dave.media_keys
+        if keys.epoch != self._epoch:  # a transition executed, what is left of the batch belongs to the old key
+            self._epoch = keys.epoch
+            self._key_ratchet = keys.key_ratchet
+            self._nonce = self._batch_end = 0
+        kr = self._key_ratchet
+        if kr is None:
+            return None
+
+        if self._nonce == self._batch_end:
+            self._nonce = next(keys.nonce_batches) * _NONCE_BATCH
+            self._batch_end = self._nonce + _NONCE_BATCH
+        nonce = self._nonce
+        self._nonce += 1
+
+        generation = nonce >> _GENERATION_SHIFT
+        if nonce % _NONCES_PER_GENERATION == _NEXT_GENERATION_PRECOMPUTE_OFFSET:
+            _ratchet_executor.submit(kr.derive, generation + 1)
+        return kr.get(generation), nonce & 0xFFFFFFFF
+
+
+# Everything touching the MLS group runs in the connection's MLS lane, the async methods wait for their turn there. The
+# next session, with the key package announcing it, is generated in advance, so resets don't wait for key generation.
 class DaveSessionManager:
     _user_id: str
-    _dave_session: openmls_dave.DaveSession
-    _key_ratchet: KeyRatchet | None
+    _lane: worker.MlsLane
+    _dave_session: openmls_dave.DaveSession | None
+    _next_session: concurrent.futures.Future
+    _media_keys: MediaKeys
     _external_sender: ExternalSender | None
-    _nonce: int
     _pending_transitions: Dict[int, Transition]
     _invalidated: bool
 
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, guild_id: str):
         self._user_id = user_id
-        self._dave_session = openmls_dave.DaveSession(user_id)
-        self._key_ratchet = None
+        self._lane = worker.MlsLane(guild_id)
+        self._dave_session = None
+        self._next_session = worker.prepare(openmls_dave.DaveSession, user_id)
+        self._media_keys = MediaKeys(0, None, itertools.count())
         self._external_sender = None
-        self._nonce = 0
         self._pending_transitions = dict()
         self._invalidated = False
 
-    def get_key_package_message(self) -> bytes:
-        return self._dave_session.get_key_package_message()
+    async def get_key_package_message(self) -> bytes:
+        return await self._lane.run("key package", self._get_key_package_message)
 
     def set_external_sender(self, identity: bytes, signature: bytes):
         self._external_sender = ExternalSender(identity, signature)
 
-    def stage_transition_from_welcome(self, transition_id: int, welcome: bytes):
+    async def stage_transition_from_welcome(self, transition_id: int, welcome: bytes):
+        await self._lane.run("welcome", self._stage_transition_from_welcome, transition_id, welcome)
+
+    async def execute_transition(self, transition_id: int) -> TransitionType | None:
+        return await self._lane.run("execute transition", self._execute_transition, transition_id)
+
+    @property
+    def media_keys(self) -> MediaKeys:
+        return self._media_keys
+
+    async def append_proposals(self, proposal_message: bytes) -> bytes | None:
+        return await self._lane.run("append proposals", self._append_proposals, proposal_message)
+
+    async def stage_transition_from_commit(self, transition_id: int, commit: bytes):
+        await self._lane.run("commit", self._stage_transition_from_commit, transition_id, commit)
+
+    async def stage_downgrade_transition(self, transition_id: int):
+        await self._lane.run("downgrade", self._add_transition, transition_id, TransitionType.DOWNGRADE)
+
+    async def reset_session(self):
+        await self._lane.run("reset", self._reset_session)
+
+    async def revoke_proposals(self, proposal_refs: bytes) -> None:
+        await self._lane.run("revoke proposals", self._revoke_proposals, proposal_refs)
+
+    # The methods below run in the MLS lane
+
+    def _session(self) -> openmls_dave.DaveSession:
+        if self._dave_session is None:
+            self._dave_session = self._take_next_session()
+        return self._dave_session
+
+    def _take_next_session(self) -> openmls_dave.DaveSession:
+        if not self._next_session.done():
+            return openmls_dave.DaveSession(self._user_id)  # the prepared one isn't ready yet, it stays for the next reset
+        try:
+            return self._next_session.result()
+        finally:
+            self._next_session = worker.prepare(openmls_dave.DaveSession, self._user_id)
+
+    def _get_key_package_message(self) -> bytes:
+        return self._session().get_key_package_message()
+
+    def _stage_transition_from_welcome(self, transition_id: int, welcome: bytes):
         if self._external_sender is None:
             raise DaveException(f"Cannot stage welcome transition with id {transition_id}: missing external sender")
 
-        self._dave_session.create_group_from_welcome(self._external_sender.identity, self._external_sender.signature, welcome)
+        self._session().create_group_from_welcome(self._external_sender.identity, self._external_sender.signature, welcome)
         self._add_transition(transition_id, TransitionType.WELCOME)
 
-    def execute_transition(self, transition_id: int) -> TransitionType | None:
+    def _execute_transition(self, transition_id: int) -> TransitionType | None:
         transition = self._pending_transitions.pop(transition_id, None)
 
         if transition is None:
@@ -80,29 +180,22 @@ class DaveSessionManager:
         if self._invalidated and transition.type != TransitionType.WELCOME:
             return None
 
-        self._key_ratchet = transition.key_ratchet
+        self._media_keys = MediaKeys(self._media_keys.epoch + 1, transition.key_ratchet, itertools.count())
 
         if transition.type == TransitionType.WELCOME:
             self._invalidated = False
 
         return transition.type
 
-    def get_current_media_key(self) -> MediaKey | None:
-        kr = self._key_ratchet
-        if kr is None:
-            return None
-
-        nonce, generation = self._get_and_advance_nonce()
-        return MediaKey(key=kr.get(generation), nonce=nonce)
-
-    def append_proposals(self, proposal_message: bytes) -> bytes | None:
+    def _append_proposals(self, proposal_message: bytes) -> bytes | None:
         if self._invalidated:
             return None
 
-        if self._dave_session.mls_group_exists():
-            result = self._dave_session.append_proposals(proposal_message)
+        session = self._session()
+        if session.mls_group_exists():
+            result = session.append_proposals(proposal_message)
         elif self._external_sender is not None:  # Initial group creation
-            result = self._dave_session.create_group_and_append_proposals(proposal_message, self._external_sender.identity, self._external_sender.signature)
+            result = session.create_group_and_append_proposals(proposal_message, self._external_sender.identity, self._external_sender.signature)
         else:
             raise DaveException("Cannot process proposals using local MLS group: missing external sender")
 
@@ -110,40 +203,33 @@ class DaveSessionManager:
             return result.commit + result.welcome
         return result.commit
 
-    def stage_transition_from_commit(self, transition_id: int, commit: bytes):
+    def _stage_transition_from_commit(self, transition_id: int, commit: bytes):
         assert self._external_sender is not None
 
         try:
-            self._dave_session.merge_commit(commit)
+            self._session().merge_commit(commit)
         except openmls_dave.DaveInvalidCommit as e:
             self._invalidated = True
             raise DaveInvalidCommitException(str(e)) from None
 
         self._add_transition(transition_id, TransitionType.COMMIT)
 
-    def stage_downgrade_transition(self, transition_id: int):
-        self._add_transition(transition_id, TransitionType.DOWNGRADE)
-
-    def reset_session(self):
-        self._dave_session = openmls_dave.DaveSession(self._user_id)
-        self._nonce = 0
+    # Media keeps the current key until a transition replaces it
+    def _reset_session(self):
+        self._dave_session = self._take_next_session()
         self._pending_transitions.clear()
 
-    def revoke_proposals(self, proposal_refs: bytes) -> None:
+    def _revoke_proposals(self, proposal_refs: bytes) -> None:
         if self._invalidated:
             return
 
-        self._dave_session.remove_proposals(proposal_refs)
-
-    def _get_and_advance_nonce(self) -> Tuple[int, int]:
-        current_nonce = self._nonce & 0xFFFFFFFF
-        current_gen = self._nonce >> 24
-        self._nonce += 1
-        return current_nonce, current_gen
+        self._session().remove_proposals(proposal_refs)
 
     def _key_ratchet_from_current_state(self) -> KeyRatchet:
-        return KeyRatchet(self._dave_session.export_base_sender_key())
+        return KeyRatchet(self._session().export_base_sender_key())
 
     def _add_transition(self, transition_id: int, transition_type: TransitionType):
         kr = self._key_ratchet_from_current_state() if transition_type != TransitionType.DOWNGRADE else None
+        if kr is not None:  # its nonces start over from 0 once executed
+            _ratchet_executor.submit(kr.derive, 1)
         self._pending_transitions[transition_id] = Transition(transition_id, transition_type, kr)
@@ -0,0 +1,102 @@
+import asyncio
+import concurrent.futures
+import profiling
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from logs import logger as base_logger
+from typing import Any, Callable, Deque, Tuple, TypeVar
+
+logger = base_logger.bind(context="MLS")
+
+_WORKERS = 2
+# Operations at least this slow, counting the wait behind earlier ones, are logged at INFO rather than DEBUG
+_SLOW_OPERATION = 0.05  # seconds
+
+T = TypeVar("T")
+
+# openmls releases the GIL while it computes, so these threads run MLS operations alongside the event loop and the
+# stream threads instead of stalling them
+_executor = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="dave-mls")
+
+
+# Runs fn in an MLS worker thread outside of any lane, for work that doesn't touch a group (e.g. new sessions)
+def prepare(fn: Callable[..., T], *args: Any) -> concurrent.futures.Future:
+    return _executor.submit(fn, *args)
+
+
+@dataclass(frozen=True, kw_only=True)
+class _Operation:
+    name: str
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...]
+    future: asyncio.Future
+    submitted: int  # perf_counter_ns
+
+
+# The MLS operations of one voice connection, run in an MLS worker thread one at a time and in the order they were
+# submitted, as the group state they share requires. Lanes of different guilds run in parallel.
+class MlsLane:
+    _owner: str
+    _operations: Deque[_Operation]
+    _lock: threading.Lock
+    _draining: bool
+
+    def __init__(self, owner: str) -> None:
+        self._owner = owner
+        self._operations = deque()
+        self._lock = threading.Lock()
+        self._draining = False
+
+    # Cancelling the returned future does not cancel the operation, later ones still see its effects
+    def run(self, name: str, fn: Callable[..., T], *args: Any) -> "asyncio.Future[T]":
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._operations.append(_Operation(name=name, fn=fn, args=args, future=future, submitted=time.perf_counter_ns()))
+            if self._draining:
+                return future
+            self._draining = True
+        _executor.submit(self._drain)
+        return future
+
+    # Runs the next operation, then goes back in line behind the other lanes, so a busy channel doesn't starve the rest
+    def _drain(self) -> None:
+        with self._lock:
+            operation = self._operations.popleft()
+        self._run(operation)
+        with self._lock:
+            if not self._operations:
+                self._draining = False
+                return
+        _executor.submit(self._drain)
+
+    def _run(self, operation: _Operation) -> None:
+        result, error = None, None
+        started = time.perf_counter_ns()
+        profiling_started = profiling.start()
+        try:
+            result = operation.fn(*operation.args)
+        except BaseException as e:  # openmls panics surface as BaseException
+            error = e
+        profiling.stop(f"mls {operation.name}", profiling_started)
+        finished = time.perf_counter_ns()
+
+        waited, took = (started - operation.submitted) / 1e9, (finished - started) / 1e9
+        logger.log("INFO" if waited + took >= _SLOW_OPERATION else "DEBUG",
+                   "{} in guild {} took {:.1f} ms after waiting {:.1f} ms", operation.name, self._owner, took * 1000, waited * 1000)
+        try:
+            operation.future.get_loop().call_soon_threadsafe(_settle, operation.future, result, error)
+        except RuntimeError:
+            pass  # the event loop is gone, nobody waits for the result anymore
+
+
+def _settle(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -1,5 +1,6 @@
 import json
 
+from dataclasses import dataclass, field
 from enum import Enum, unique
 from typing import Dict, Any
 
@@ -17,7 +18,30 @@ class OpCode(Enum):
     HEARTBEAT_ACK = 11
 
 
+# The fields of a VOICE_STATE_UPDATE dispatch handlers use. Joins waiting for one keep this view, and the rest of the
+# payload (member, roles, avatars, ...) is freed with the event
+@dataclass(frozen=True, slots=True, kw_only=True)
+class VoiceState:
+    guild_id: str
+    channel_id: str | None
+    user_id: str
+    username: str
+    session_id: str
+    self_mute: bool
+    self_deaf: bool
+    self_stream: bool
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class VoiceServer:
+    guild_id: str
+    endpoint: str | None  # None while Discord has no voice server for the guild
+    token: str = field(repr=False)  # kept out of logs
+
+
 class Event:
+    __slots__ = ("_opcode", "_seq_num", "_name", "_parsed")
+
     _opcode: OpCode
     _seq_num: int | None
     _name: str | None
@@ -42,11 +66,32 @@ class Event:
     def name(self) -> str | None:
         return self._name
 
+    @property
+    def data(self) -> Any:
+        return self._parsed
+
     def __getitem__(self, key: str) -> Any:
         return self._parsed[key]
 
     def __contains__(self, key: str) -> bool:
         return key in self._parsed
 
+    def voice_state(self) -> VoiceState:
+        d = self._parsed
+        member = d.get("member")
+        return VoiceState(guild_id=d.get("guild_id", ""),
+                          channel_id=d["channel_id"],
+                          user_id=d["user_id"],
+                          username=member["user"]["username"] if member is not None else "",
+                          session_id=d["session_id"],
+                          self_mute=d.get("self_mute", False),
+                          self_deaf=d.get("self_deaf", False),
+                          self_stream=d.get("self_stream", False))
+
+    def voice_server(self) -> VoiceServer:
+        d = self._parsed
+        return VoiceServer(guild_id=d["guild_id"], endpoint=d["endpoint"], token=d["token"])
+
+    # Only formatted when a log line is actually emitted, call sites pass the event as a logger argument
     def __str__(self) -> str:
         return f"Opcode: {self.opcode}, Seq: {self.seq_num}, Name: {self.name}, Data: {self._parsed}"
@@ -0,0 +1,44 @@
+import gzip
+import struct
+import time
+
+from pathlib import Path
+from typing import Iterator, Tuple
+
+_MAGIC = b"MCGW1\n"
+_RECORD_HEADER_FORMAT = "<dI"  # seconds since the recording started, frame length
+_RECORD_HEADER_SIZE = struct.calcsize(_RECORD_HEADER_FORMAT)
+
+
+# Appends every frame received from the gateway, with its arrival time, to a gzip compressed capture.
+# Captures contain interaction tokens, so they shouldn't be shared.
+class GatewayRecorder:
+    _file: gzip.GzipFile
+    _start: float
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(path, "wb", compresslevel=6)
+        self._file.write(_MAGIC)
+        self._start = time.perf_counter()
+
+    def record(self, frame: str) -> None:
+        data = frame.encode()
+        self._file.write(struct.pack(_RECORD_HEADER_FORMAT, time.perf_counter() - self._start, len(data)) + data)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_recording(path: Path) -> Iterator[Tuple[float, str]]:
+    with gzip.open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not a gateway capture")
+        while header := f.read(_RECORD_HEADER_SIZE):
+            if len(header) < _RECORD_HEADER_SIZE:
+                return  # the recording was cut off mid record
+            elapsed, length = struct.unpack(_RECORD_HEADER_FORMAT, header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield elapsed, data.decode()
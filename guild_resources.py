@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+
+from event import VoiceServer, VoiceState
+from typing import Dict, List, Tuple, TYPE_CHECKING
+from logs import logger as base_logger
+
+if TYPE_CHECKING:
+    from voice_client import VoiceClient
+
+logger = base_logger.bind(context="GuildResources")
+
+_REAP_INTERVAL = 60.0
+
+
+# What one guild holds while the bot is connected to voice there, or joining
+class _Guild:
+    __slots__ = ("voice_client", "voice_state_update", "voice_server_update", "expected_since")
+
+    voice_client: "VoiceClient | None"
+    voice_state_update: asyncio.Future[VoiceState] | None
+    voice_server_update: asyncio.Future[VoiceServer] | None
+    expected_since: float
+
+    def __init__(self) -> None:
+        self.voice_client = None
+        self.voice_state_update = None
+        self.voice_server_update = None
+        self.expected_since = 0.0
+
+    def empty(self) -> bool:
+        return self.voice_client is None and self.voice_state_update is None and self.voice_server_update is None
+
+    def discard_voice_updates(self) -> None:
+        for future in (self.voice_state_update, self.voice_server_update):
+            if future is not None and not future.done():
+                future.cancel()
+        self.voice_state_update = self.voice_server_update = None
+
+
+# Owns every per-guild resource of the process, shared by all shards. Guilds are dropped as soon as their voice client
+# closes or their join fails, so memory follows the number of guilds currently in voice, not of those that ever were.
+class GuildRegistry:
+    _guilds: Dict[str, _Guild]
+    _update_timeout: float
+
+    def __init__(self, update_timeout: float) -> None:
+        self._guilds = {}
+        self._update_timeout = update_timeout
+
+    def voice_client(self, guild_id: str) -> "VoiceClient | None":
+        guild = self._guilds.get(guild_id)
+        if guild is None or guild.voice_client is None or guild.voice_client.closed:
+            return None
+        return guild.voice_client
+
+    def voice_clients(self) -> Dict[str, "VoiceClient"]:
+        return {guild_id: guild.voice_client for guild_id, guild in self._guilds.items()
+                if guild.voice_client is not None and not guild.voice_client.closed}
+
+    def add_voice_client(self, guild_id: str, voice_client: "VoiceClient") -> None:
+        self._guilds.setdefault(guild_id, _Guild()).voice_client = voice_client
+
+    # Called once a voice client closed, returns False if a newer voice client already took its place
+    def release(self, guild_id: str, voice_client: "VoiceClient") -> bool:
+        guild = self._guilds.get(guild_id)
+        if guild is None or guild.voice_client is not voice_client:
+            return False
+        guild.voice_client = None
+        self._drop_if_empty(guild_id)
+        return True
+
+    def expect_voice_updates(self, guild_id: str) -> Tuple[asyncio.Future[VoiceState], asyncio.Future[VoiceServer]]:
+        loop = asyncio.get_running_loop()
+        guild = self._guilds.setdefault(guild_id, _Guild())
+        guild.discard_voice_updates()
+        guild.voice_state_update = loop.create_future()
+        guild.voice_server_update = loop.create_future()
+        guild.expected_since = time.monotonic()
+        return guild.voice_state_update, guild.voice_server_update
+
+    def resolve_voice_state_update(self, guild_id: str, state: VoiceState) -> None:
+        guild = self._guilds.get(guild_id)
+        if guild is not None and guild.voice_state_update is not None and not guild.voice_state_update.done():
+            guild.voice_state_update.set_result(state)
+
+    def resolve_voice_server_update(self, guild_id: str, server: VoiceServer) -> None:
+        guild = self._guilds.get(guild_id)
+        if guild is not None and guild.voice_server_update is not None and not guild.voice_server_update.done():
+            guild.voice_server_update.set_result(server)
+
+    # Called when a join finished, successfully or not
+    def discard_voice_updates(self, guild_id: str) -> None:
+        guild = self._guilds.get(guild_id)
+        if guild is not None:
+            guild.discard_voice_updates()
+            self._drop_if_empty(guild_id)
+
+    # A safety net for whatever slipped past release and discard_voice_updates, which would be a bug worth a warning
+    def reap(self) -> None:
+        now = time.monotonic()
+        for guild_id, guild in list(self._guilds.items()):
+            if guild.voice_client is not None and guild.voice_client.closed:
+                logger.warning(f"Reaping closed voice client of guild {guild_id}")
+                guild.voice_client = None
+            if guild.voice_state_update is not None and now - guild.expected_since > 2 * self._update_timeout:
+                logger.warning(f"Reaping voice update futures of guild {guild_id} pending for {now - guild.expected_since:.0f} s")
+                guild.discard_voice_updates()
+            self._drop_if_empty(guild_id)
+
+    async def reap_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(_REAP_INTERVAL)
+            self.reap()
+
+    def report(self) -> List[str]:
+        lines = [f"{len(self._guilds)} guilds holding resources, RSS {_rss() / 2**20:.1f} MiB"]
+        for guild_id, guild in sorted(self._guilds.items()):
+            usage = guild.voice_client.resource_usage() if guild.voice_client is not None else {}
+            usage["pending voice updates"] = sum(future is not None for future in (guild.voice_state_update, guild.voice_server_update))
+            lines.append(f"guild {guild_id}: " + ", ".join(f"{name} {count}" for name, count in usage.items()))
+        return lines
+
+    def log_report(self) -> None:
+        for line in self.report():
+            logger.info(line)
+
+    def _drop_if_empty(self, guild_id: str) -> None:
+        guild = self._guilds.get(guild_id)
+        if guild is not None and guild.empty():
+            del self._guilds[guild_id]
+
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
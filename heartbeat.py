@@ -0,0 +1,62 @@
+import statistics
+import time
+
+from collections import deque
+from typing import Deque, Tuple
+
+
+_RTT_WINDOW = 32
+
+
+# Tracks heartbeat round-trip times of a gateway connection and notices when acknowledgements stop coming,
+# which is how a half-open connection shows up long before TCP gives up on it. On a slow link an acknowledgement
+# can arrive after the next heartbeat went out, so every unacknowledged heartbeat is kept until its own arrives.
+class HeartbeatMonitor:
+    _max_missed: int
+    _pending: Deque[Tuple[int | None, float]]  # nonce and send time of each unacknowledged heartbeat, oldest first
+    _rtts: Deque[float]
+
+    def __init__(self, max_missed: int) -> None:
+        self._max_missed = max_missed
+        self._pending = deque(maxlen=max_missed + 1)
+        self._rtts = deque(maxlen=_RTT_WINDOW)
+
+    @property
+    def latency(self) -> float | None:
+        return self._rtts[-1] if self._rtts else None
+
+    @property
+    def average_latency(self) -> float | None:
+        return statistics.fmean(self._rtts) if self._rtts else None
+
+    @property
+    def max_latency(self) -> float | None:
+        return max(self._rtts) if self._rtts else None
+
+    @property
+    def missed(self) -> int:
+        return len(self._pending)
+
+    def reset(self) -> None:
+        self._pending.clear()
+
+    # Called once per heartbeat interval, before sending the next heartbeat
+    def expired(self) -> bool:
+        return len(self._pending) >= self._max_missed
+
+    def sent(self, nonce: int | None = None) -> None:
+        self._pending.append((nonce, time.perf_counter()))
+
+    # Returns the round-trip time, or None if the acknowledgement matches no unacknowledged heartbeat. Without nonces,
+    # acknowledgements are matched to heartbeats in the order they were sent.
+    def acked(self, nonce: int | None = None) -> float | None:
+        for i, (pending_nonce, sent_at) in enumerate(self._pending):
+            if pending_nonce == nonce:
+                break
+        else:
+            return None
+        for _ in range(i + 1):  # heartbeats sent before the acknowledged one won't be acknowledged anymore
+            self._pending.popleft()
+        rtt = time.perf_counter() - sent_at
+        self._rtts.append(rtt)
+        return rtt
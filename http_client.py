@@ -6,7 +6,7 @@ from urllib.parse import urlencode
 
 from config import Config
 from event import Event
-from typing import Dict, Any
+from typing import Dict, Any, List
 from logs import logger as base_logger
 from interactions import InteractionType, InteractionFlag
 
@@ -17,25 +17,41 @@ class HttpClient:
     _config: Config
     _api_url: str
     _aclient: httpx.AsyncClient
-    _client: httpx.Client
 
     def __init__(self, config: Config):
         headers = {"Authorization": f"Bot {config.api_token}"}
         self._config = config
         self._api_url = f"{config.api_url}/{config.api_version}"
         self._aclient = httpx.AsyncClient(headers=headers)
-        self._client = httpx.Client(headers=headers)
 
-    def get_gateway_url(self) -> str:
-        base_url = self._get("/gateway")["url"]
+    async def get_gateway_bot(self, timeout: float) -> Dict[str, Any] | None:
+        try:
+            resp = await self._aclient.get(f"{self._api_url}/gateway/bot", timeout=timeout)
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not fetch gateway information: {e!r}")
+            return None
+        if resp.status_code != 200:
+            logger.warning(f"Could not fetch gateway information, STATUS {resp.status_code}, BODY: {resp.text}")
+            return None
+        return resp.json()
+
+    def gateway_url(self, base_url: str) -> str:
         params = {"v": self._config.api_version, "encoding": self._config.encoding}
         return f"{base_url}?/{urlencode(params)}"
 
-    def create_slash_command(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        logger.log("OUT", f"Creating command {json.dumps(params)}")
-        resp = self._post(f"/applications/{self._config.application_id}/commands", body=params).json()
-        logger.log("IN", f"Command creation response: {resp}")
-        return resp
+    # Replaces all global commands of the application in a single request
+    async def overwrite_commands(self, commands: List[Dict[str, Any]]) -> bool:
+        logger.log("OUT", f"Overwriting commands {json.dumps(commands)}")
+        try:
+            resp = await self._aclient.put(f"{self._api_url}/applications/{self._config.application_id}/commands", json=commands, timeout=10.0)
+        except httpx.HTTPError as e:
+            logger.warning(f"Command overwrite failed: {e!r}")
+            return False
+        if resp.status_code != 200:
+            logger.warning(f"Command overwrite failed, STATUS {resp.status_code}, BODY: {resp.text}")
+            return False
+        logger.log("IN", f"Command overwrite response: {resp.json()}")
+        return True
 
     async def get_user_voice_channel(self, guild_id: str, user_id: str) -> str | None:
         resp = await self._aget(f"/guilds/{guild_id}/voice-states/{user_id}")
@@ -67,11 +83,17 @@ class HttpClient:
 
         return success
 
-    def _get(self, path: str) -> Dict[str, Any]:
-        return self._client.get(f"{self._api_url}{path}").json()
-
-    def _post(self, path: str, body: Dict[str, Any]) -> httpx.Response:
-        return self._client.post(f"{self._api_url}{path}", json=body)
+    async def respond_autocomplete(self, interaction_event: Event, choices: List[Dict[str, str]]) -> bool:
+        respond_url = f"/interactions/{interaction_event['id']}/{interaction_event['token']}/callback"
+        try:
+            resp = await self._apost(respond_url, {"type": InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE_RESULT, "data": {"choices": choices}})
+        except httpx.TimeoutException as e:
+            logger.warning(f"AUTOCOMPLETE {interaction_event['id']} RESPONSE TIMEOUT: {e}")
+            return False
+        if resp.status_code >= 300:
+            logger.warning(f"AUTOCOMPLETE {interaction_event['id']} RESPONSE ERROR, STATUS {resp.status_code}, BODY: {resp.text}")
+            return False
+        return True
 
     async def _aget(self, path: str) -> Dict[str, Any]:
         return (await self._aclient.get(f"{self._api_url}{path}")).json()
@@ -1,6 +1,13 @@
+# Types of interactions received
+class InteractionRequestType:
+    APPLICATION_COMMAND: int = 2
+    APPLICATION_COMMAND_AUTOCOMPLETE: int = 4
+
+
 class InteractionType:
     CHANNEL_MESSAGE_WITH_SOURCE: int = 4
     DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE: int = 5
+    APPLICATION_COMMAND_AUTOCOMPLETE_RESULT: int = 8
 
 
 class InteractionFlag:
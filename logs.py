@@ -1,27 +1,174 @@
 from arguments import args
+import atexit
+import queue
 import sys
+import threading
+import time
 from loguru import logger as base_logger
 from pathlib import Path
+from typing import Dict, List, TextIO
 
 LOGS_PATH = Path(args.logfile)
 
+_MAX_BATCH_SIZE = 1024  # lines
+_MAX_QUEUED_LINES = 100_000  # past this, lines are dropped rather than letting memory grow while the writer is stuck
+_REOPEN_INTERVAL = 10.0  # seconds between attempts to reopen or rotate the log file after a failure
 
-class Tee:
-    def __init__(self, original_stream, file_path):
-        self.original_stream = original_stream
-        self.file = open(file_path, "a", buffering=1)
 
-    def write(self, message):
-        self.original_stream.write(message)
-        self.file.write(message)
+# Stands in for stderr: writes are only enqueued, and a background thread copies them in batches to the real stderr
+# and to the log file, rotating the file once it gets too large or too old. This way callers on the event loop and
+# in stream threads never wait for the terminal or the disk. If the file can't be written (full disk, deleted log
+# directory, ...), lines still reach stderr and the file is reopened later.
+class QueuedLogWriter:
+    _stream: TextIO
+    _path: Path
+    _max_bytes: int
+    _max_age: float
+    _backups: int
+    _queue: queue.Queue
+    _dropped: int
+    _dropped_lock: threading.Lock
+    _thread: threading.Thread
 
-    def flush(self):
-        self.original_stream.flush()
-        self.file.flush()
+    def __init__(self, stream: TextIO, path: Path, max_bytes: int, max_age: float, backups: int) -> None:
+        self._stream = stream
+        self._path = path
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._backups = backups
+        self._queue = queue.Queue(maxsize=_MAX_QUEUED_LINES)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+    def flush(self) -> None:
+        pass  # batches are flushed as soon as they are written
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        file = self._open()
+        opened_at = time.time()
+        retry_at = opened_at + _REOPEN_INTERVAL
+        while True:
+            batch: List[str | None] = [self._queue.get()]
+            while len(batch) < _MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in batch
+            text = "".join(line for line in batch if line is not None)
+            with self._dropped_lock:
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                text = f"{dropped} log lines were dropped because the log writer fell behind\n" + text
+            try:
+                self._stream.write(text)
+                self._stream.flush()
+            except OSError:
+                pass  # nowhere left to report it
+
+            now = time.time()
+            if file is None and now >= retry_at:
+                file, opened_at, retry_at = self._open(), now, now + _REOPEN_INTERVAL
+            if file is not None:
+                try:
+                    file.write(text)
+                    file.flush()
+                except OSError as e:
+                    self._report(f"Writing to log file {self._path} failed ({e!r}), retrying in {_REOPEN_INTERVAL:g} s")
+                    self._close(file)
+                    file, retry_at = None, now + _REOPEN_INTERVAL
+
+            if stopping:
+                if file is not None:
+                    self._close(file)
+                return
+            if file is not None and now >= retry_at and (file.tell() >= self._max_bytes or now - opened_at >= self._max_age):
+                self._close(file)
+                try:
+                    self._rotate()
+                except OSError as e:
+                    self._report(f"Rotating log file {self._path} failed ({e!r}), retrying in {_REOPEN_INTERVAL:g} s")
+                file, opened_at, retry_at = self._open(), now, now + _REOPEN_INTERVAL
+
+    def _open(self) -> TextIO | None:
+        try:
+            return open(self._path, "a")
+        except OSError as e:
+            self._report(f"Opening log file {self._path} failed ({e!r}), retrying in {_REOPEN_INTERVAL:g} s")
+            return None
+
+    def _close(self, file: TextIO) -> None:
+        try:
+            file.close()
+        except OSError:
+            pass  # the buffered lines are lost, the file is reopened later anyway
+
+    def _report(self, message: str) -> None:
+        try:
+            self._stream.write(message + "\n")
+            self._stream.flush()
+        except OSError:
+            pass
+
+    def _rotate(self) -> None:
+        timestamp = time.strftime("%Y%m%d-%H%M%S") + f"{time.time() % 1:.3f}"[1:]
+        self._path.rename(self._path.with_name(f"{self._path.name}.{timestamp}"))
+        rotated = sorted(self._path.parent.glob(f"{self._path.name}.*"))
+        for old in rotated[:max(0, len(rotated) - self._backups)]:
+            old.unlink(missing_ok=True)
+
+
+# Token bucket per category of high-volume lines. Call sites check it before building the message,
+# so lines that get sampled out cost no formatting at all
+class _Sampler:
+    _rate: float
+    _tokens: Dict[str, float]
+    _updated: Dict[str, float]
+    _suppressed: Dict[str, int]
+    _lock: threading.Lock
+
+    def __init__(self, rate: float) -> None:
+        self._rate = rate
+        self._tokens = {}
+        self._updated = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def sample(self, category: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self._updated.get(category, now)
+            tokens = min(self._rate, self._tokens.get(category, self._rate) + elapsed * self._rate)
+            self._updated[category] = now
+            if tokens < 1:
+                self._tokens[category] = tokens
+                self._suppressed[category] = self._suppressed.get(category, 0) + 1
+                return False
+            self._tokens[category] = tokens - 1
+            suppressed = self._suppressed.pop(category, 0)
+        if suppressed:
+            logger.info(f"Suppressed {suppressed} {category} lines (limit {self._rate:g} per second)")
+        return True
 
 
 LOGS_PATH.parent.mkdir(exist_ok=True)
-sys.stderr = Tee(sys.stderr, LOGS_PATH)
+_log_writer = QueuedLogWriter(sys.stderr, LOGS_PATH, args.log_max_size * 1024 * 1024, args.log_max_age * 3600, args.log_backups)
+sys.stderr = _log_writer
+atexit.register(_log_writer.stop)
 
 base_logger.level("IN", no=20, color="<yellow>")
 base_logger.level("OUT", no=20, color="<cyan>")
@@ -30,3 +177,9 @@ base_logger.remove()
 base_logger.add(sys.stderr, colorize=True, format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> - <level>{level}</level>: <b>[{extra[context]}]</b> {message}")
 
 logger = base_logger.opt(colors=True).bind(context="DEFAULT")
+
+_sampler = _Sampler(args.log_rate_limit)
+
+
+def sample(category: str) -> bool:
+    return _sampler.sample(category)
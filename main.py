@@ -2,26 +2,48 @@
 
 import asyncio
 import commands
+import hashlib
+import json
+import profiling
 
 from arguments import args
-from client import Client
 from intents import Intent
 from config import Config
 from http_client import HttpClient
+from logs import logger as base_logger
+from shard_manager import ShardManager
+
+logger = base_logger.bind(context="Main")
 
 voice_client = None
 song_task = None
 
 
+# Commands are only sent to Discord when their definitions changed since the last successful registration
+async def register_commands(http_client: HttpClient, config: Config) -> None:
+    definitions = json.dumps(commands.ALL, sort_keys=True)
+    digest = hashlib.sha256(f"{config.application_id}\n{definitions}".encode()).hexdigest()
+    hash_path = config.state_dir / "commands.sha256"
+    if hash_path.is_file() and hash_path.read_text() == digest:
+        logger.info("Commands are unchanged, skipping registration")
+        return
+    if await http_client.overwrite_commands(commands.ALL):
+        hash_path.parent.mkdir(parents=True, exist_ok=True)
+        hash_path.write_text(digest)
+
+
+async def run(config: Config) -> None:
+    http_client = HttpClient(config)
+    shard_manager = ShardManager(http_client, Intent.GUILD_VOICE_STATES, config)
+    await asyncio.gather(register_commands(http_client, config), shard_manager.start())
+
+
 def main():
     config = Config(env_file=args.env)
-    http_client = HttpClient(config)
-    http_client.create_slash_command(commands.Play)
-    http_client.create_slash_command(commands.Skip)
-    client = Client(http_client, Intent.GUILD_VOICE_STATES, config)
+    profiling.install_signal_handler()
 
     try:
-        asyncio.run(client.start())
+        asyncio.run(run(config))
     except KeyboardInterrupt:  # Python <= 3.10
         pass
 
@@ -2,7 +2,7 @@ import asyncio
 import opus
 
 from dataclasses import dataclass, field
-from typing import Callable, Iterator
+from typing import Callable, Generator
 from pathlib import Path
 
 
@@ -28,8 +28,8 @@ class MediaFile:
     def duration_str(self) -> str:
         return f"{self.duration // 60}:{self.duration % 60:02d}"
 
-    def opus_packets(self) -> Iterator[bytes]:
-        return opus.encode(str(self.file_path))
+    def opus_packets(self, encoder_settings: opus.EncoderSettings, start: float = 0.0) -> Generator[bytes | None, None, None]:
+        return opus.encode(str(self.file_path), encoder_settings, start)
 
     def __post_init__(self):
         object.__setattr__(self, "downloaded", asyncio.get_running_loop().create_future())
@@ -1,3 +1,3 @@
-from .encode import encode
+from .encode import encode, EncoderSettings, SKIPPED_FRAME
 
-__all__ = ["encode"]
+__all__ = ["encode", "EncoderSettings", "SKIPPED_FRAME"]
@@ -0,0 +1,413 @@
+import bisect
+import itertools
+import json
+import os
+import struct
+
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+_EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+_OGG_MAGIC = b'OggS'
+
+_EBML_ID_SEGMENT = 0x18538067
+_EBML_ID_CLUSTER = 0x1F43B675
+_EBML_ID_TRACKS = 0x1654AE6B
+_EBML_ID_TRACK_ENTRY = 0xAE
+_EBML_ID_TRACK_NUMBER = 0xD7
+_EBML_ID_CODEC_ID = 0x86
+_EBML_ID_BLOCK_GROUP = 0xA0
+_EBML_ID_BLOCK = 0xA1
+_EBML_ID_SIMPLE_BLOCK = 0xA3
+_EBML_ID_INFO = 0x1549A966
+_EBML_ID_TIMECODE_SCALE = 0x2AD7B1
+_EBML_ID_CLUSTER_TIMECODE = 0xE7
+_EBML_MASTER_IDS = {_EBML_ID_SEGMENT, _EBML_ID_CLUSTER, _EBML_ID_TRACKS, _EBML_ID_TRACK_ENTRY, _EBML_ID_BLOCK_GROUP, _EBML_ID_INFO}
+_DEFAULT_TIMECODE_SCALE = 1000000  # nanoseconds
+
+_MATROSKA_OPUS_CODEC_ID = "A_OPUS"
+
+_OGG_PAGE_HEADER_FORMAT = "<4sBBqIIIB"
+_OGG_PAGE_HEADER_SIZE = struct.calcsize(_OGG_PAGE_HEADER_FORMAT)
+
+_OGG_CONTINUED_PACKET_FLAG = 0x01
+
+_SAMPLING_RATE = 48000
+_FRAME_SAMPLES_20MS = 960
+_FRAME_SAMPLES_10MS = 480
+_PROBE_PACKETS = 50
+
+
+class OpusDemuxException(Exception):
+    pass
+
+
+# Maps container timestamps to file offsets where demuxing can start, e.g. Matroska clusters or Ogg pages
+@dataclass
+class _SeekIndex:
+    container: str
+    stream_id: int | None = None  # Opus track number (Matroska) or stream serial number (Ogg)
+    pre_skip: int = 0
+    times: List[float] = field(default_factory=list)
+    offsets: List[int] = field(default_factory=list)
+
+    def add(self, time: float, offset: int) -> None:
+        if not self.times or time > self.times[-1]:
+            self.times.append(time)
+            self.offsets.append(offset)
+
+    def lookup(self, position: float) -> Tuple[float, int] | None:
+        i = bisect.bisect_right(self.times, position) - 1
+        if i < 0 or self.stream_id is None:
+            return None
+        return self.times[i], self.offsets[i]
+
+
+def _index_path(filename: str) -> Path:
+    return Path(f"{filename}.index.json")
+
+
+def _load_index(filename: str, container: str) -> _SeekIndex:
+    try:
+        index = _SeekIndex(**json.loads(_index_path(filename).read_text()))
+        if index.container == container:
+            return index
+    except (OSError, ValueError, TypeError):
+        pass
+    return _SeekIndex(container)
+
+
+def probe(filename: str) -> bool:
+    try:
+        for _ in itertools.islice(_opus_frames(filename, 0.0, persist_index=False), _PROBE_PACKETS):
+            pass
+    except (OpusDemuxException, OSError):
+        return False
+    return True
+
+
+# Indexes the whole file once, so that any later seek starts demuxing near its target instead of wherever indexing
+# left off. Meant to run right after the download, in the thread that did it.
+def build_index(filename: str) -> None:
+    with open(filename, "rb") as f:
+        container = _container(f.read(4))
+        f.seek(0)
+        index = _SeekIndex(container)
+        if container == "matroska":
+            packets = _matroska_packets(f, index, resume=False, index_only=True)
+        else:
+            packets = _ogg_packets(f, index, resume=False)
+        for _ in packets:
+            pass
+    _index_path(filename).write_text(json.dumps(asdict(index)))
+
+
+def _container(magic: bytes) -> str:
+    if magic == _EBML_MAGIC:
+        return "matroska"
+    if magic == _OGG_MAGIC:
+        return "ogg"
+    raise OpusDemuxException("Unsupported container")
+
+
+def opus_frames(filename: str, start: float = 0.0) -> Iterator[bytes]:
+    return _opus_frames(filename, start, persist_index=True)
+
+
+def _opus_frames(filename: str, start: float, persist_index: bool) -> Iterator[bytes]:
+    with open(filename, "rb") as f:
+        container = _container(f.read(4))
+        index = _load_index(filename, container)
+
+        entry = index.lookup(start) if start > 0 else None
+        position, offset = entry if entry is not None else (0.0, 0)
+        f.seek(offset)
+
+        if container == "matroska":
+            packets = _matroska_packets(f, index, resume=entry is not None)
+        else:
+            packets = _ogg_packets(f, index, resume=entry is not None)
+
+        skip = round((start - position) * 1000 / 20) if start > position else 0
+        try:
+            yield from itertools.islice(_reframe(packets), skip, None)
+        finally:
+            # build_index may have stored a complete index meanwhile
+            if persist_index and len(index.times) > len(_load_index(filename, container).times):
+                _index_path(filename).write_text(json.dumps(asdict(index)))
+
+
+# Matroska/WebM
+
+def _vint_length(first_byte: int) -> int:
+    if first_byte == 0:
+        raise OpusDemuxException("Invalid EBML variable size integer")
+    return 9 - first_byte.bit_length()
+
+
+def _vint_value(raw: bytes) -> int | None:
+    data_bits = 7 * len(raw)
+    value = int.from_bytes(raw) & ((1 << data_bits) - 1)
+    return None if value == (1 << data_bits) - 1 else value
+
+
+def _read_vint(f: BinaryIO) -> bytes | None:
+    first = f.read(1)
+    if not first:
+        return None
+    length = _vint_length(first[0])
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        return None
+    return first + rest
+
+
+def _parse_vint(data: bytes, offset: int) -> Tuple[int, int]:
+    length = _vint_length(data[offset])
+    value = _vint_value(data[offset:offset + length])
+    if value is None:
+        raise OpusDemuxException("Unexpected unknown size EBML integer")
+    return value, offset + length
+
+
+# With index_only, blocks are skipped rather than read, only cluster timecodes are of interest
+def _matroska_packets(f: BinaryIO, index: _SeekIndex, resume: bool, index_only: bool = False) -> Iterator[bytes]:
+    track_entries: List[Dict[int, bytes]] = []
+    opus_track = index.stream_id if resume else None
+    timecode_scale = _DEFAULT_TIMECODE_SCALE
+    cluster_offset = 0
+
+    while True:
+        element_offset = f.tell()
+        raw_id = _read_vint(f)
+        raw_size = _read_vint(f) if raw_id is not None else None
+        if raw_id is None or raw_size is None:
+            return
+
+        element_id = int.from_bytes(raw_id)
+        size = _vint_value(raw_size)
+
+        if element_id == _EBML_ID_TRACK_ENTRY:
+            track_entries.append({})
+        elif element_id == _EBML_ID_CLUSTER:
+            cluster_offset = element_offset
+        if element_id in _EBML_MASTER_IDS:
+            continue  # descend into children, which also handles unknown sized segments and clusters
+        if size is None:
+            raise OpusDemuxException(f"Unknown size for non-master element {element_id:#x}")
+
+        if element_id in (_EBML_ID_TRACK_NUMBER, _EBML_ID_CODEC_ID) and track_entries:
+            track_entries[-1][element_id] = f.read(size)
+        elif element_id == _EBML_ID_TIMECODE_SCALE:
+            timecode_scale = int.from_bytes(f.read(size))
+        elif element_id == _EBML_ID_CLUSTER_TIMECODE:
+            index.add(int.from_bytes(f.read(size)) * timecode_scale / 1e9, cluster_offset)
+        elif element_id in (_EBML_ID_SIMPLE_BLOCK, _EBML_ID_BLOCK):
+            if opus_track is None:
+                opus_track = _find_opus_track(track_entries)
+                index.stream_id = opus_track
+            if index_only:
+                f.seek(size, os.SEEK_CUR)
+            else:
+                yield from _block_packets(f.read(size), opus_track)
+        else:
+            f.seek(size, os.SEEK_CUR)
+
+
+def _find_opus_track(track_entries: List[Dict[int, bytes]]) -> int:
+    for entry in track_entries:
+        codec_id = entry.get(_EBML_ID_CODEC_ID, b"").rstrip(b"\x00").decode("ascii", errors="replace")
+        if codec_id == _MATROSKA_OPUS_CODEC_ID and _EBML_ID_TRACK_NUMBER in entry:
+            return int.from_bytes(entry[_EBML_ID_TRACK_NUMBER])
+    raise OpusDemuxException("No Opus track found")
+
+
+def _block_packets(block: bytes, opus_track: int) -> Iterator[bytes]:
+    track_number, offset = _parse_vint(block, 0)
+    if track_number != opus_track:
+        return
+
+    flags = block[offset + 2]  # skips the 16 bit relative timecode
+    offset += 3
+    lacing = (flags >> 1) & 0x3
+
+    if lacing == 0:
+        yield block[offset:]
+        return
+
+    frame_count = block[offset] + 1
+    offset += 1
+    sizes: List[int] = []
+
+    match lacing:
+        case 1:  # Xiph
+            for _ in range(frame_count - 1):
+                size = 0
+                while True:
+                    lace = block[offset]
+                    offset += 1
+                    size += lace
+                    if lace != 255:
+                        break
+                sizes.append(size)
+        case 2:  # fixed size
+            sizes = [(len(block) - offset) // frame_count] * (frame_count - 1)
+        case 3:  # EBML
+            size, offset = _parse_vint(block, offset)
+            sizes.append(size)
+            for _ in range(frame_count - 2):
+                length = _vint_length(block[offset])
+                delta, offset = _parse_vint(block, offset)
+                sizes.append(sizes[-1] + delta - ((1 << (7 * length - 1)) - 1))
+
+    sizes.append(len(block) - offset - sum(sizes))
+    for size in sizes:
+        yield block[offset:offset + size]
+        offset += size
+
+
+# Ogg
+
+def _ogg_packets(f: BinaryIO, index: _SeekIndex, resume: bool) -> Iterator[bytes]:
+    serial = index.stream_id if resume else None
+    packet_index = 2 if resume else 0
+    page_start_time = None
+    packet = bytearray()
+
+    while True:
+        page_offset = f.tell()
+        header = f.read(_OGG_PAGE_HEADER_SIZE)
+        if len(header) < _OGG_PAGE_HEADER_SIZE:
+            return
+
+        magic, _, header_type, granule_position, page_serial, _, _, segment_count = struct.unpack(_OGG_PAGE_HEADER_FORMAT, header)
+        if magic != _OGG_MAGIC:
+            raise OpusDemuxException("Lost Ogg page sync")
+
+        segment_table = f.read(segment_count)
+        body = f.read(sum(segment_table))
+
+        if serial is None:
+            if not body.startswith(b"OpusHead"):
+                raise OpusDemuxException("First Ogg stream is not Opus")
+            serial = page_serial
+            index.stream_id = serial
+            index.pre_skip = int.from_bytes(body[10:12], "little")
+        if page_serial != serial:
+            continue
+
+        if page_start_time is not None and not header_type & _OGG_CONTINUED_PACKET_FLAG:
+            index.add(page_start_time, page_offset)
+        if granule_position >= 0 and packet_index >= 2:
+            page_start_time = max(0.0, (granule_position - index.pre_skip) / _SAMPLING_RATE)
+
+        offset = 0
+        for lace in segment_table:
+            packet += body[offset:offset + lace]
+            offset += lace
+            if lace == 255:
+                continue  # packet continues in the next segment
+            if packet_index >= 2:  # skips OpusHead and OpusTags
+                yield bytes(packet)
+            packet_index += 1
+            packet = bytearray()
+
+
+# Opus packet re-framing (RFC 6716, section 3)
+
+def _frame_samples(toc: int) -> int:
+    config = toc >> 3
+    if config < 12:  # SILK
+        return (480, 960, 1920, 2880)[config % 4]
+    if config < 16:  # Hybrid
+        return (480, 960)[config % 2]
+    return (120, 240, 480, 960)[config % 4]  # CELT
+
+
+def _read_frame_length(packet: bytes, offset: int) -> Tuple[int, int]:
+    first = packet[offset]
+    if first < 252:
+        return first, offset + 1
+    return first + 4 * packet[offset + 1], offset + 2
+
+
+def _encode_frame_length(length: int) -> bytes:
+    if length < 252:
+        return bytes([length])
+    first = 252 + (length & 0x3)
+    return bytes([first, (length - first) >> 2])
+
+
+def _split_frames(packet: bytes) -> List[bytes]:
+    match packet[0] & 0x3:
+        case 0:
+            return [packet[1:]]
+        case 1:
+            half = (len(packet) - 1) // 2
+            return [packet[1:1 + half], packet[1 + half:]]
+        case 2:
+            size, offset = _read_frame_length(packet, 1)
+            return [packet[offset:offset + size], packet[offset + size:]]
+
+    vbr, has_padding, frame_count = packet[1] & 0x80, packet[1] & 0x40, packet[1] & 0x3F
+    offset = 2
+    padding = 0
+    while has_padding:
+        lace = packet[offset]
+        offset += 1
+        padding += 254 if lace == 255 else lace
+        has_padding = lace == 255
+    end = len(packet) - padding
+
+    if vbr:
+        sizes = []
+        for _ in range(frame_count - 1):
+            size, offset = _read_frame_length(packet, offset)
+            sizes.append(size)
+        sizes.append(end - offset - sum(sizes))
+    else:
+        sizes = [(end - offset) // frame_count] * frame_count
+
+    frames = []
+    for size in sizes:
+        frames.append(packet[offset:offset + size])
+        offset += size
+    return frames
+
+
+def _reframe(packets: Iterator[bytes]) -> Iterator[bytes]:
+    pending: Tuple[int, bytes] | None = None  # a 10 ms frame waiting to be paired
+
+    for packet in packets:
+        if not packet:
+            continue
+
+        toc = packet[0] & 0xFC
+        samples = _frame_samples(toc)
+
+        if samples == _FRAME_SAMPLES_20MS:
+            if pending is not None:
+                raise OpusDemuxException("20 ms frame after unpaired 10 ms frame")
+            if packet[0] & 0x3 == 0:
+                yield packet
+            else:
+                for frame in _split_frames(packet):
+                    yield bytes([toc]) + frame
+        elif samples == _FRAME_SAMPLES_10MS:
+            for frame in _split_frames(packet):
+                if pending is None:
+                    pending = (toc, frame)
+                    continue
+                if pending[0] != toc:
+                    raise OpusDemuxException("Cannot pair 10 ms frames with different configurations")
+                if len(pending[1]) == len(frame):
+                    yield bytes([toc | 0x1]) + pending[1] + frame
+                else:
+                    yield bytes([toc | 0x2]) + _encode_frame_length(len(pending[1])) + pending[1] + frame
+                pending = None
+        else:
+            raise OpusDemuxException(f"Unsupported Opus frame duration ({samples / 48} ms)")
+
+    if pending is not None:
+        yield bytes([pending[0]]) + pending[1]
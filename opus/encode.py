@@ -1,20 +1,45 @@
 import ctypes
+import itertools
 import os
+import profiling
 import subprocess
+import numpy as np
+import threading
+import time
 
-from typing import Iterator
+from dataclasses import dataclass
+from typing import Generator, Iterator, List, Tuple
 from logs import logger as base_logger
+from . import demux, loudness
 
 logger = base_logger.bind(context="OpusEncoder")
 
 _SILENCE_FRAME = b'\xf8\xff\xfe'
+_TRAILING_SILENCE_FRAMES = 5
+_SILENT_PACKET_MAX_SIZE = 3  # what libopus produces for digital silence when using VBR
+# Stands for 20 ms of leading silence that were trimmed: sent and waited for never, but still counted in the position
+SKIPPED_FRAME = b""
 
 _SAMPLING_RATE = 48000
 _CHANNELS = 2
 _PACKET_DURATION_MS = 20
 _SAMPLE_BYTE_SIZE = 2
-_CHUNK_SIZE = _SAMPLING_RATE * _PACKET_DURATION_MS * _CHANNELS * _SAMPLE_BYTE_SIZE // 1000
+_FRAME_SAMPLES = _SAMPLING_RATE * _PACKET_DURATION_MS // 1000
+_CHUNK_SIZE = _FRAME_SAMPLES * _CHANNELS * _SAMPLE_BYTE_SIZE
 _FFMPEG_BUFFER_CHUNKS = 500
+_PCM_BLOCK_CHUNKS = 50
+_PASSTHROUGH_GAIN_TOLERANCE = 0.5  # dB
+
+_OPUS_AUTO = -1000
+_OPUS_SIGNALS = {"auto": _OPUS_AUTO, "voice": 3001, "music": 3002}
+
+_LOAD_REPORT_FRAMES = 50
+_LOAD_ADJUSTMENT_INTERVAL = 1.0
+_LOAD_EWMA_WEIGHT = 0.2
+_LOAD_STALE_AFTER = 5.0  # seconds without load reports after which the measured encode time no longer says anything
+# Complexity is only raised again well below the limits that lowered it, otherwise every step up overloads and lowers it
+_LOAD_RAISE_FRACTION = 0.5
+_STREAMS_RAISE_FRACTION = 0.75
 
 # ctypes
 
@@ -26,9 +51,20 @@ _lib.free_buffer.argtypes = [ctypes.c_void_p]
 _lib.free_buffer.restype = None
 
 # create_encoder
-_lib.create_encoder.argtypes = []
+_lib.create_encoder.argtypes = [
+    ctypes.c_int,  # int bitrate
+    ctypes.c_int,  # int complexity
+    ctypes.c_int,  # int vbr
+    ctypes.c_int,  # int fec
+    ctypes.c_int,  # int packet_loss_perc
+    ctypes.c_int   # int signal
+]
 _lib.create_encoder.restype = ctypes.c_void_p
 
+# set_complexity
+_lib.set_complexity.argtypes = [ctypes.c_void_p, ctypes.c_int]
+_lib.set_complexity.restype = ctypes.c_int
+
 # destroy_encoder
 _lib.destroy_encoder.argtypes = [ctypes.c_void_p]
 _lib.destroy_encoder.restype = None
@@ -46,13 +82,114 @@ class OpusEncodingException(Exception):
     pass
 
 
+@dataclass(frozen=True, kw_only=True)
+class EncoderSettings:
+    bitrate: int | None = None  # bits per second, None lets libopus pick
+    complexity: int = 10
+    vbr: bool = True
+    fec: bool = False
+    expected_packet_loss: int = 0  # percentage, only relevant with FEC
+    signal: str = "auto"
+    min_complexity: int = 5
+    encode_time_threshold: float = 0.002  # seconds per frame
+    max_full_complexity_streams: int = 32
+    passthrough: bool = True
+    trim_silence: bool = True
+    silence_suppression_threshold: float = 1.0  # seconds
+    gain: float = 0.0  # dB
+    normalize_loudness: bool = False
+    loudness_target: float = -16.0  # LUFS
+    fade_in: float = 0.0  # seconds
+    fade_out: float = 0.0  # seconds
+
+    def __post_init__(self):
+        if self.signal not in _OPUS_SIGNALS:
+            raise ValueError(f"Invalid Opus signal type '{self.signal}', expected one of {list(_OPUS_SIGNALS)}")
+
+
+class _EncoderLoadMonitor:
+    _lock: threading.Lock
+    _active_streams: int
+    _frame_encode_time: float
+    _complexity_reduction: int
+    _last_adjustment: float
+    _last_report: float
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._active_streams = 0
+        self._frame_encode_time = 0.0
+        self._complexity_reduction = 0
+        self._last_adjustment = 0.0
+        self._last_report = 0.0
+
+    # Load is also reconsidered when streams come and go, since idle or paused streams send no reports
+    def stream_started(self, settings: EncoderSettings) -> None:
+        with self._lock:
+            self._active_streams += 1
+            self._adjust(settings)
+
+    def stream_finished(self, settings: EncoderSettings) -> None:
+        with self._lock:
+            self._active_streams -= 1
+            if self._active_streams > 0:
+                self._adjust(settings)
+                return
+            if self._complexity_reduction > 0:
+                logger.info(f"No more encoding streams, restoring complexity to {settings.complexity}")
+            self._frame_encode_time = 0.0
+            self._complexity_reduction = 0
+
+    def complexity(self, settings: EncoderSettings) -> int:
+        return max(settings.min_complexity, settings.complexity - self._complexity_reduction)
+
+    def report(self, frame_encode_time: float, settings: EncoderSettings) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_report >= _LOAD_STALE_AFTER:
+                self._frame_encode_time = frame_encode_time
+            else:
+                self._frame_encode_time += _LOAD_EWMA_WEIGHT * (frame_encode_time - self._frame_encode_time)
+            self._last_report = now
+            self._adjust(settings)
+            return self.complexity(settings)
+
+    def _adjust(self, settings: EncoderSettings) -> None:
+        now = time.monotonic()
+        if now - self._last_adjustment < _LOAD_ADJUSTMENT_INTERVAL:
+            return
+        if now - self._last_report >= _LOAD_STALE_AFTER:
+            self._frame_encode_time = 0.0  # nothing was encoded for a while, so nothing is slowing encoding down
+
+        overloaded = (self._active_streams > settings.max_full_complexity_streams
+                      or self._frame_encode_time > settings.encode_time_threshold)
+        relaxed = (self._active_streams <= settings.max_full_complexity_streams * _STREAMS_RAISE_FRACTION
+                   and self._frame_encode_time < settings.encode_time_threshold * _LOAD_RAISE_FRACTION)
+
+        if overloaded and self.complexity(settings) > settings.min_complexity:
+            self._complexity_reduction += 1
+            self._last_adjustment = now
+            logger.warning(f"Encoder overloaded ({self._active_streams} streams, {1000 * self._frame_encode_time:.3f} ms per frame), "
+                           f"lowering complexity to {self.complexity(settings)}")
+        elif relaxed and self._complexity_reduction > 0:
+            self._complexity_reduction -= 1
+            self._last_adjustment = now
+            logger.info(f"Encoder load decreased ({self._active_streams} streams, {1000 * self._frame_encode_time:.3f} ms per frame), "
+                        f"raising complexity to {self.complexity(settings)}")
+
+
+_load_monitor = _EncoderLoadMonitor()
+
+
 class _PCMEncoder:
     _filename: str
+    _start: float
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, start: float = 0.0) -> None:
         self._filename = filename
+        self._start = start
 
-    def pcm_stream(self) -> Iterator[bytes]:
+    def pcm_stream(self, chunk_size: int = _CHUNK_SIZE) -> Iterator[bytes]:
         proc = subprocess.Popen(
             self._ffmpeg_cmd(),
             bufsize=_FFMPEG_BUFFER_CHUNKS * _CHUNK_SIZE,
@@ -64,7 +201,9 @@ class _PCMEncoder:
         logger.info(f"Starting FFmpeg PCM stream of {self._filename}")
         try:
             while True:
-                packet = proc.stdout.read(_CHUNK_SIZE)
+                started = profiling.start()
+                packet = proc.stdout.read(chunk_size)
+                profiling.stop("pcm read", started)
                 if not packet:
                     break
                 yield packet
@@ -93,6 +232,7 @@ class _PCMEncoder:
     def _ffmpeg_cmd(self) -> list[str]:
         return ["ffmpeg",
                 "-hide_banner",
+                *(["-ss", f"{self._start:.3f}"] if self._start > 0 else []),
                 "-i", self._filename,
                 "-f", "s16le",
                 "-ar", str(_SAMPLING_RATE),
@@ -102,13 +242,83 @@ class _PCMEncoder:
                 "-"]
 
 
+class _PCMProcessor:
+    _gain: float
+    _fade_in: int
+    _fade_out: int
+    _position: int
+
+    def __init__(self, gain: float, fade_in: float, fade_out: float) -> None:
+        self._gain = 10 ** (gain / 20)
+        self._fade_in = round(fade_in * _SAMPLING_RATE)
+        self._fade_out = round(fade_out * _SAMPLING_RATE)
+        self._position = 0
+
+    def process(self, blocks: Iterator[bytes]) -> Iterator[bytes]:
+        tail = np.empty((0, _CHANNELS), dtype=np.float32)  # held back until the end of the stream is known, for the fade out
+
+        for block in blocks:
+            samples = np.frombuffer(block, dtype=np.int16).reshape(-1, _CHANNELS).astype(np.float32)
+            self._apply_gain_and_fade_in(samples)
+
+            if self._fade_out == 0:
+                yield from self._chunks(samples)
+                continue
+
+            samples = np.concatenate((tail, samples))
+            ready = max(0, len(samples) - self._fade_out) // _FRAME_SAMPLES * _FRAME_SAMPLES
+            yield from self._chunks(samples[:ready])
+            tail = samples[ready:]
+
+        fade = min(len(tail), self._fade_out)
+        if fade > 0:
+            tail[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, np.newaxis]
+        yield from self._chunks(tail)
+
+    def _apply_gain_and_fade_in(self, samples: np.ndarray) -> None:
+        if self._gain != 1.0:
+            samples *= self._gain
+
+        if self._position < self._fade_in:
+            n = min(len(samples), self._fade_in - self._position)
+            ramp = np.arange(self._position, self._position + n, dtype=np.float32) / self._fade_in
+            samples[:n] *= ramp[:, np.newaxis]
+
+        self._position += len(samples)
+
+    def _chunks(self, samples: np.ndarray) -> Iterator[bytes]:
+        if len(samples) == 0:
+            return
+        pcm = np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+        for offset in range(0, len(pcm), _CHUNK_SIZE):
+            yield pcm[offset:offset + _CHUNK_SIZE]
+
+
 class _OpusEncoder:
     _encoder: ctypes.c_void_p
+    _settings: EncoderSettings
+    _complexity: int
+    _window_frames: int
+    _window_encode_time: float
 
-    def __init__(self) -> None:
-        self._encoder = _lib.create_encoder()
+    def __init__(self, settings: EncoderSettings) -> None:
+        self._settings = settings
+        self._complexity = _load_monitor.complexity(settings)
+        self._encoder = _lib.create_encoder(settings.bitrate if settings.bitrate is not None else _OPUS_AUTO,
+                                            self._complexity,
+                                            int(settings.vbr),
+                                            int(settings.fec),
+                                            settings.expected_packet_loss,
+                                            _OPUS_SIGNALS[settings.signal])
+        if not self._encoder:
+            logger.error("Failed to create encoder")
+            raise OpusEncodingException("Failed to create encoder")
+        self._window_frames = 0
+        self._window_encode_time = 0.0
 
     def encode(self, data: bytes) -> bytes:
+        started = profiling.start()
+        start = time.perf_counter()
         padding = _CHUNK_SIZE - len(data)
         padded_data = data + b'\x00' * padding
         buf = (ctypes.c_ubyte * len(padded_data)).from_buffer_copy(padded_data)
@@ -117,17 +327,113 @@ class _OpusEncoder:
         if out_ptr:
             ret = bytes(out_ptr[:out_len.value])
             _lib.free_buffer(out_ptr)
+            self._record_encode_time(time.perf_counter() - start)
+            profiling.stop("opus encode", started)
             return ret
         logger.error("Failed to encode packet")
         raise OpusEncodingException("Failed to encode packet")
 
+    def _record_encode_time(self, encode_time: float) -> None:
+        self._window_encode_time += encode_time
+        self._window_frames += 1
+        if self._window_frames < _LOAD_REPORT_FRAMES:
+            return
+
+        complexity = _load_monitor.report(self._window_encode_time / self._window_frames, self._settings)
+        self._window_frames = 0
+        self._window_encode_time = 0.0
+        if complexity != self._complexity and _lib.set_complexity(self._encoder, complexity) == 0:
+            self._complexity = complexity
+
     def __del__(self) -> None:
         _lib.destroy_encoder(self._encoder)
 
 
-def encode(media_filename: str) -> Iterator[bytes]:
-    pcm_enc = _PCMEncoder(media_filename)
-    opus_enc = _OpusEncoder()
-    opus_stream = (opus_enc.encode(pcm_chunk) for pcm_chunk in pcm_enc.pcm_stream())
-    yield from opus_stream
-    yield from [_SILENCE_FRAME] * 5
+def _reencode(media_filename: str, settings: EncoderSettings, gain: float, start: float = 0.0) -> Iterator[Tuple[bool, bytes]]:
+    pcm_enc = _PCMEncoder(media_filename, start)
+
+    if gain != 0.0 or settings.fade_in > 0 or settings.fade_out > 0:
+        processor = _PCMProcessor(gain, settings.fade_in, settings.fade_out)
+        pcm_chunks = processor.process(pcm_enc.pcm_stream(_PCM_BLOCK_CHUNKS * _CHUNK_SIZE))
+    else:
+        pcm_chunks = pcm_enc.pcm_stream()
+
+    _load_monitor.stream_started(settings)
+    try:
+        opus_enc = _OpusEncoder(settings)
+        for pcm_chunk in pcm_chunks:
+            yield pcm_chunk.count(0) == len(pcm_chunk), opus_enc.encode(pcm_chunk)
+    finally:
+        _load_monitor.stream_finished(settings)
+
+
+def _passthrough(media_filename: str, settings: EncoderSettings, gain: float, start: float = 0.0) -> Iterator[Tuple[bool, bytes]]:
+    logger.info(f"Passing through Opus packets of {media_filename}")
+    position = start
+    try:
+        for packet in demux.opus_frames(media_filename, start):
+            yield len(packet) <= _SILENT_PACKET_MAX_SIZE, packet
+            position += _PACKET_DURATION_MS / 1000
+    except demux.OpusDemuxException as e:
+        logger.warning(f"Opus passthrough of {media_filename} failed at {position:.2f} s ({e}), re-encoding the rest")
+        yield from _reencode(media_filename, settings, gain, position)
+
+
+# None stands for a 20 ms slot in which nothing should be sent, SKIPPED_FRAME for 20 ms that take no time at all
+def _trim_silence(frames: Iterator[Tuple[bool, bytes]], settings: EncoderSettings) -> Iterator[bytes | None]:
+    suppression_frames = round(settings.silence_suppression_threshold * 1000 / _PACKET_DURATION_MS)
+    held: List[bytes] = []
+    silent_run = 0
+    audio_started = False
+
+    for silent, packet in frames:
+        if not silent:
+            if silent_run >= suppression_frames:
+                trailing = min(silent_run, _TRAILING_SILENCE_FRAMES)
+                yield from itertools.repeat(_SILENCE_FRAME, trailing)
+                yield from itertools.repeat(None, silent_run - trailing)
+            else:
+                yield from held
+            held.clear()
+            silent_run = 0
+            audio_started = True
+            yield packet
+        elif audio_started:
+            silent_run += 1
+            if silent_run < suppression_frames:
+                held.append(packet)
+            else:
+                held.clear()
+        else:  # leading silence is dropped
+            yield SKIPPED_FRAME
+    # trailing silence (whatever is left in held) is dropped
+
+
+def _gain(media_filename: str, settings: EncoderSettings) -> float:
+    gain = settings.gain
+    if settings.normalize_loudness:
+        measured = loudness.load(media_filename)
+        if measured is not None:
+            gain += measured.gain_to(settings.loudness_target)
+        else:
+            logger.warning(f"No loudness measurement for {media_filename}, playing without normalization")
+    return gain
+
+
+def _can_passthrough(media_filename: str, settings: EncoderSettings, gain: float) -> bool:
+    needs_processing = abs(gain) >= _PASSTHROUGH_GAIN_TOLERANCE or settings.fade_in > 0 or settings.fade_out > 0
+    return settings.passthrough and not needs_processing and demux.probe(media_filename)
+
+
+def encode(media_filename: str, settings: EncoderSettings, start: float = 0.0) -> Generator[bytes | None, None, None]:
+    gain = _gain(media_filename, settings)
+    if _can_passthrough(media_filename, settings, gain):
+        frames = _passthrough(media_filename, settings, gain, start)
+    else:
+        frames = _reencode(media_filename, settings, gain, start)
+
+    if settings.trim_silence:
+        yield from _trim_silence(frames, settings)
+    else:
+        yield from (packet for _, packet in frames)
+    yield from [_SILENCE_FRAME] * _TRAILING_SILENCE_FRAMES
@@ -0,0 +1,68 @@
+import json
+import math
+import re
+import subprocess
+
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from logs import logger as base_logger
+
+logger = base_logger.bind(context="Loudness")
+
+_INTEGRATED_LOUDNESS_REGEX = re.compile(r"^\s*I:\s+(\S+) LUFS", re.MULTILINE)
+_SAMPLE_PEAK_REGEX = re.compile(r"^\s*Peak:\s+(\S+) dBFS", re.MULTILINE)
+_MAX_PEAK = -1.0  # dBFS
+_MAX_GAIN = 20.0  # dB, in either direction
+
+
+@dataclass(frozen=True)
+class Loudness:
+    integrated: float  # LUFS
+    peak: float  # dBFS
+
+    def gain_to(self, target: float) -> float:
+        gain = min(target - self.integrated, _MAX_PEAK - self.peak)
+        if not math.isfinite(gain):
+            return 0.0
+        return max(-_MAX_GAIN, min(_MAX_GAIN, gain))
+
+
+def _cache_path(filename: str) -> Path:
+    return Path(f"{filename}.loudness.json")
+
+
+def analyze(filename: str) -> Loudness | None:
+    cmd = ["ffmpeg",
+           "-hide_banner",
+           "-nostats",
+           "-i", filename,
+           "-vn",
+           "-af", "ebur128=peak=sample:framelog=quiet",
+           "-f", "null",
+           "-"]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    integrated = _INTEGRATED_LOUDNESS_REGEX.findall(proc.stderr)
+    peak = _SAMPLE_PEAK_REGEX.findall(proc.stderr)
+    if proc.returncode != 0 or not integrated or not peak:
+        logger.warning(f"Loudness analysis of {filename} failed (exit code {proc.returncode})")
+        return None
+    return Loudness(integrated=float(integrated[-1]), peak=float(peak[-1]))
+
+
+def load(filename: str) -> Loudness | None:
+    try:
+        return Loudness(**json.loads(_cache_path(filename).read_text()))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def analyze_and_store(filename: str) -> Loudness | None:
+    loudness = load(filename)
+    if loudness is not None:
+        return loudness
+
+    loudness = analyze(filename)
+    if loudness is not None:
+        _cache_path(filename).write_text(json.dumps(asdict(loudness)))
+        logger.info(f"Loudness of {filename}: {loudness.integrated} LUFS, peak {loudness.peak} dBFS")
+    return loudness
@@ -13,16 +13,36 @@ void free_buffer(void* p) {
     free(p);
 }
 
-OpusEncoder* create_encoder() {
+OpusEncoder* create_encoder(int bitrate, int complexity, int vbr, int fec, int packet_loss_perc, int signal) {
     int error;
     OpusEncoder *encoder = opus_encoder_create(SAMPLE_RATE, CHANNELS, OPUS_APPLICATION_AUDIO, &error);
     if (error != OPUS_OK) {
         fprintf(stderr, "Failed to initialize Opus encoder (error code = %d)", error);
         return NULL;
     }
+
+    error = opus_encoder_ctl(encoder, OPUS_SET_BITRATE(bitrate));
+    if (error == OPUS_OK) error = opus_encoder_ctl(encoder, OPUS_SET_COMPLEXITY(complexity));
+    if (error == OPUS_OK) error = opus_encoder_ctl(encoder, OPUS_SET_VBR(vbr));
+    if (error == OPUS_OK) error = opus_encoder_ctl(encoder, OPUS_SET_INBAND_FEC(fec));
+    if (error == OPUS_OK) error = opus_encoder_ctl(encoder, OPUS_SET_PACKET_LOSS_PERC(packet_loss_perc));
+    if (error == OPUS_OK) error = opus_encoder_ctl(encoder, OPUS_SET_SIGNAL(signal));
+    if (error != OPUS_OK) {
+        fprintf(stderr, "Failed to configure Opus encoder (error code = %d)", error);
+        opus_encoder_destroy(encoder);
+        return NULL;
+    }
     return encoder;
 }
 
+int set_complexity(OpusEncoder* encoder, int complexity) {
+    int error = opus_encoder_ctl(encoder, OPUS_SET_COMPLEXITY(complexity));
+    if (error != OPUS_OK) {
+        fprintf(stderr, "Failed to set Opus encoder complexity (error code = %d)", error);
+    }
+    return error;
+}
+
 uint8_t* encode(OpusEncoder* encoder, opus_int16* pcm, size_t* out_len) {
     uint8_t* out = (uint8_t*) malloc(sizeof(uint8_t) * MAX_PACKET_SIZE);
     opus_int32 encoded_size = opus_encode(encoder, pcm, SAMPLES_PER_FRAME_PER_CHANNEL, out, MAX_PACKET_SIZE);
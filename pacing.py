@@ -0,0 +1,144 @@
+import os
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, FrozenSet, Iterator, List
+from logs import logger as base_logger
+
+logger = base_logger.bind(context="Pacer")
+
+LATE_POLICIES = {"drop", "compress", "catch_up"}
+_COMPRESSED_INTERVAL_RATIO = 0.5
+
+
+@dataclass(frozen=True, kw_only=True)
+class PacingSettings:
+    # Seconds polled before each deadline, after sleeping through the rest. Sharper timing, but every stream burns
+    # that much CPU per 20 ms packet (0.0005 is 2.5 % of a core), so by default sleeping alone has to do.
+    spin_time: float = 0.0
+    late_policy: str = "catch_up"
+    max_catch_up: int = 3  # packets sent back-to-back before the schedule is moved instead
+    realtime_priority: int | None = None  # SCHED_FIFO priority of the sending thread
+    cpu_affinity: FrozenSet[int] | None = None
+
+    def __post_init__(self):
+        if self.late_policy not in LATE_POLICIES:
+            raise ValueError(f"Invalid late packet policy {self.late_policy!r}, expected one of {sorted(LATE_POLICIES)}")
+
+
+# Releases one packet per interval on a fixed grid of a monotonic clock, so deadlines never accumulate rounding or
+# oversleeping errors. When the sender falls a whole interval or more behind, the late policy decides what happens:
+#   drop: overdue packets are skipped, the sender leaves a gap in the sequence so receivers see them as lost
+#   compress: overdue packets go out at half the interval until the schedule is met again
+#   catch_up: up to max_catch_up overdue packets go out back-to-back, then the schedule is moved to now
+class Pacer:
+    _interval: int
+    _compressed_interval: int
+    _settings: PacingSettings
+    _spin_time: int
+    _start: int | None
+    _slot: int
+    _last_send: int
+    _burst: int
+    _late: int
+    _dropped: int
+    _rescheduled: int
+    _sent: int
+    _total_error: int
+    _max_error: int
+
+    def __init__(self, interval: float, settings: PacingSettings) -> None:
+        self._interval = round(interval * 1e9)
+        self._compressed_interval = round(self._interval * _COMPRESSED_INTERVAL_RATIO)
+        self._settings = settings
+        self._spin_time = round(settings.spin_time * 1e9)
+        self._late = self._dropped = self._rescheduled = self._sent = 0
+        self._total_error = self._max_error = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self._start = None
+        self._slot = 0
+        self._last_send = 0
+        self._burst = 0
+
+    # Blocks until the next packet is due, returns False if it should be dropped instead of sent
+    def wait(self) -> bool:
+        now = time.perf_counter_ns()
+        if self._start is None:
+            self._start = now
+        deadline = self._start + self._slot * self._interval
+
+        if now - deadline < self._interval:
+            self._burst = 0
+            self._sleep_until(deadline)
+        else:
+            self._late += 1
+            match self._settings.late_policy:
+                case "drop":
+                    self._slot += 1
+                    self._dropped += 1
+                    return False
+                case "compress":
+                    self._sleep_until(self._last_send + self._compressed_interval)
+                case "catch_up":
+                    self._burst += 1
+                    if self._burst > self._settings.max_catch_up:
+                        self._start = now - self._slot * self._interval
+                        deadline = now
+                        self._burst = 0
+                        self._rescheduled += 1
+
+        sent_at = time.perf_counter_ns()
+        error = sent_at - deadline
+        self._total_error += error
+        self._max_error = max(self._max_error, error)
+        self._last_send = sent_at
+        self._sent += 1
+        self._slot += 1
+        return True
+
+    def _sleep_until(self, target: int) -> None:
+        remaining = target - time.perf_counter_ns()
+        if remaining > self._spin_time:
+            time.sleep((remaining - self._spin_time) / 1e9)
+        while time.perf_counter_ns() < target:
+            time.sleep(0)  # lets other threads, like the other streams' senders, take the GIL meanwhile
+
+    def __str__(self) -> str:
+        mean_error = self._total_error / self._sent / 1000 if self._sent else 0.0
+        return (f"mean lateness {mean_error:.0f} us, max {self._max_error / 1000:.0f} us, late {self._late}, "
+                f"dropped {self._dropped}, rescheduled {self._rescheduled}")
+
+
+# Raises scheduling priority and pins the calling thread while sending, restoring both afterwards
+# since the thread goes back to a shared executor
+@contextmanager
+def sender_scheduling(settings: PacingSettings) -> Iterator[None]:
+    restore: List[Callable[[], None]] = []
+
+    if settings.realtime_priority is not None:
+        try:
+            policy, param = os.sched_getscheduler(0), os.sched_getparam(0)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(settings.realtime_priority))
+            restore.append(lambda: os.sched_setscheduler(0, policy, param))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Could not use realtime scheduling for the sender thread: {e!r}")
+
+    if settings.cpu_affinity:
+        try:
+            cpus = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, settings.cpu_affinity)
+            restore.append(lambda: os.sched_setaffinity(0, cpus))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Could not pin the sender thread to CPUs {sorted(settings.cpu_affinity)}: {e!r}")
+
+    try:
+        yield
+    finally:
+        for undo in reversed(restore):
+            try:
+                undo()
+            except OSError as e:
+                logger.warning(f"Could not restore sender thread scheduling: {e!r}")
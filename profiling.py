@@ -0,0 +1,167 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+from collections import Counter, defaultdict
+from logs import logger as base_logger, LOGS_PATH
+from types import FrameType
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+logger = base_logger.bind(context="Profiler")
+
+_SAMPLING_INTERVAL = 0.005
+_NO_OWNER = "-"
+
+T = TypeVar("T")
+
+# Checked by instrumented call sites, which do no work at all beyond that while profiling is off
+enabled = False
+
+
+class _StageStats:
+    count: int
+    total: int
+    max: int
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, elapsed: int) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+# Stage statistics are kept per thread, so recording never contends on a lock
+_local = threading.local()
+_all_stage_stats: List[Dict[Tuple[str, str], _StageStats]] = []
+_lock = threading.Lock()
+_thread_cpu: Dict[str, int] = defaultdict(int)
+_sampler: "_StackSampler | None" = None
+
+
+def start() -> int:
+    return time.perf_counter_ns() if enabled else 0
+
+
+def stop(stage: str, started: int) -> None:
+    if not started:
+        return
+    elapsed = time.perf_counter_ns() - started
+    stage_stats = getattr(_local, "stage_stats", None)
+    if stage_stats is None:
+        stage_stats = _local.stage_stats = {}
+        with _lock:
+            _all_stage_stats.append(stage_stats)
+    key = (getattr(_local, "owner", _NO_OWNER), stage)
+    stats = stage_stats.get(key)
+    if stats is None:
+        stats = stage_stats[key] = _StageStats()
+    stats.add(elapsed)
+
+
+# Runs fn in the calling thread, attributing the thread's CPU time and the stages it records to owner (e.g. a guild)
+def run_attributed(owner: str, fn: Callable[..., T], *args: Any) -> T:
+    _local.owner = owner
+    started = time.thread_time_ns()
+    try:
+        return fn(*args)
+    finally:
+        if enabled:  # otherwise an entry per guild that ever streamed would pile up
+            with _lock:
+                _thread_cpu[owner] += time.thread_time_ns() - started
+        _local.owner = _NO_OWNER
+
+
+# Periodically samples the stacks of all other threads, counted in the collapsed format flame graph tools read
+class _StackSampler(threading.Thread):
+    _stop_event: threading.Event
+    samples: Counter
+
+    def __init__(self) -> None:
+        super().__init__(name="stack-sampler", daemon=True)
+        self._stop_event = threading.Event()
+        self.samples = Counter()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(_SAMPLING_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                current: FrameType | None = frame
+                while current is not None:
+                    code = current.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    current = current.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def enable() -> None:
+    global enabled, _sampler
+    if enabled:
+        return
+    with _lock:
+        for stage_stats in _all_stage_stats:
+            stage_stats.clear()
+        _thread_cpu.clear()
+    _sampler = _StackSampler()
+    _sampler.start()
+    enabled = True
+    logger.info("Profiling enabled")
+
+
+def disable() -> None:
+    global enabled, _sampler
+    if not enabled:
+        return
+    enabled = False
+    sampler, _sampler = _sampler, None
+    if sampler is not None:
+        sampler.stop()
+        _report(sampler.samples)
+    logger.info("Profiling disabled")
+
+
+def toggle() -> None:
+    if enabled:
+        disable()
+    else:
+        enable()
+
+
+def _report(samples: Counter) -> None:
+    totals: Dict[Tuple[str, str], _StageStats] = defaultdict(_StageStats)
+    with _lock:
+        for stage_stats in _all_stage_stats:
+            for key, stats in list(stage_stats.items()):
+                total = totals[key]
+                total.count += stats.count
+                total.total += stats.total
+                total.max = max(total.max, stats.max)
+        thread_cpu = dict(_thread_cpu)
+
+    for (owner, stage), stats in sorted(totals.items()):
+        logger.info(f"{owner} {stage}: {stats.count} calls, mean {stats.total / stats.count / 1000:.1f} us, "
+                    f"max {stats.max / 1000:.1f} us, total {stats.total / 1e6:.1f} ms")
+    for owner, cpu in sorted(thread_cpu.items(), key=lambda item: -item[1]):
+        logger.info(f"{owner} stream thread CPU time: {cpu / 1e9:.2f} s")
+
+    path = LOGS_PATH.parent / f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+    logger.info(f"Wrote {sum(samples.values())} stack samples to {path}")
+
+
+# SIGUSR1 toggles profiling, the report is written when it gets switched off
+def install_signal_handler() -> None:
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=toggle, name="profiler-toggle").start())
@@ -0,0 +1,59 @@
+import asyncio
+import random
+import websockets
+
+from logs import logger as base_logger
+from typing import overload
+
+logger = base_logger.bind(context="Reconnect")
+
+_FAST_RETRIES = 2
+_FAST_RETRY_MAX_DELAY = 0.5
+_BASE_DELAY = 1.0
+
+
+# Exponential backoff with full jitter. The first few retries are almost immediate, as most disconnections
+# are voice server restarts or gateway blips that are over by the time the next connection attempt starts.
+class Backoff:
+    _max_delay: float
+    _attempts: int
+
+    def __init__(self, max_delay: float) -> None:
+        self._max_delay = max_delay
+        self._attempts = 0
+
+    @property
+    def attempts(self) -> int:
+        return self._attempts
+
+    def next_delay(self) -> float:
+        attempt = self._attempts
+        self._attempts += 1
+        if attempt < _FAST_RETRIES:
+            return random.uniform(0, _FAST_RETRY_MAX_DELAY)
+        return random.uniform(0, min(self._max_delay, _BASE_DELAY * 2 ** (attempt - _FAST_RETRIES)))
+
+    def reset(self) -> None:
+        self._attempts = 0
+
+
+# Without max_attempts, retries until connected
+@overload
+async def connect(url: str, backoff: Backoff) -> websockets.ClientConnection: ...
+
+
+@overload
+async def connect(url: str, backoff: Backoff, max_attempts: int) -> websockets.ClientConnection | None: ...
+
+
+async def connect(url: str, backoff: Backoff, max_attempts: int | None = None) -> websockets.ClientConnection | None:
+    while max_attempts is None or backoff.attempts < max_attempts:
+        delay = backoff.next_delay()
+        logger.info(f"Connection attempt {backoff.attempts} to {url} in {delay:.2f} s")
+        await asyncio.sleep(delay)
+        try:
+            return await websockets.connect(url)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+            logger.warning(f"Connection attempt {backoff.attempts} to {url} failed: {e!r}")
+    logger.warning(f"Giving up connecting to {url} after {backoff.attempts} attempts")
+    return None
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from logs import logger as base_logger
+
+logger = base_logger.bind(context="SessionState")
+
+
+@dataclass(frozen=True, kw_only=True)
+class GatewaySession:
+    session_id: str
+    resume_url: str
+    last_seq: int | None
+
+
+@dataclass(frozen=True, kw_only=True)
+class QueuedMedia:
+    id: str
+    title: str
+    thumbnail: str
+    duration: int
+    link: str
+    start: float = 0.0  # seconds into the media where playback continues
+
+
+@dataclass(frozen=True, kw_only=True)
+class GuildPlayback:
+    guild_id: str
+    channel_id: str
+    queue: List[QueuedMedia]  # the current media first
+
+
+# Everything needed to pick up where a previous process left off, keyed by "shard_id/shard_count" and guild id
+@dataclass(frozen=True, kw_only=True)
+class State:
+    saved_at: float = field(default_factory=time.time)
+    sessions: Dict[str, GatewaySession] = field(default_factory=dict)
+    guilds: Dict[str, GuildPlayback] = field(default_factory=dict)
+
+    def session(self, shard: Tuple[int, int]) -> GatewaySession | None:
+        return self.sessions.get(shard_key(shard))
+
+
+def shard_key(shard: Tuple[int, int]) -> str:
+    return f"{shard[0]}/{shard[1]}"
+
+
+# Writes go to a temporary file that then replaces the previous snapshot, so a crash mid write never leaves a torn file
+class StateStore:
+    _path: Path
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    def save(self, state: State) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self._path.with_name(f"{self._path.name}.tmp")
+        temporary.write_text(json.dumps(asdict(state)))
+        os.replace(temporary, self._path)
+
+    # Snapshots older than max_age are ignored, by then the gateway session expired and queues are stale
+    def load(self, max_age: float) -> State | None:
+        try:
+            raw = json.loads(self._path.read_text())
+            state = State(saved_at=raw["saved_at"],
+                          sessions={key: GatewaySession(**session) for key, session in raw["sessions"].items()},
+                          guilds={guild_id: GuildPlayback(guild_id=playback["guild_id"],
+                                                          channel_id=playback["channel_id"],
+                                                          queue=[QueuedMedia(**media) for media in playback["queue"]])
+                                  for guild_id, playback in raw["guilds"].items()})
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable state snapshot {self._path}: {e!r}")
+            return None
+
+        age = time.time() - state.saved_at
+        if age > max_age:
+            logger.info(f"Ignoring state snapshot from {age:.0f} s ago")
+            return None
+        return state
@@ -0,0 +1,159 @@
+import asyncio
+import guild_resources
+import importlib
+import json
+import session_state
+import sharding
+import signal
+import time
+import title_index
+import track_index
+
+from client import Client
+from config import Config
+from http_client import HttpClient
+from types import ModuleType
+from typing import Any, Dict
+from logs import logger as base_logger
+
+logger = base_logger.bind(context="ShardManager")
+
+# Used when gateway information can neither be fetched nor read from the cache
+_DEFAULT_GATEWAY = {"url": "wss://gateway.discord.gg", "shards": 1,
+                    "session_start_limit": {"total": 1000, "remaining": 1000, "max_concurrency": 1}}
+# Only needed once someone uses voice, but loading them takes far longer than the rest of startup
+_VOICE_MODULES = ["voice_client", "youtube"]
+
+
+class ShardManager:
+    _http_client: HttpClient
+    _intents: int
+    _config: Config
+    _shard_count: int
+    _clients: Dict[int, Client]
+    _state_store: session_state.StateStore
+    _guilds: guild_resources.GuildRegistry
+    _titles: title_index.TitleIndex
+    _tracks: track_index.TrackIndex
+    _youtube: ModuleType | None  # once warming up its API connection started
+
+    def __init__(self, http_client: HttpClient, intents: int, config: Config) -> None:
+        self._http_client = http_client
+        self._intents = intents
+        self._config = config
+        self._shard_count = 0
+        self._clients = {}
+        # Processes running different shards keep separate snapshots
+        self._state_store = session_state.StateStore(config.state_dir / f"session-{config.shard_process_index}.json")
+        self._guilds = guild_resources.GuildRegistry(config.voice_join_phase_timeout)
+        self._titles = title_index.TitleIndex()
+        self._tracks = track_index.TrackIndex(config.state_dir / "tracks.sqlite3", config.local_search_min_coverage)
+        self._youtube = None
+
+    # None for guilds whose shard runs in another process
+    def client_for(self, guild_id: str) -> Client | None:
+        if not self._clients:
+            return None
+        return self._clients.get(sharding.shard_id(guild_id, self._shard_count))
+
+    async def start(self) -> None:
+        gateway = await self._gateway_info()
+        session_start_limit = gateway["session_start_limit"]
+        self._shard_count = self._config.shard_count or gateway["shards"]
+        logger.info(f"Using {self._shard_count} shards (recommended: {gateway['shards']}), "
+                    f"identify concurrency {session_start_limit['max_concurrency']}, "
+                    f"{session_start_limit['remaining']}/{session_start_limit['total']} session starts remaining")
+
+        url = self._http_client.gateway_url(gateway["url"])
+        limiter = sharding.IdentifyLimiter(session_start_limit["max_concurrency"])
+        shard_ids = [i for i in range(self._shard_count) if i % self._config.shard_process_count == self._config.shard_process_index]
+        self._clients = {i: Client(self._http_client, self._intents, self._config, url, (i, self._shard_count), limiter, self.client_for, self._guilds, self._titles,
+                                 self._tracks)
+                         for i in shard_ids}
+        logger.info(f"Running shards {shard_ids} in this process")
+        self._restore_state()
+        await self._load_titles()
+
+        # SIGUSR2 logs what each guild holds
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, self._guilds.log_report)
+        background = [asyncio.create_task(self._snapshot_periodically()), asyncio.create_task(self._guilds.reap_periodically()),
+                      asyncio.create_task(self._keep_youtube_warm())]
+        try:
+            await asyncio.gather(_preload_voice_modules(), *(client.start() for client in self._clients.values()))
+        finally:
+            for task in background:
+                task.cancel()
+            self._state_store.save(self._snapshot())
+            logger.info("Saved final state snapshot")
+            self._tracks.close()
+            if self._youtube is not None:
+                await self._youtube.close()
+
+    def _restore_state(self) -> None:
+        state = self._state_store.load(self._config.state_restore_max_age)
+        if state is None:
+            return
+        sessions = guilds = 0
+        for i, client in self._clients.items():
+            session = state.session((i, self._shard_count))
+            playback = [guild for guild in state.guilds.values() if sharding.shard_id(guild.guild_id, self._shard_count) == i]
+            client.restore(session, playback)
+            sessions += session is not None
+            guilds += len(playback)
+        logger.info(f"Restored {sessions} gateway sessions and playback in {guilds} guilds from {time.time() - state.saved_at:.1f} s ago")
+
+    # Autocomplete suggests what was played before this process started too
+    async def _load_titles(self) -> None:
+        tracks = await self._tracks.tracks(title_index.MAX_ENTRIES)
+        for track in reversed(tracks):  # oldest first, so the index would evict those
+            self._titles.add(track.video_id, track.title, plays=track.plays, played_at=track.last_played)
+            for query in track.queries:
+                self._titles.add(track.video_id, track.title, query, plays=0, played_at=track.last_played)
+        logger.info(f"Loaded {len(tracks)} titles for autocomplete")
+
+    def _snapshot(self) -> session_state.State:
+        sessions = {session_state.shard_key((i, self._shard_count)): session
+                    for i, client in self._clients.items() if (session := client.session_snapshot()) is not None}
+        guilds = {playback.guild_id: playback for client in self._clients.values() for playback in client.playback_snapshots()}
+        return session_state.State(sessions=sessions, guilds=guilds)
+
+    async def _snapshot_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._config.state_snapshot_interval)
+            try:
+                await asyncio.to_thread(self._state_store.save, self._snapshot())
+            except OSError as e:
+                logger.warning(f"Could not save state snapshot: {e!r}")
+
+    async def _keep_youtube_warm(self) -> None:
+        try:
+            self._youtube = await asyncio.to_thread(importlib.import_module, "youtube")
+        except Exception as e:
+            logger.warning(f"Could not load the youtube module to warm up its API connection: {e!r}")
+            return
+        await self._youtube.keep_warm(self._config)
+
+    # The cached response keeps restarts going when the REST API is slow or unreachable
+    async def _gateway_info(self) -> Dict[str, Any]:
+        cache_path = self._config.state_dir / "gateway.json"
+        gateway = await self._http_client.get_gateway_bot(self._config.gateway_fetch_timeout)
+        if gateway is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps(gateway))
+            return gateway
+        try:
+            gateway = json.loads(cache_path.read_text())
+            logger.warning(f"Using cached gateway information from {cache_path}")
+            return gateway
+        except (OSError, ValueError) as e:
+            logger.warning(f"No usable cached gateway information ({e!r}), using defaults")
+            return _DEFAULT_GATEWAY
+
+
+# Imports the voice modules in a worker thread while the shards connect, so the first voice use doesn't stall the event loop
+async def _preload_voice_modules() -> None:
+    for module in _VOICE_MODULES:
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except Exception as e:
+            logger.warning(f"Preloading module {module} failed, it will be loaded on first use: {e!r}")
@@ -0,0 +1,22 @@
+import asyncio
+
+from typing import List
+
+_IDENTIFY_INTERVAL = 5.0  # seconds between identifies in the same rate limit bucket
+
+
+def shard_id(guild_id: str, shard_count: int) -> int:
+    return (int(guild_id) >> 22) % shard_count
+
+
+# Shards whose ids are equal modulo max_concurrency share a bucket, in which only one identify is allowed every 5 seconds
+class IdentifyLimiter:
+    _buckets: List[asyncio.Lock]
+
+    def __init__(self, max_concurrency: int) -> None:
+        self._buckets = [asyncio.Lock() for _ in range(max_concurrency)]
+
+    async def acquire(self, shard_id: int) -> None:
+        lock = self._buckets[shard_id % len(self._buckets)]
+        await lock.acquire()
+        asyncio.get_running_loop().call_later(_IDENTIFY_INTERVAL, lock.release)
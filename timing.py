@@ -0,0 +1,31 @@
+import time
+
+from typing import Dict
+
+
+# Durations of consecutive phases of a multi step operation, each measured from the end of the previous one
+class PhaseTimer:
+    _start: float
+    _last: float
+    _phases: Dict[str, float]
+
+    def __init__(self) -> None:
+        self._start = self._last = time.perf_counter()
+        self._phases = {}
+
+    @property
+    def phases(self) -> Dict[str, float]:
+        return dict(self._phases)
+
+    @property
+    def total(self) -> float:
+        return self._last - self._start
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self._phases[phase] = now - self._last
+        self._last = now
+
+    def __str__(self) -> str:
+        phases = ", ".join(f"{phase} {duration * 1000:.0f} ms" for phase, duration in self._phases.items())
+        return f"{phases} (total {self.total * 1000:.0f} ms)"
@@ -0,0 +1,141 @@
+import bisect
+import difflib
+import heapq
+import re
+import time
+import unicodedata
+
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+MAX_ENTRIES = 10000
+_TOKEN_PATTERN = re.compile(r"\w+")
+_MAX_TYPO_LENGTH_DIFFERENCE = 2
+
+
+@dataclass(frozen=True, kw_only=True)
+class Suggestion:
+    video_id: str
+    title: str
+
+
+class _Entry:
+    __slots__ = ("title", "tokens", "keys", "plays", "last_played")
+
+    title: str
+    tokens: Set[str]
+    keys: str  # normalized title and queries that resolved to it, each between newlines, so a substring test finds prefixes
+    plays: int
+    last_played: float
+
+    def __init__(self, title: str) -> None:
+        self.title = title
+        self.tokens = set()
+        self.keys = "\n"
+        self.plays = 0
+        self.last_played = 0.0
+
+
+# Titles of media played before and the queries that found them, searched by /play autocomplete. Autocomplete answers
+# have to arrive within Discord's deadline on every keystroke, so suggestions come from memory only: every word typed
+# has to start a word of the title or of a past query, and words matching none get one more chance as a close match
+# (typos). Matches are ranked by how often and how recently they were played.
+class TitleIndex:
+    _entries: Dict[str, _Entry]
+    _postings: Dict[str, Set[str]]  # token to video ids
+    _tokens: List[str]  # sorted, for prefix lookups
+    _top: List[str] | None  # most played video ids, suggested before anything is typed, None when outdated
+
+    def __init__(self) -> None:
+        self._entries = {}
+        self._postings = {}
+        self._tokens = []
+        self._top = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # query is what the user typed to find the media, None if it was a link
+    def add(self, video_id: str, title: str, query: str | None = None, plays: int = 1, played_at: float | None = None) -> None:
+        self._top = None
+        entry = self._entries.get(video_id)
+        if entry is None:
+            if len(self._entries) >= MAX_ENTRIES:
+                self._remove(min(self._entries, key=lambda vid: self._entries[vid].last_played))
+            entry = self._entries[video_id] = _Entry(title)
+        entry.plays += plays
+        entry.last_played = max(entry.last_played, played_at if played_at is not None else time.time())
+        for text in (title, query):
+            if text is None:
+                continue
+            key = _normalize(text)
+            if key and f"\n{key}\n" not in entry.keys:
+                entry.keys += f"{key}\n"
+                for token in _TOKEN_PATTERN.findall(key):
+                    self._add_token(token, video_id, entry)
+
+    def suggest(self, typed: str, limit: int) -> List[Suggestion]:
+        words = _TOKEN_PATTERN.findall(_normalize(typed))
+        if not words:
+            if self._top is None or len(self._top) < limit:
+                self._top = heapq.nsmallest(limit, self._entries, key=lambda vid: (-self._entries[vid].plays, -self._entries[vid].last_played))
+            return [Suggestion(video_id=video_id, title=self._entries[video_id].title) for video_id in self._top[:limit]]
+
+        candidates = self._matches(words[0])
+        for word in words[1:]:
+            if not candidates:
+                return []
+            candidates &= self._matches(word)
+        if not candidates:
+            return []
+
+        phrase = "\n" + " ".join(words)
+        ranked = heapq.nsmallest(limit, candidates, key=lambda vid: (phrase not in self._entries[vid].keys,
+                                                                     -self._entries[vid].plays, -self._entries[vid].last_played))
+        return [Suggestion(video_id=video_id, title=self._entries[video_id].title) for video_id in ranked[:limit]]
+
+    # Words typed so far match the start of tokens, and any word that doesn't could be a typo
+    def _matches(self, word: str) -> Set[str]:
+        matches = self._prefixed(word)
+        if not matches:
+            matches = set().union(*(self._postings[token] for token in self._close_tokens(word)))
+        return matches
+
+    def _prefixed(self, prefix: str) -> Set[str]:
+        matches: Set[str] = set()
+        for i in range(bisect.bisect_left(self._tokens, prefix), len(self._tokens)):
+            if not self._tokens[i].startswith(prefix):
+                break
+            matches |= self._postings[self._tokens[i]]
+        return matches
+
+    # Comparing with every token would take tens of milliseconds per keystroke with a full index, so only those starting
+    # with the same letter and of about the same length are considered, which most typos leave alone
+    def _close_tokens(self, word: str) -> List[str]:
+        start = bisect.bisect_left(self._tokens, word[0])
+        end = bisect.bisect_left(self._tokens, chr(ord(word[0]) + 1), start)
+        nearby = [token for token in self._tokens[start:end] if abs(len(token) - len(word)) <= _MAX_TYPO_LENGTH_DIFFERENCE]
+        return difflib.get_close_matches(word, nearby, n=3, cutoff=0.75)
+
+    def _add_token(self, token: str, video_id: str, entry: _Entry) -> None:
+        entry.tokens.add(token)
+        postings = self._postings.get(token)
+        if postings is None:
+            postings = self._postings[token] = set()
+            bisect.insort(self._tokens, token)
+        postings.add(video_id)
+
+    def _remove(self, video_id: str) -> None:
+        entry = self._entries.pop(video_id)
+        for token in entry.tokens:
+            postings = self._postings[token]
+            postings.discard(video_id)
+            if not postings:
+                del self._postings[token]
+                self._tokens.pop(bisect.bisect_left(self._tokens, token))
+
+
+# Case, accents and punctuation don't count, so "Voce nao vale nada" finds "Você Não Vale Nada!"
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join(_TOKEN_PATTERN.findall("".join(c for c in decomposed if not unicodedata.combining(c))))
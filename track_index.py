@@ -0,0 +1,159 @@
+import asyncio
+import re
+import sqlite3
+import time
+import unicodedata
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+from logs import logger as base_logger
+
+logger = base_logger.bind(context="TrackIndex")
+
+_CANDIDATES = 10
+_TOKEN_PATTERN = re.compile(r"\w+")
+# How much closer the best track's wording has to be than that of a runner-up covering as much of the query, otherwise
+# the query is ambiguous
+_MIN_MARGIN = 0.2
+# Words that may be left out of a track's title and queries without making it a different track
+_FILLER_WORDS = {"a", "an", "and", "by", "feat", "ft", "of", "official", "the", "video",  # English
+                 "as", "com", "da", "de", "do", "e", "o", "os"}  # Portuguese
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    queries TEXT NOT NULL DEFAULT '',
+    plays INTEGER NOT NULL DEFAULT 0,
+    last_played REAL NOT NULL DEFAULT 0
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, queries, content='tracks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts(rowid, title, queries) VALUES (new.rowid, new.title, new.queries);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_update AFTER UPDATE OF title, queries ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, title, queries) VALUES ('delete', old.rowid, old.title, old.queries);
+    INSERT INTO tracks_fts(rowid, title, queries) VALUES (new.rowid, new.title, new.queries);
+END;
+"""
+
+
+@dataclass(frozen=True, kw_only=True)
+class Track:
+    video_id: str
+    title: str
+    queries: List[str]
+    plays: int
+    last_played: float
+
+
+# Every track the bot resolved, with the free-text queries that led to it, kept in SQLite next to the state snapshots.
+# A search is answered locally when every word of the query that tells tracks apart appears in a track's title or past
+# queries, enough of the query's words are covered, and no other track matches as well; anything less certain goes
+# to the YouTube API, since "song remix" or "song live" is a different video than "song".
+# The database is only used from a thread of its own, as waiting for another shard process's lock on the file could
+# otherwise stall the event loop.
+class TrackIndex:
+    _db: sqlite3.Connection
+    _min_coverage: float
+    _executor: ThreadPoolExecutor
+
+    def __init__(self, path: Path, min_coverage: float) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=1.0, check_same_thread=False)  # shard processes share the file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # no fsync per commit, a crash can only lose the latest plays
+        self._db.executescript(_SCHEMA)
+        self._min_coverage = min_coverage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="track-index")
+
+    # Returns right away, the play is written in the background
+    def record(self, video_id: str, title: str, query: str | None) -> None:
+        self._executor.submit(self._record, video_id, title, query)
+
+    async def search(self, query: str) -> str | None:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._search, query)
+
+    async def tracks(self, limit: int) -> List[Track]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._tracks, limit)
+
+    # Waits for pending writes
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._db.close()
+
+    def _record(self, video_id: str, title: str, query: str | None) -> None:
+        try:
+            with self._db:
+                row = self._db.execute("SELECT queries FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+                queries = row[0].split("\n") if row is not None and row[0] else []
+                if query is not None and _normalize(query) not in (_normalize(known) for known in queries):
+                    queries.append(query.replace("\n", " "))
+                self._db.execute("INSERT INTO tracks (video_id, title, queries, plays, last_played) VALUES (?, ?, ?, 1, ?) "
+                                 "ON CONFLICT (video_id) DO UPDATE SET title = excluded.title, queries = excluded.queries, "
+                                 "plays = plays + 1, last_played = excluded.last_played",
+                                 (video_id, title, "\n".join(queries), time.time()))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record video ID {video_id}: {e!r}")
+
+    def _search(self, query: str) -> str | None:
+        words = _TOKEN_PATTERN.findall(_normalize(query))
+        if not words:
+            return None
+        match = " OR ".join(f'"{word}"' for word in words)  # literals, words the user added or left out are for coverage to judge
+        try:
+            rows = self._db.execute("SELECT tracks.video_id, tracks.title, tracks.queries FROM tracks_fts "
+                                    "JOIN tracks ON tracks.rowid = tracks_fts.rowid WHERE tracks_fts MATCH ? "
+                                    "ORDER BY bm25(tracks_fts), tracks.plays DESC LIMIT ?", (match, _CANDIDATES)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Local search for '{query}' failed: {e!r}")
+            return None
+
+        scored = []
+        for video_id, title, queries in rows:
+            texts = [title, *queries.split("\n")]
+            recall = _recall(words, texts)
+            if recall is not None and recall >= self._min_coverage:
+                scored.append((recall, _similarity(words, texts), video_id))
+        scored.sort(reverse=True)
+        if not scored:
+            return None
+        if len(scored) > 1 and scored[0][0] == scored[1][0] and scored[0][1] - scored[1][1] < _MIN_MARGIN:
+            return None
+        return scored[0][2]
+
+    def _tracks(self, limit: int) -> List[Track]:
+        rows = self._db.execute("SELECT video_id, title, queries, plays, last_played FROM tracks "
+                                "ORDER BY last_played DESC LIMIT ?", (limit,)).fetchall()
+        return [Track(video_id=video_id, title=title, queries=queries.split("\n") if queries else [], plays=plays, last_played=last_played)
+                for video_id, title, queries, plays, last_played in rows]
+
+
+# Share of the query's words found in the track's title and past queries, None if any but filler words is missing
+def _recall(words: List[str], texts: List[str]) -> float | None:
+    typed = set(words)
+    known = set(_TOKEN_PATTERN.findall(_normalize(" ".join(texts))))
+    if any(word not in known and word not in _FILLER_WORDS for word in typed):
+        return None
+    return len(typed & known) / len(typed)
+
+
+# Dice coefficient between the words of the query and those of the best matching title or past query, which prefers
+# "song" over "song live" for the query "song"
+def _similarity(words: List[str], texts: List[str]) -> float:
+    typed = set(words)
+    best = 0.0
+    for text in texts:
+        text_words = set(_TOKEN_PATTERN.findall(_normalize(text)))
+        if text_words:
+            best = max(best, 2 * len(typed & text_words) / (len(typed) + len(text_words)))
+    return best
+
+
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
@@ -1,108 +1,236 @@
+import asyncio
 import crypto
+import pacing
+import profiling
 import random
 import struct
 import socket
-import time
 import threading
 
-from typing import Tuple, List
+from typing import Tuple, List, Callable, Any
 from logs import logger as base_logger
-from dave.session import DaveSessionManager, MediaKey
+from dave.session import DaveSessionManager, MediaKeyStream
 from media_file import MediaFile
+from opus import EncoderSettings, SKIPPED_FRAME
 
 logger = base_logger.bind(context="UDP")
 
 _IP_DISCOVERY_PACKET_FORMAT = "!HHI64sH"
+_IP_DISCOVERY_RESPONSE_TYPE = 0x2
 _RTP_HEADER_FORMAT = "!ccHII"
+_RTP_HEADER_SIZE = struct.calcsize(_RTP_HEADER_FORMAT)
+_MAX_OPUS_PACKET_SIZE = 4000
+_MAX_ULEB128_SIZE = 5
+_DAVE_MAGIC_MARKER = b'\xFA\xFA'
+# ciphertext, untruncated GCM tag (briefly written before truncation), ULEB128 nonce, supplemental data size and marker
+_DAVE_FRAME_BUFFER_SIZE = _MAX_OPUS_PACKET_SIZE + 16 + _MAX_ULEB128_SIZE + 1 + len(_DAVE_MAGIC_MARKER)
+_PACKET_BUFFER_SIZE = _RTP_HEADER_SIZE + _DAVE_FRAME_BUFFER_SIZE + crypto.TRANSPORT_TAG_SIZE + 4
 
 
 def _ip_discovery_packet(ssrc: int) -> bytes:
     return struct.pack(_IP_DISCOVERY_PACKET_FORMAT, 0x1, 70, ssrc, b"", 0)
 
 
-def _ip_discovery_response(resp: bytes) -> Tuple[str, int]:
-    (_, _, _, ip, port) = struct.unpack(_IP_DISCOVERY_PACKET_FORMAT, resp)
+def _ip_discovery_response(resp: bytes, ssrc: int) -> Tuple[str, int] | None:
+    if len(resp) != struct.calcsize(_IP_DISCOVERY_PACKET_FORMAT):
+        return None
+    (packet_type, _, resp_ssrc, ip, port) = struct.unpack(_IP_DISCOVERY_PACKET_FORMAT, resp)
+    if packet_type != _IP_DISCOVERY_RESPONSE_TYPE or resp_ssrc != ssrc:
+        return None
     return (ip.decode().replace("\x00", ""), port)
 
 
-def do_ip_discovery(sock: socket.socket, ssrc: int) -> Tuple[str, int]:
-    logger.log("OUT", "IP DISCOVERY REQUEST")
-    sock.send(_ip_discovery_packet(ssrc))
-    (resp, from_addr) = sock.recvfrom(1024)
-    parsed_resp = _ip_discovery_response(resp)
-    logger.log("IN", f"IP DISCOVERY RESPONSE: {parsed_resp}")
-    return parsed_resp
-
-
-def _rtp_header(ssrc: int, seq: int, timestamp: int) -> bytes:
-    return struct.pack(_RTP_HEADER_FORMAT, b'\x80', b'\x78', seq & ((1 << 16) - 1), timestamp & ((1 << 32) - 1), ssrc)
-
-
-def _to_uleb128(val: int) -> bytes:
-    result = b''
+# UDP gives no delivery guarantee, so the request is resent whenever a response doesn't arrive in time
+async def do_ip_discovery(sock: socket.socket, ssrc: int, timeout: float, attempts: int) -> Tuple[str, int]:
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    try:
+        for attempt in range(1, attempts + 1):
+            logger.log("OUT", f"IP DISCOVERY REQUEST (attempt {attempt})")
+            await loop.sock_sendall(sock, _ip_discovery_packet(ssrc))
+            try:
+                async with asyncio.timeout(timeout):
+                    while (parsed_resp := _ip_discovery_response(await loop.sock_recv(sock, 1024), ssrc)) is None:
+                        logger.warning("Ignoring unexpected packet during IP discovery")
+            except TimeoutError:
+                logger.warning(f"IP discovery attempt {attempt} timed out after {timeout} s")
+                continue
+            logger.log("IN", f"IP DISCOVERY RESPONSE: {parsed_resp}")
+            return parsed_resp
+    finally:
+        sock.setblocking(True)
+    raise TimeoutError(f"No IP discovery response after {attempts} attempts")
+
+
+def _write_uleb128(buf: bytearray, offset: int, val: int) -> int:
     while val >= 0x80:
-        result += (0x80 | (val & 0x7F)).to_bytes(length=1)
+        buf[offset] = 0x80 | (val & 0x7F)
+        offset += 1
         val >>= 7
-    result += val.to_bytes(length=1)
-    return result
-
-
-def _build_dave_payload(payload: bytes, media_key: MediaKey) -> bytes:
-    ciphertext, tag = crypto.encrypt_dave(payload, media_key.nonce, media_key.key)
-    nonce_uleb128 = _to_uleb128(media_key.nonce)
-    supplemental_data_size = len(tag) + len(nonce_uleb128) + 3
-    return ciphertext + tag + nonce_uleb128 + supplemental_data_size.to_bytes(length=1) + b'\xFA\xFA'
-
-
-def _build_audio_packet(payload: bytes, ssrc: int, sequence: int, timestamp: int,
-                        encryption_key: bytes, nonce: int, encryption_mode: str,
-                        dave: DaveSessionManager) -> bytes:
-    header = _rtp_header(ssrc, sequence, timestamp)
-
-    media_key = dave.get_current_media_key()
-    if media_key is not None:
-        payload = _build_dave_payload(payload, media_key)
-
-    trunc_nonce = nonce & 0xFFFFFFFF
-    encrypted_payload = crypto.encrypt_packet(header, payload, trunc_nonce, encryption_key, encryption_mode)
-    return header + encrypted_payload + trunc_nonce.to_bytes(4, "little")
+    buf[offset] = val
+    return offset + 1
+
+
+class _AudioPacketBuilder:
+    _ssrc: int
+    _media_keys: MediaKeyStream
+    _transport_encryptor: crypto.TransportEncryptor
+    _dave_encryptor: crypto.DaveEncryptor
+    _packet: bytearray
+    _packet_view: memoryview
+    _header_view: memoryview
+    _dave_frame: bytearray
+    _dave_frame_view: memoryview
+
+    def __init__(self, ssrc: int, encryption_key: bytes, encryption_mode: str, dave: DaveSessionManager) -> None:
+        self._ssrc = ssrc
+        self._media_keys = MediaKeyStream(dave)
+        self._transport_encryptor = crypto.TransportEncryptor(encryption_key, encryption_mode)
+        self._dave_encryptor = crypto.DaveEncryptor()
+        self._packet = bytearray(_PACKET_BUFFER_SIZE)
+        self._packet_view = memoryview(self._packet)
+        self._header_view = self._packet_view[:_RTP_HEADER_SIZE]
+        self._dave_frame = bytearray(_DAVE_FRAME_BUFFER_SIZE)
+        self._dave_frame_view = memoryview(self._dave_frame)
+
+    # The returned view is only valid until the next call, as every packet is built in the same buffer
+    def build(self, payload: bytes, sequence: int, timestamp: int, nonce: int) -> memoryview:
+        struct.pack_into(_RTP_HEADER_FORMAT, self._packet, 0, b'\x80', b'\x78', sequence & ((1 << 16) - 1), timestamp & ((1 << 32) - 1), self._ssrc)
+
+        started = profiling.start()
+        media_key = self._media_keys.next_key()
+        payload_view = self._build_dave_frame(payload, *media_key) if media_key is not None else memoryview(payload)
+        profiling.stop("dave encrypt", started)
+
+        started = profiling.start()
+        trunc_nonce = nonce & 0xFFFFFFFF
+        size = _RTP_HEADER_SIZE + self._transport_encryptor.encrypt_into(self._header_view, payload_view, trunc_nonce, self._packet_view[_RTP_HEADER_SIZE:])
+        profiling.stop("transport encrypt", started)
+        struct.pack_into("<I", self._packet, size, trunc_nonce)
+        return self._packet_view[:size + 4]
+
+    def _build_dave_frame(self, payload: bytes, key: bytes, nonce: int) -> memoryview:
+        frame = self._dave_frame
+        offset = self._dave_encryptor.encrypt_into(payload, nonce, key, self._dave_frame_view)
+        offset = _write_uleb128(frame, offset, nonce)
+        supplemental_data_size = offset - len(payload) + 1 + len(_DAVE_MAGIC_MARKER)
+        frame[offset] = supplemental_data_size
+        frame[offset + 1:offset + 3] = _DAVE_MAGIC_MARKER
+        return self._dave_frame_view[:offset + 3]
+
+
+# Lets the event loop stop a running stream or move it to another position, and see where it is
+class StreamControl:
+    _stop_event: threading.Event
+    _lock: threading.Lock
+    _seek_position: float | None
+    position: float  # seconds, written by the stream thread only
+
+    def __init__(self) -> None:
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._seek_position = None
+        self.position = 0.0
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def seek(self, position: float) -> None:
+        with self._lock:
+            self._seek_position = position
+
+    def take_seek(self) -> float | None:
+        with self._lock:
+            position, self._seek_position = self._seek_position, None
+            return position
 
 
 def stream_audio(sock: socket.socket, media_file: MediaFile, ssrc: int,
                  initial_seq: int, encryption_key: List[int], nonce: int,
-                 encryption_mode: str, stop_event: threading.Event, dave: DaveSessionManager) -> int:
+                 encryption_mode: str, control: StreamControl, dave: DaveSessionManager,
+                 encoder_settings: EncoderSettings, pacing_settings: pacing.PacingSettings,
+                 set_speaking: Callable[[bool], Any], start: float = 0.0) -> int:
+    with pacing.sender_scheduling(pacing_settings):
+        return _stream_audio(sock, media_file, ssrc, initial_seq, encryption_key, nonce, encryption_mode,
+                             control, dave, encoder_settings, pacing_settings, set_speaking, start)
+
+
+def _stream_audio(sock: socket.socket, media_file: MediaFile, ssrc: int,
+                  initial_seq: int, encryption_key: List[int], nonce: int,
+                  encryption_mode: str, control: StreamControl, dave: DaveSessionManager,
+                  encoder_settings: EncoderSettings, pacing_settings: pacing.PacingSettings,
+                  set_speaking: Callable[[bool], Any], start: float) -> int:
     logger.info("Starting audio stream")
 
     ts = random.getrandbits(32)  # TODO: should be voice client state
     k = bytes(encryption_key)
 
-    opus_packets = media_file.opus_packets()
+    opus_packets = media_file.opus_packets(encoder_settings, start)
 
-    packets = (_build_audio_packet(payload, ssrc, initial_seq + i, ts + 960*i, k, nonce+i, encryption_mode, dave) for (i, payload) in enumerate(opus_packets))
+    builder = _AudioPacketBuilder(ssrc, k, encryption_mode, dave)
 
-    next_time = None
+    pacer = pacing.Pacer(0.02, pacing_settings)
+    position = start
+    frames = 0
+    numbered_packets = 0  # sent or dropped, each takes a sequence number and a nonce
     sent_packets = 0
+    speaking = False
 
     try:
-        for packet in packets:
-            if stop_event.is_set():
+        while True:
+            try:
+                payload = next(opus_packets)  # not a for loop, seeking replaces the generator
+            except StopIteration:
+                break
+            if control.stopped():
                 logger.info("Received stop event, stopping stream")
                 break
 
-            if next_time is None:
-                next_time = time.perf_counter()
-
-            sleep_amount = next_time - time.perf_counter()
-            if sleep_amount > 0:
-                time.sleep(sleep_amount)
-
-            sock.send(packet)
-            sent_packets += 1
-            next_time += 0.02
+            seek_position = control.take_seek()
+            if seek_position is not None:
+                # sequence, timestamp and nonce carry on, so receivers see one continuous stream
+                logger.info(f"Seeking to {seek_position:.2f} s")
+                opus_packets.close()
+                opus_packets = media_file.opus_packets(encoder_settings, seek_position)
+                pacer.reset()
+                position = seek_position
+                continue
+            if payload == SKIPPED_FRAME:
+                position += 0.02
+                control.position = position
+                continue
+
+            if payload is not None:
+                if not speaking:
+                    set_speaking(True)
+                    speaking = True
+            elif speaking:  # trailing silence frames were already sent
+                set_speaking(False)
+                speaking = False
+
+            # Packets are only built once they are due, so one that gets dropped costs no encryption
+            if pacer.wait():
+                if payload is not None:
+                    packet = builder.build(payload, initial_seq + numbered_packets, ts + 960*frames, nonce + numbered_packets)
+                    started = profiling.start()
+                    sock.send(packet)
+                    profiling.stop("socket send", started)
+                    numbered_packets += 1
+                    sent_packets += 1
+            elif payload is not None:
+                numbered_packets += 1  # the sequence number is skipped, so receivers see the packet as lost
+            frames += 1
+            position += 0.02
+            control.position = position
     except OSError as e:
         if e.errno == 9:
             logger.info("Socket was closed. Stopping stream.")
         else:
             logger.warning(f"Socket was closed unexpectedly (error code = {e.errno}. Stopping stream.")
-    logger.info(f"Audio stream end, duration: {0.02 * sent_packets} seconds, total packets sent: {sent_packets}")
-    return sent_packets
+    finally:
+        opus_packets.close()  # stops the decoder or demuxer now rather than whenever the generator gets collected
+    logger.info(f"Audio stream end, duration: {0.02 * frames:.2f} seconds, total packets sent: {sent_packets}, pacing: {pacer}")
+    return numbered_packets
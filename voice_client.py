@@ -1,17 +1,26 @@
 import asyncio
+import heartbeat
 import json
+import logs
+import profiling
 import random
+import reconnect
+import session_state
 import socket
 import threading
 import udp
 import websockets
 
+from collections import deque
+from timing import PhaseTimer
 from voice_event import VoiceEvent, VoiceOpCode
-from typing import Any, List, Callable, Awaitable
+from typing import Any, Deque, Dict, List, Callable, Awaitable, Tuple
 from config import Config
 from logs import logger as base_logger
-from concurrent.futures import ThreadPoolExecutor, Executor
+from concurrent.futures import ThreadPoolExecutor
 from media_file import MediaFile
+from opus import EncoderSettings
+from pacing import PacingSettings
 from dave.session import DaveSessionManager, DaveInvalidCommitException, TransitionType
 from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
 
@@ -31,21 +40,34 @@ class VoiceClient:
     _last_seq: int
     _rtp_nonce: int
     _closed: bool
-    _executor: Executor
+    _stream_executor: ThreadPoolExecutor
+    _download_executor: ThreadPoolExecutor
+    _thread_name_prefix: str
+    _voice_ready: asyncio.Event
     _session_ready: asyncio.Event
     _dave_session_ready: asyncio.Event
     _idle_timer: asyncio.Task | None
     _player: asyncio.Task
     _media_queue: asyncio.Queue
-    _stop_event: threading.Event | None
+    _queued: Deque[Tuple[MediaFile, float]]  # what _media_queue holds, for snapshots
+    _stream_control: udp.StreamControl | None
+    _current_media: MediaFile | None
     _dave_session_manager: DaveSessionManager
     _external_sender_ready: asyncio.Event
     _identified: bool
-    _ws: websockets.ClientConnection
-    _sock: socket.socket
+    _ws: websockets.ClientConnection | None
+    _sock: socket.socket | None
     _transport_encryption_mode: str
     _transport_encryption_key: List[int]
-    _recv_loop: asyncio.Task
+    _recv_loop: asyncio.Task | None
+    _join_watchdog: asyncio.Task | None
+    _join_timer: PhaseTimer
+    _encoder_settings: EncoderSettings
+    _pacing_settings: PacingSettings
+    _speaking: bool
+    _heartbeat_task: asyncio.Task | None
+    _heartbeat_monitor: heartbeat.HeartbeatMonitor
+    _backoff: reconnect.Backoff
 
     def __init__(
         self,
@@ -56,30 +78,68 @@ class VoiceClient:
         token: str,
         on_close: Callable[[], Awaitable[Any]],
         config: Config,
+        join_timer: PhaseTimer,
     ) -> None:
         self._guild_id = guild_id
         self._channel_id = channel_id
-        self._url = f"wss://{url}?v=8"
+        self._url = f"{url}?v=8" if "://" in url else f"wss://{url}?v=8"  # Discord endpoints come without a scheme
         self._session_id = session_id
         self._token = token
         self._on_close = on_close
         self._config = config
+        self._join_timer = join_timer
 
         self._ssrc = 0
         self._audio_seq = random.getrandbits(32)
         self._last_seq = -1
         self._rtp_nonce = random.getrandbits(32)
         self._closed = False
-        self._executor = ThreadPoolExecutor()
+        # Streaming has a thread of its own, so the current media never waits behind downloads of what's queued next
+        self._thread_name_prefix = f"voice-{guild_id}-"
+        self._stream_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self._thread_name_prefix}stream")
+        self._download_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"{self._thread_name_prefix}download")
+        self._voice_ready = asyncio.Event()
         self._session_ready = asyncio.Event()
         self._dave_session_ready = asyncio.Event()
         self._idle_timer = None
         self._player = asyncio.create_task(self._play_loop())
         self._media_queue = asyncio.Queue()
-        self._stop_event = None
-        self._dave_session_manager = DaveSessionManager(self._config.application_id)
+        self._queued = deque()
+        self._stream_control = None
+        self._current_media = None
+        self._dave_session_manager = DaveSessionManager(self._config.application_id, self._guild_id)
         self._external_sender_ready = asyncio.Event()
         self._identified = False
+        self._encoder_settings = EncoderSettings(bitrate=config.opus_bitrate,
+                                                 complexity=config.opus_complexity,
+                                                 vbr=config.opus_vbr,
+                                                 fec=config.opus_fec,
+                                                 expected_packet_loss=config.opus_expected_packet_loss,
+                                                 signal=config.opus_signal,
+                                                 min_complexity=config.opus_min_complexity,
+                                                 encode_time_threshold=config.opus_encode_time_threshold,
+                                                 max_full_complexity_streams=config.opus_max_full_complexity_streams,
+                                                 passthrough=config.opus_passthrough,
+                                                 trim_silence=config.silence_trim,
+                                                 silence_suppression_threshold=config.silence_suppression_threshold,
+                                                 gain=config.audio_gain,
+                                                 normalize_loudness=config.loudness_normalization,
+                                                 loudness_target=config.loudness_target,
+                                                 fade_in=config.fade_in,
+                                                 fade_out=config.fade_out)
+        self._pacing_settings = PacingSettings(spin_time=config.pacing_spin_time,
+                                               late_policy=config.pacing_late_policy,
+                                               max_catch_up=config.pacing_max_catch_up,
+                                               realtime_priority=config.sender_realtime_priority,
+                                               cpu_affinity=config.sender_cpu_affinity)
+        self._speaking = False
+        self._heartbeat_task = None
+        self._ws = None
+        self._sock = None
+        self._recv_loop = None
+        self._join_watchdog = None
+        self._heartbeat_monitor = heartbeat.HeartbeatMonitor(config.heartbeat_max_missed)
+        self._backoff = reconnect.Backoff(config.reconnect_max_delay)
 
     @property
     def channel_id(self) -> str:
@@ -89,41 +149,101 @@ class VoiceClient:
     def closed(self) -> bool:
         return self._closed
 
+    @property
+    def latency(self) -> float | None:
+        return self._heartbeat_monitor.latency
+
     async def start(self) -> None:
-        self._ws = await websockets.connect(self._url)
         try:
+            self._ws = await websockets.connect(self._url, open_timeout=self._config.voice_join_phase_timeout)
+            self._join_timer.mark("websocket connect")
             self._recv_loop = asyncio.create_task(self._receive_loop())
+            self._join_watchdog = asyncio.create_task(self._watch_join())
             await self._recv_loop
+        except (OSError, TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+            logger.warning(f"Could not connect to voice gateway {self._url}: {e!r}")
         except asyncio.exceptions.CancelledError:
             logger.info("Receive loop task cancelled")
         finally:
             await self._close()
 
-    async def enqueue_media(self, media: MediaFile) -> None:
-        asyncio.get_running_loop().run_in_executor(self._executor, media.download)
-        await self._media_queue.put(media)
+    # Every phase of the handshake gets its own deadline, so a join that gets stuck anywhere gives up instead of hanging
+    async def _watch_join(self) -> None:
+        phases = [("READY", self._voice_ready), ("session description", self._session_ready), ("DAVE session", self._dave_session_ready)]
+        for phase, ready in phases:
+            try:
+                await asyncio.wait_for(ready.wait(), self._config.voice_join_phase_timeout)
+            except TimeoutError:
+                logger.warning(f"Voice join of guild {self._guild_id} timed out waiting for {phase} "
+                               f"after {self._config.voice_join_phase_timeout} s, phases so far: {self._join_timer}")
+                await self._close()
+                return
+        self._join_timer.mark("DAVE ready")
+        logger.info(f"Joined voice in guild {self._guild_id}: {self._join_timer}")
+
+    async def enqueue_media(self, media: MediaFile, start: float = 0.0) -> None:
+        asyncio.get_running_loop().run_in_executor(self._download_executor, media.download)
+        self._queued.append((media, start))
+        await self._media_queue.put((media, start))
+
+    def resource_usage(self) -> Dict[str, int]:
+        tasks = [self._player, self._recv_loop, self._join_watchdog, self._heartbeat_task, self._idle_timer]
+        return {"queued media": len(self._queued),
+                "threads": sum(1 for thread in threading.enumerate() if thread.name.startswith(self._thread_name_prefix)),
+                "tasks": sum(1 for task in tasks if task is not None and not task.done()),
+                "open sockets": int(self._sock is not None and self._sock.fileno() != -1) + int(self._ws is not None and self._ws.close_code is None)}
+
+    def playback_state(self) -> session_state.GuildPlayback | None:
+        queue = [(media, start) for media, start in self._queued]
+        if self._current_media is not None and self._stream_control is not None:
+            queue.insert(0, (self._current_media, self._stream_control.position))
+        if not queue:
+            return None
+        return session_state.GuildPlayback(guild_id=self._guild_id,
+                                           channel_id=self._channel_id,
+                                           queue=[session_state.QueuedMedia(id=media.id, title=media.title, thumbnail=media.thumbnail,
+                                                                            duration=media.duration, link=media.link, start=start)
+                                                  for media, start in queue])
 
     def skip_current_media(self) -> bool:
-        if self._stop_event is not None:
-            self._stop_event.set()
+        if self._stream_control is not None:
+            self._stream_control.stop()
             return True
         return False
 
+    def seek_current_media(self, position: float) -> bool:
+        if self._stream_control is None or self._current_media is None:
+            return False
+        if not 0 <= position < self._current_media.duration:
+            return False
+        self._stream_control.seek(position)
+        return True
+
     async def _send(self, op: VoiceOpCode, data: Any) -> None:
         payload = {"op": op.value, "d": data}
+        assert self._ws is not None
         await self._ws.send(json.dumps(payload))
         # TODO have logger.log("OUT",...) only here and remove all others?
 
     async def _send_binary(self, op: VoiceOpCode, data: bytes) -> None:
+        assert self._ws is not None
         await self._ws.send(op.value.to_bytes(length=1) + data)
 
     async def _send_heartbeat(self, nonce: int) -> None:
         await self._send(VoiceOpCode.HEARTBEAT, {"seq_ack": self._last_seq, "t": nonce})
-        logger.log("OUT", f"HEARTBEAT last_seq = {self._last_seq}, nonce = {nonce}")
+        self._heartbeat_monitor.sent(nonce)
+        if logs.sample("voice heartbeat"):
+            logger.log("OUT", "HEARTBEAT last_seq = {}, nonce = {}", self._last_seq, nonce)
 
     async def _regular_heartbeats(self, heartbeat_interval: float) -> None:
         heartbeat_nonce = random.randint(1000000000000, 1999999999999)
+        self._heartbeat_monitor.reset()
         while True:
+            if self._heartbeat_monitor.expired():
+                logger.warning(f"{self._heartbeat_monitor.missed} heartbeats were not acknowledged, dropping zombie connection")
+                assert self._ws is not None
+                self._ws.transport.abort()  # the receive loop sees an abnormal closure and resumes
+                return
             try:
                 await self._send_heartbeat(heartbeat_nonce)
             except websockets.exceptions.ConnectionClosed:
@@ -131,6 +251,16 @@ class VoiceClient:
             await asyncio.sleep(heartbeat_interval)
             heartbeat_nonce += 1
 
+    def _handle_heartbeat_ack(self, event: VoiceEvent) -> None:
+        rtt = self._heartbeat_monitor.acked(event["t"])
+        if rtt is None:
+            logger.warning("Received heartbeat ACK with unexpected nonce: {}", event)
+            return
+        if logs.sample("voice heartbeat ACK"):
+            average = self._heartbeat_monitor.average_latency
+            assert average is not None  # the acknowledged heartbeat was just recorded
+            logger.log("IN", "VOICE HEARTBEAT ACK rtt = {:.1f} ms, average = {:.1f} ms", rtt * 1000, average * 1000)
+
     async def _identify(self) -> None:
         data = {
             "token": self._token,
@@ -143,19 +273,21 @@ class VoiceClient:
         await self._send(VoiceOpCode.IDENTIFY, data)
 
     async def _send_key_package(self) -> None:
-        key_package = self._dave_session_manager.get_key_package_message()
+        key_package = await self._dave_session_manager.get_key_package_message()
         await self._send_binary(VoiceOpCode.DAVE_MLS_KEY_PACKAGE, key_package)
         logger.log("OUT", "DAVE MLS KEY PACKAGE")
 
     async def _handle_hello(self, event: VoiceEvent) -> None:
-        logger.log("IN", f"HELLO {event}")
-
-        if self._identified:
-            return
+        logger.log("IN", "HELLO {}", event)
 
+        # every connection, resumed ones included, gets its own HELLO and heartbeat interval
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
         heartbeat_interval = event["heartbeat_interval"] / 1000
-        await self._identify()
-        asyncio.create_task(self._regular_heartbeats(heartbeat_interval))
+        self._heartbeat_task = asyncio.create_task(self._regular_heartbeats(heartbeat_interval))
+
+        if not self._identified:
+            await self._identify()
 
     def _prepare_socket(self, ip: str, port: int) -> None:
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -163,13 +295,23 @@ class VoiceClient:
         self._sock.connect((ip, port))
 
     async def _handle_ready(self, event: VoiceEvent) -> None:
-        logger.log("IN", f"VOICE READY {event}")
+        logger.log("IN", "VOICE READY {}", event)
         self._identified = True
+        self._backoff.reset()
         ip, port, ssrc, modes = event["ip"], event["port"], event["ssrc"], event["modes"]
         self._transport_encryption_mode = "aead_aes256_gcm_rtpsize" if "aead_aes256_gcm_rtpsize" in modes else "aead_xchacha20_poly1305_rtpsize"
         self._ssrc = ssrc
+        self._voice_ready.set()
+        self._join_timer.mark("READY")
         self._prepare_socket(ip, port)
-        my_ip, my_port = udp.do_ip_discovery(self._sock, ssrc)
+        assert self._sock is not None
+        try:
+            my_ip, my_port = await udp.do_ip_discovery(self._sock, ssrc, self._config.ip_discovery_timeout, self._config.ip_discovery_attempts)
+        except (OSError, TimeoutError) as e:
+            logger.warning(f"IP discovery failed: {e!r}")
+            await self._close()
+            return
+        self._join_timer.mark("IP discovery")
         logger.log("OUT", f"SELECT PROTOCOL encryption mode = {self._transport_encryption_mode}")
         await self._send(VoiceOpCode.SELECT_PROTOCOL,
                          {"protocol": "udp",
@@ -184,13 +326,19 @@ class VoiceClient:
         await self._session_ready.wait()
         await self._dave_session_ready.wait()
 
-    async def _play_song(self, media_file: MediaFile) -> None:
+    async def _play_song(self, media_file: MediaFile, start: float) -> None:
+        self._stream_control = udp.StreamControl()
+        self._stream_control.position = start
+        self._current_media = media_file
         await self._ensure_ready()
 
-        logger.info(f"Now playing {media_file}")
-        self._stop_event = threading.Event()
-        sent_packets = await asyncio.get_running_loop().run_in_executor(
-            self._executor,
+        logger.info(f"Now playing {media_file}" + (f" from {start:.1f} s" if start else ""))
+        loop = asyncio.get_running_loop()
+        # dropped packets count too, their sequence numbers and nonces are used up
+        packets = await loop.run_in_executor(
+            self._stream_executor,
+            profiling.run_attributed,
+            self._guild_id,
             udp.stream_audio,
             self._sock,
             media_file,
@@ -199,12 +347,17 @@ class VoiceClient:
             self._transport_encryption_key,
             self._rtp_nonce,
             self._transport_encryption_mode,
-            self._stop_event,
+            self._stream_control,
             self._dave_session_manager,
+            self._encoder_settings,
+            self._pacing_settings,
+            lambda speaking: asyncio.run_coroutine_threadsafe(self._set_speaking(speaking), loop),
+            start,
         )
-        self._audio_seq += sent_packets
-        self._rtp_nonce += sent_packets
-        self._stop_event = None
+        self._audio_seq += packets
+        self._rtp_nonce += packets
+        self._stream_control = None
+        self._current_media = None
 
     async def _play_loop(self) -> None:
         try:
@@ -214,7 +367,7 @@ class VoiceClient:
                 if self._media_queue.qsize() == 0:
                     self._idle_timer = asyncio.create_task(self._disconnect_after_delay())
 
-                next_media = await self._media_queue.get()
+                next_media, start = await self._media_queue.get()
 
                 if self._idle_timer is not None:
                     self._idle_timer.cancel()
@@ -222,21 +375,22 @@ class VoiceClient:
 
                 logger.info(f"Waiting for download of {next_media} to complete...")
                 ready = await next_media.downloaded
+                self._queued.popleft()  # only now, so snapshots taken while downloading still have it
                 if ready:
-                    await self._play_song(next_media)
+                    await self._play_song(next_media, start)
                 else:
                     logger.warning(f"Download of {next_media} did not succeed, skipping")
         except asyncio.CancelledError:
             logger.info("Play loop cancelled")
 
     async def _handle_session_description(self, event: VoiceEvent) -> None:
-        logger.log("IN", f"SESSION DESCRIPTION {event}")
+        logger.log("IN", "SESSION DESCRIPTION {}", event)
+        self._join_timer.mark("session description")
 
         self._transport_encryption_key = event["secret_key"]
 
-        speaking_payload = {"ssrc": self._ssrc, "speaking": (1 << 0), "delay": 0}
-        await self._send(VoiceOpCode.SPEAKING, speaking_payload)
-        logger.log("OUT", f"SPEAKING {speaking_payload}")
+        self._speaking = False
+        await self._set_speaking(True)
 
         if event["dave_protocol_version"] > 0:
             await self._send_key_package()
@@ -245,6 +399,27 @@ class VoiceClient:
 
         self._session_ready.set()
 
+    async def _set_speaking(self, speaking: bool) -> None:
+        if speaking == self._speaking:
+            return
+        self._speaking = speaking
+        await self._send_speaking()
+
+    async def _send_speaking(self) -> None:
+        speaking_payload = {"ssrc": self._ssrc, "speaking": (1 << 0) if self._speaking else 0, "delay": 0}
+        try:
+            await self._send(VoiceOpCode.SPEAKING, speaking_payload)
+        except ConnectionClosed:
+            logger.info(f"Could not send SPEAKING {speaking_payload}, connection is closed (resent after resuming)")
+            return
+        logger.log("OUT", f"SPEAKING {speaking_payload}")
+
+    async def _handle_resumed(self) -> None:
+        logger.info("Connection resumed successfully")
+        self._backoff.reset()
+        if self._speaking:
+            await self._send_speaking()
+
     def _handle_dave_mls_external_sender(self, event: VoiceEvent) -> None:
         logger.log("IN", "DAVE MLS EXTERNAL SENDER")
 
@@ -260,21 +435,21 @@ class VoiceClient:
 
         await asyncio.wait_for(self._external_sender_ready.wait(), timeout=10.0)
 
-        self._dave_session_manager.stage_transition_from_welcome(transition_id, event["welcome_message"])
+        await self._dave_session_manager.stage_transition_from_welcome(transition_id, event["welcome_message"])
 
         if transition_id == 0:
-            self._dave_session_manager.execute_transition(0)
+            await self._dave_session_manager.execute_transition(0)
             logger.info("DAVE transition successfully executed (initial group creation - immediate transition from welcome)")
             self._dave_session_ready.set()
         else:
             await self._send(VoiceOpCode.DAVE_TRANSITION_READY, {"transition_id": transition_id})
             logger.log("OUT", f"DAVE TRANSITION READY (transition_id = {transition_id})")
 
-    def _handle_dave_execute_transition(self, event: VoiceEvent) -> None:
+    async def _handle_dave_execute_transition(self, event: VoiceEvent) -> None:
         transition_id = event["transition_id"]
         logger.log("IN", f"DAVE EXECUTE TRANSITION (transition_id = {transition_id})")
 
-        transition_type = self._dave_session_manager.execute_transition(transition_id)
+        transition_type = await self._dave_session_manager.execute_transition(transition_id)
         if transition_type is not None:
             logger.info(f"DAVE transition {transition_id} successfully executed (type = {transition_type})")
         else:
@@ -294,7 +469,7 @@ class VoiceClient:
             case 0:  # Append
                 await asyncio.wait_for(self._external_sender_ready.wait(), timeout=10.0)
 
-                commit_welcome_message = self._dave_session_manager.append_proposals(event["proposal_messages"])
+                commit_welcome_message = await self._dave_session_manager.append_proposals(event["proposal_messages"])
 
                 if commit_welcome_message is not None:
                     await self._send_binary(VoiceOpCode.DAVE_MLS_COMMIT_WELCOME, commit_welcome_message)
@@ -302,7 +477,7 @@ class VoiceClient:
                 else:
                     logger.info("Proposal processing skipped")
             case 1:  # Revoke - note: untested
-                self._dave_session_manager.revoke_proposals(event["proposal_refs"])
+                await self._dave_session_manager.revoke_proposals(event["proposal_refs"])
                 logger.info("Proposal revocation successful")
             case _:
                 raise ValueError(f"Unknown DAVE MLS PROPOSALS operation type: {operation_type}")
@@ -310,7 +485,7 @@ class VoiceClient:
     async def _invalid_commit_recovery(self, transition_id: int) -> None:
         logger.warning("Received invalid commit, starting recovery flow")
 
-        self._dave_session_manager.reset_session()
+        await self._dave_session_manager.reset_session()
 
         await self._send(VoiceOpCode.DAVE_MLS_INVALID_COMMIT_WELCOME, {"transition_id": transition_id})
         logger.log("OUT", f"DAVE MLS INVALID COMMIT WELCOME (transition_id = {transition_id})")
@@ -322,26 +497,26 @@ class VoiceClient:
         logger.log("IN", f"DAVE MLS ANNOUNCE COMMIT TRANSITION (transition_id = {transition_id})")
 
         try:
-            self._dave_session_manager.stage_transition_from_commit(transition_id, event["commit_message"])
+            await self._dave_session_manager.stage_transition_from_commit(transition_id, event["commit_message"])
         except DaveInvalidCommitException:
             await self._invalid_commit_recovery(transition_id)
             return
 
         if transition_id == 0:
-            self._dave_session_manager.execute_transition(0)
+            await self._dave_session_manager.execute_transition(0)
             logger.info("DAVE transition successfully executed (initial group creation - immediate transition from own commit)")
             self._dave_session_ready.set()
         else:
             await self._send(VoiceOpCode.DAVE_TRANSITION_READY, {"transition_id": transition_id})
             logger.log("OUT", f"DAVE TRANSITION READY (transition_id = {transition_id})")
 
-    def _handle_dave_prepare_transition(self, event: VoiceEvent) -> None:
+    async def _handle_dave_prepare_transition(self, event: VoiceEvent) -> None:
         transition_id = event["transition_id"]
         protocol_version = event["protocol_version"]
         logger.log("IN", f"DAVE PREPARE TRANSITION (transition_id = {transition_id}, protocol_version = {protocol_version})")
 
         if protocol_version == 0:
-            self._dave_session_manager.stage_downgrade_transition(transition_id)
+            await self._dave_session_manager.stage_downgrade_transition(transition_id)
         elif protocol_version == 1:
             if transition_id == 0:
                 logger.info("DAVE sole member reset")
@@ -359,23 +534,32 @@ class VoiceClient:
             raise NotImplementedError(f"No support for transition to DAVE protocol version {dave_version}")
 
         if epoch == 1:  # Either upgrade from transport-only, or sole member reset
-            self._dave_session_manager.reset_session()
+            await self._dave_session_manager.reset_session()
             await self._send_key_package()
 
-    async def _reconnect(self) -> None:
+    # Only the websocket is replaced, the UDP socket and the audio stream using it keep going throughout
+    async def _reconnect(self) -> bool:
         logger.info("Reconnecting...")
+        assert self._ws is not None
+        await self._ws.close()
+        ws = await reconnect.connect(self._url, self._backoff, self._config.voice_reconnect_attempts)
+        if ws is None:
+            return False
+
+        self._ws = ws
+        resume = {
+            "server_id": self._guild_id,
+            "session_id": self._session_id,
+            "token": self._token,
+            "seq_ack": self._last_seq
+        }
         try:
-            self._ws = await websockets.connect(self._url)
-            resume = {
-                "server_id": self._guild_id,
-                "session_id": self._session_id,
-                "token": self._token,
-                "seq_ack": self._last_seq
-            }
             await self._send(VoiceOpCode.RESUME, resume)
-            logger.log("OUT", f"RESUME (server_id = {self._guild_id})")
-        except Exception as e:
-            logger.warning(f"Failed to reconnect: {e}")
+        except ConnectionClosed as e:
+            logger.warning(f"Could not send resume: {e}")  # the receive loop sees the closed connection and retries
+            return True
+        logger.log("OUT", f"RESUME (server_id = {self._guild_id}, seq_ack = {self._last_seq})")
+        return True
 
     async def _handle_disconnection(self, exception: ConnectionClosed) -> bool:
         if _kicked_or_call_terminated(exception):
@@ -388,19 +572,19 @@ class VoiceClient:
             logger.warning(f"Connection closed (error): {exception}")
 
         if _should_reconnect(exception):
-            await self._reconnect()
-            return True
+            return await self._reconnect()
         return False
 
     async def _receive_loop(self) -> None:
         while True:
+            assert self._ws is not None
             try:
                 event = VoiceEvent(await self._ws.recv())
             except websockets.exceptions.ConnectionClosed as e:
                 if await self._handle_disconnection(e):
                     continue
                 else:
-                    logger.info("Reconnection is not allowed. Closing client.")
+                    logger.info("Reconnection is not allowed or failed. Closing client.")
                     return
 
             if event.seq_num:
@@ -410,7 +594,7 @@ class VoiceClient:
                 case VoiceOpCode.HELLO:
                     asyncio.create_task(self._handle_hello(event))
                 case VoiceOpCode.HEARTBEAT_ACK:
-                    logger.log("IN", "VOICE HEARTBEAT ACK")
+                    self._handle_heartbeat_ack(event)
                 case VoiceOpCode.READY:
                     asyncio.create_task(self._handle_ready(event))
                 case VoiceOpCode.SESSION_DESCRIPTION:
@@ -420,32 +604,43 @@ class VoiceClient:
                 case VoiceOpCode.DAVE_MLS_WELCOME:
                     asyncio.create_task(self._handle_dave_mls_welcome(event))
                 case VoiceOpCode.DAVE_EXECUTE_TRANSITION:
-                    self._handle_dave_execute_transition(event)
+                    asyncio.create_task(self._handle_dave_execute_transition(event))
                 case VoiceOpCode.DAVE_MLS_PROPOSALS:
                     asyncio.create_task(self._handle_dave_mls_proposals(event))
                 case VoiceOpCode.DAVE_MLS_ANNOUNCE_COMMIT_TRANSITION:
                     await self._handle_dave_mls_announce_commit_transition(event)
                 case VoiceOpCode.DAVE_PREPARE_TRANSITION:
-                    self._handle_dave_prepare_transition(event)
+                    await self._handle_dave_prepare_transition(event)
                 case VoiceOpCode.DAVE_PREPARE_EPOCH:
                     await self._handle_dave_prepare_epoch(event)
                 case VoiceOpCode.RESUMED:
-                    logger.info("Connection resumed successfully")
+                    asyncio.create_task(self._handle_resumed())
                 case _:
-                    logger.log("IN", f"UNHANDLED VOICE EVENT {event}")
+                    # speaking and client connect/disconnect notices about other users, one per change in busy channels
+                    if logs.sample("unhandled voice event"):
+                        logger.log("IN", "UNHANDLED VOICE EVENT {}", event)
 
     async def _close(self) -> None:
         if self._closed:
             return
-        self._recv_loop.cancel(msg="Close method was called")
-        self._player.cancel(msg="Close method was called")
-        await self._ws.close()
+        self._closed = True
+        # the watchdog and the idle timer close from within their own task, which has to live on to finish closing
+        current = asyncio.current_task()
+        for task in (self._recv_loop, self._join_watchdog, self._player, self._heartbeat_task):
+            if task is not None and task is not current:
+                task.cancel(msg="Close method was called")
+        if self._stream_control is not None:
+            self._stream_control.stop()
+        self._stream_executor.shutdown(wait=False, cancel_futures=True)
+        self._download_executor.shutdown(wait=False, cancel_futures=True)
+        self._queued.clear()
+        if self._ws is not None:
+            await self._ws.close()
         if self._sock is not None:
             self._sock.close()
         await self._on_close()
-        if self._idle_timer is not None:
+        if self._idle_timer is not None and self._idle_timer is not current:
             self._idle_timer.cancel()
-        self._closed = True
 
     async def _disconnect_after_delay(self) -> None:
         logger.info("Idle timer started")
@@ -38,6 +38,8 @@ class VoiceOpCode(Enum):
 
 
 class VoiceEvent:
+    __slots__ = ("_opcode", "_seq_num", "_parsed", "_binary")
+
     _opcode: VoiceOpCode
     _seq_num: int | None
     _parsed: Dict[str, Any]
@@ -70,5 +72,5 @@ class VoiceEvent:
 
     def __str__(self) -> str:
         if self._binary:
-            return f"Opcode: {self.opcode}, Seq: {self.seq_num}, Binary fields: {[k for k in self._parsed.keys() if not k.startswith("_")]}"
+            return f"Opcode: {self.opcode}, Seq: {self.seq_num}, Binary fields: {[k for k in self._parsed.keys() if not k.startswith('_')]}"
         return f"Opcode: {self.opcode}, Seq: {self.seq_num}, Data: {self._parsed}"
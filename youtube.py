@@ -1,5 +1,7 @@
+import asyncio
 import httpx
 import tempfile
+import threading
 import urllib.parse
 import yt_dlp
 import isodate  # type: ignore[import-untyped]
@@ -7,8 +9,11 @@ import isodate  # type: ignore[import-untyped]
 from logs import logger as base_logger
 from config import Config
 from media_file import MediaFile
+from opus import demux, loudness
 from pathlib import Path
 from arguments import args
+from track_index import TrackIndex
+from typing import Any, Dict, Tuple
 
 API_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
 API_INFO_URL = "https://www.googleapis.com/youtube/v3/videos"
@@ -16,7 +21,20 @@ API_INFO_URL = "https://www.googleapis.com/youtube/v3/videos"
 logger = base_logger.bind(context="YoutubeDL")
 SAVE_DIR = Path(tempfile.gettempdir()) / 'meu-chapeu'
 
-_client = httpx.AsyncClient()
+# Both API calls of a /play share one HTTP/2 connection, kept open by keep_warm between commands
+_KEEPALIVE_EXPIRY = 300.0
+_WARM_INTERVAL = 60.0
+_SEARCH_FIELDS = "items(id/videoId,snippet(title,thumbnails/default/url))"
+_VIDEO_FIELDS = "items(snippet(title,thumbnails/default/url),contentDetails/duration)"
+
+_client: httpx.AsyncClient | None = None
+
+_PREFETCH_LIMIT = 32
+_prefetched: Dict[str, asyncio.Task] = {}
+# A speculative download and the download of the same media once it's queued must not write the same file at once.
+# Locks are counted by the downloads holding or waiting for them and dropped once none is left.
+_download_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+_download_locks_lock = threading.Lock()
 
 
 class YoutubeDLLogger:
@@ -44,22 +62,57 @@ YDL_OPTS = {
 ydl = yt_dlp.YoutubeDL(params=YDL_OPTS)  # type: ignore[arg-type]
 
 
-async def video_id_from_search(query: str, config: Config) -> str | None:
+# Created on first use, inside the event loop it belongs to
+def _api_client(config: Config) -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(http2=True,
+                                    headers={"Accept": "application/json"},
+                                    timeout=httpx.Timeout(config.youtube_api_timeout),
+                                    limits=httpx.Limits(max_connections=10, max_keepalive_connections=4, keepalive_expiry=_KEEPALIVE_EXPIRY))
+    return _client
+
+
+# Connection setup is a large share of a cold API call. A request without a key is rejected at once and costs no quota,
+# but opens the connection and keeps it from expiring.
+async def keep_warm(config: Config) -> None:
+    while True:
+        try:
+            await _api_client(config).head(API_INFO_URL)
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not warm up the YouTube API connection: {e!r}")
+        await asyncio.sleep(_WARM_INTERVAL)
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Returns the ID and snippet of the first result, which saves fetching the snippet again with the video details
+async def search(query: str, config: Config) -> Tuple[str, Dict[str, Any]] | None:
     params = {"part": "snippet",
               "type": "video",
+              "maxResults": 1,
+              "fields": _SEARCH_FIELDS,
               "key": config.google_api_token,
               "q": query,
               "regionCode": "BR",
               "relevanceLanguage": "pt"}
-    headers = {"Accept": "application/json"}
     logger.info(f"Searching YouTube for query '{query}'")
-    res = await _client.get(API_SEARCH_URL, headers=headers, params=params)
+    try:
+        res = await _api_client(config).get(API_SEARCH_URL, params=params)
+    except httpx.HTTPError as e:
+        logger.warning(f"YouTube search for '{query}' failed: {e!r}")
+        return None
     if res.status_code == 200:
         results = res.json()["items"]
         if len(results) > 0:
             video_id = results[0]["id"]["videoId"]
             logger.info(f"Found video ID {video_id} for query '{query}'")
-            return video_id
+            return video_id, results[0]["snippet"]
         logger.info(f"Search for '{query}' returned no results")
         return None
     else:
@@ -75,19 +128,43 @@ def youtube_link(video_id: str) -> str:
     return f"https://youtube.com/watch?v={video_id}"
 
 
-def download(video_id: str) -> bool:
+def download(video_id: str, analyze_loudness: bool = False) -> bool:
+    with _download_locks_lock:
+        lock, users = _download_locks.get(video_id, (None, 0))
+        if lock is None:
+            lock = threading.Lock()
+        _download_locks[video_id] = (lock, users + 1)
+    try:
+        with lock:
+            return _download(video_id, analyze_loudness)
+    finally:
+        with _download_locks_lock:
+            lock, users = _download_locks[video_id]
+            if users == 1:
+                del _download_locks[video_id]
+            else:
+                _download_locks[video_id] = (lock, users - 1)
+
+
+def _download(video_id: str, analyze_loudness: bool) -> bool:
     path = file_path(video_id)
     if path.is_file():
         logger.info(f"Video ID {video_id} is already downloaded, skipping download")
-        return True
-
-    logger.info(f"Downloading video ID {video_id}")
-    try:
-        ydl.download([youtube_link(video_id)])
-    except yt_dlp.utils.DownloadError:
-        logger.error(f"Failed to download video ID {video_id}")
-        return False
-    logger.info(f"Downloaded video ID {video_id} successfully")
+    else:
+        logger.info(f"Downloading video ID {video_id}")
+        try:
+            ydl.download([youtube_link(video_id)])
+        except yt_dlp.utils.DownloadError:
+            logger.error(f"Failed to download video ID {video_id}")
+            return False
+        logger.info(f"Downloaded video ID {video_id} successfully")
+        try:
+            demux.build_index(str(path))
+        except (demux.OpusDemuxException, OSError) as e:
+            logger.info(f"Not indexing video ID {video_id} for seeking: {e!r}")
+
+    if analyze_loudness:
+        loudness.analyze_and_store(str(path))
     return True
 
 
@@ -104,42 +181,85 @@ def video_id_from_url(user_query: str) -> str | None:
     return video_id if len(video_id) == 11 else None
 
 
-async def get_video_id(user_query: str, config: Config) -> str | None:
+async def local_video_id(user_query: str, tracks: TrackIndex) -> str | None:
     video_id = video_id_from_url(user_query)
     if video_id is not None:
         logger.info(f"Extracted video ID {video_id} from user query '{user_query}'")
         return video_id
-    return await video_id_from_search(user_query, config)
+    video_id = await tracks.search(user_query)
+    if video_id is not None:
+        logger.info(f"Found video ID {video_id} for query '{user_query}' in the local index")
+    return video_id
 
 
-async def build_media_file(video_id: str, config: Config) -> MediaFile | None:
-    params = {"part": ["snippet", "contentDetails"],
+async def build_media_file(video_id: str, config: Config, snippet: Dict[str, Any] | None = None) -> MediaFile | None:
+    params = {"part": ["contentDetails"] if snippet is not None else ["snippet", "contentDetails"],
+              "fields": _VIDEO_FIELDS,
               "key": config.google_api_token,
               "id": video_id}
-    headers = {"Accept": "application/json"}
     logger.info(f"Fetching metadata for video ID {video_id}")
-    res = await _client.get(API_INFO_URL, headers=headers, params=params)
-    if res.status_code == 200:
-        json = res.json()
-        return MediaFile(id=video_id,
-                         file_path=file_path(video_id),
-                         link=youtube_link(video_id),
-                         title=json["items"][0]["snippet"]["title"],
-                         thumbnail=json["items"][0]["snippet"]["thumbnails"]["default"]["url"],
-                         duration=int(isodate.parse_duration(json["items"][0]["contentDetails"]["duration"]).total_seconds()),
-                         download_fn=lambda: download(video_id))
+    try:
+        res = await _api_client(config).get(API_INFO_URL, params=params)
+    except httpx.HTTPError as e:
+        logger.warning(f"Fetching metadata for video ID {video_id} failed: {e!r}")
+        return None
+    items = res.json()["items"] if res.status_code == 200 else []
+    if items:
+        item = items[0]
+        snippet = snippet if snippet is not None else item["snippet"]
+        return media_file(video_id,
+                          snippet["title"],
+                          snippet["thumbnails"]["default"]["url"],
+                          int(isodate.parse_duration(item["contentDetails"]["duration"]).total_seconds()),
+                          config)
     return None
 
 
-async def get_video_from_user_query(user_query: str, config: Config) -> MediaFile | None:
-    video_id = await get_video_id(user_query, config)
-    if video_id is None:
-        logger.warning(f"Failed to find video for query '{user_query}'")
-        return None
+# Also used to rebuild media restored from a state snapshot, whose metadata is already known
+def media_file(video_id: str, title: str, thumbnail: str, duration: int, config: Config) -> MediaFile:
+    return MediaFile(id=video_id,
+                     file_path=file_path(video_id),
+                     link=youtube_link(video_id),
+                     title=title,
+                     thumbnail=thumbnail,
+                     duration=duration,
+                     download_fn=lambda: download(video_id, config.loudness_normalization))
+
 
+# Started for the top /play autocomplete suggestion, so that by the time the command is submitted the metadata of the
+# media is known and its file is downloaded or on its way. Only the latest prefetches are kept.
+def prefetch(video_id: str, config: Config) -> None:
+    if video_id in _prefetched:
+        return
+    while len(_prefetched) >= _PREFETCH_LIMIT:
+        del _prefetched[next(iter(_prefetched))]
+    _prefetched[video_id] = asyncio.create_task(_prefetch(video_id, config))
+
+
+async def _prefetch(video_id: str, config: Config) -> MediaFile | None:
     media_file = await build_media_file(video_id, config)
+    if media_file is not None and not file_path(video_id).is_file():
+        logger.info(f"Prefetching video ID {video_id}")
+        asyncio.create_task(asyncio.to_thread(download, video_id, config.loudness_normalization))
+    return media_file
+
+
+# One API call for links and local matches, two for searches
+async def get_video_from_user_query(user_query: str, config: Config, tracks: TrackIndex) -> MediaFile | None:
+    video_id, snippet = await local_video_id(user_query, tracks), None
+    if video_id is None:
+        found = await search(user_query, config)
+        if found is None:
+            logger.warning(f"Failed to find video for query '{user_query}'")
+            return None
+        video_id, snippet = found
+
+    prefetched = _prefetched.pop(video_id, None)
+    if prefetched is not None and (media_file := await prefetched) is not None:
+        logger.info(f"Using prefetched metadata for video ID {video_id}")
+        return media_file
+
+    media_file = await build_media_file(video_id, config, snippet)
     if media_file is None:
         logger.error(f"Failed to retrieve data about video ID {video_id} for query '{user_query}'")
-        return None
-
-    return await build_media_file(video_id, config)
+    return media_file